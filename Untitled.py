@@ -4,14 +4,24 @@
 # In[1]:
 
 
+import contextlib
+import copy
+import inspect
+import itertools
 import os
-from collections import OrderedDict, deque, namedtuple
-from typing import List, Tuple
+import queue
+import shutil
+import statistics
+import threading
+import time
+from collections import OrderedDict, defaultdict, deque, namedtuple
+from typing import Iterator, List, Optional, Tuple, Union
 
 import gym
 import numpy as np
 import torch
 from pytorch_lightning import LightningModule, Trainer
+from pytorch_lightning.callbacks import ModelCheckpoint
 from pytorch_lightning.utilities import DistributedType
 from torch import Tensor, nn
 from torch.optim import Adam, Optimizer
@@ -20,6 +30,8 @@ from torch.utils.data.dataset import IterableDataset
 from pytorch_lightning.loggers import TensorBoardLogger
 import csv
 
+from gym_go import features, gogame, govars
+
 PATH_DATASETS = os.environ.get("PATH_DATASETS", ".")
 AVAIL_GPUS = min(1, torch.cuda.device_count())
 print(AVAIL_GPUS)
@@ -59,43 +71,441 @@ class DQN(nn.Module):
 # Named tuple for storing experience steps gathered in training
 Experience = namedtuple(
     "Experience",
-    field_names=["state", "action", "reward", "done", "new_state"],
+    field_names=["state", "action", "reward", "done", "new_state", "valid_moves", "n_steps"],
+    defaults=[None, 1],
 )
 
-class ReplayBuffer:
+class SharedArrays:
+    """Mixin for objects whose state lives in NumPy arrays that can be moved to shared memory.
+
+    After `share_memory`, pickling the object (e.g. passing it to a torch.multiprocessing process) passes the
+    shared tensors behind its arrays, so all processes read and write the same memory.
+    `save_arrays` writes the arrays to .npy files and `load_arrays` maps them back lazily.
+    """
+
+    def share_memory(self) -> None:
+        tensors = {}
+        for name, value in list(vars(self).items()):
+            if isinstance(value, np.ndarray):
+                tensors[name] = torch.from_numpy(value).clone().share_memory_()
+                setattr(self, name, tensors[name].numpy())
+            elif isinstance(value, SharedArrays):
+                value.share_memory()
+        self._shared_tensors = tensors
+
+    def __getstate__(self) -> dict:
+        state = dict(vars(self))
+        state.update(getattr(self, "_shared_tensors", {}))
+        return state
+
+    def __setstate__(self, state: dict) -> None:
+        for name, tensor in state.get("_shared_tensors", {}).items():
+            state[name] = tensor.numpy()
+        vars(self).update(state)
+
+    def save_arrays(self, path: str) -> None:
+        """Writes every array to a .npy file in the directory path, nested SharedArrays to subdirectories."""
+        os.makedirs(path, exist_ok=True)
+        for name, value in vars(self).items():
+            if isinstance(value, SharedArrays):
+                value.save_arrays(os.path.join(path, name))
+            elif isinstance(value, np.ndarray):
+                np.save(os.path.join(path, name + ".npy"), value)
+
+    def load_arrays(self, path: str) -> None:
+        """Maps the arrays written by save_arrays back copy-on-write, so the files are only read as pages are used
+        and the saved files are never modified. Arrays in shared memory are filled in place instead, so all
+        processes sharing them see the contents.
+        """
+        shared = getattr(self, "_shared_tensors", {})
+        for name, value in list(vars(self).items()):
+            if isinstance(value, SharedArrays):
+                value.load_arrays(os.path.join(path, name))
+            elif isinstance(value, np.ndarray):
+                array = np.load(os.path.join(path, name + ".npy"), mmap_mode="c")
+                if array.shape != value.shape or array.dtype != value.dtype:
+                    raise ValueError(f"Saved {name} of shape {array.shape} and dtype {array.dtype} "
+                                     f"does not fit shape {value.shape} and dtype {value.dtype}")
+                if name in shared:
+                    value[...] = array
+                else:
+                    setattr(self, name, array)
+
+
+def _counter(i: int) -> property:
+    """Integer attribute stored in the `counters` array, so it is shared with the arrays"""
+    return property(lambda self: int(self.counters[i]), lambda self, value: self.counters.__setitem__(i, value))
+
+
+class ReplayBuffer(SharedArrays):
     """Replay Buffer for storing past experiences allowing the agent to learn from them.
 
+    Observations are stored once, as frames in a ring array shared by all experiences,
+    and every experience references the frames of its state and next state by id. When experiences are
+    added with frame ids (see `add_frame`), consecutive experiences of an episode share their boards,
+    so every board is stored and copied once. Experiences with array states still work and store both boards.
+
+    The other fields are stored in preallocated arrays, which are written to circularly,
+    so appending and sampling cost O(batch) and never build Python objects.
+    An experience whose state frame was overwritten in the frame ring becomes invalid and is not sampled.
+    Samples are identified by experience ids, which count the experiences ever added (the buffer index of an
+    id is id % capacity), so an experience overwritten since it was sampled can be told apart.
+
+    `share_memory` moves the buffer to shared memory, guarded by a process lock, so actor processes
+    can add experiences while the learner samples.
+
     Args:
-        capacity: size of the buffer
+        capacity: number of experiences
+        obs_size: size of the (flattened) observations
+        n_actions: number of discrete actions, the size of the legal masks
+        obs_dtype: dtype the observations are stored as (they are binary, so float32 is exact)
+        frame_capacity: number of frames, by default 1/8 more than the capacity, which leaves room for the
+            final boards of the episodes
     """
 
-    def __init__(self, capacity: int) -> None:
-        self.buffer = deque(maxlen=capacity)
+    index = _counter(0)
+    size = _counter(1)
+    num_frames = _counter(2)
+    num_valid = _counter(3)
+    num_added = _counter(4)
+
+    def __init__(self, capacity: int, obs_size: int, n_actions: int, obs_dtype=np.float32,
+                 frame_capacity: Optional[int] = None) -> None:
+        self.counters = np.zeros(5, dtype=np.int64)
+        self.lock = None
+        self.capacity = capacity
+        self.frame_capacity = frame_capacity or capacity + capacity // 8 + 1
+        self.frames = np.zeros((self.frame_capacity, obs_size), dtype=obs_dtype)
+        self.frame_valid_moves = np.zeros((self.frame_capacity, n_actions), dtype=bool)
+        # Experience whose state is the frame, -1 if none
+        self.frame_owners = np.full(self.frame_capacity, -1, dtype=np.int64)
+
+        self.state_frames = np.zeros(capacity, dtype=np.int64)
+        self.actions = np.zeros(capacity, dtype=np.int64)
+        self.rewards = np.zeros(capacity, dtype=np.float32)
+        self.dones = np.zeros(capacity, dtype=bool)
+        self.next_frames = np.zeros(capacity, dtype=np.int64)
+        self.n_steps = np.ones(capacity, dtype=np.int64)
+        self.valid = np.zeros(capacity, dtype=bool)
+        self.experience_ids = np.zeros(capacity, dtype=np.int64)
+
+    def __len__(self) -> int:
+        return self.num_valid
+
+    def share_memory(self, ctx=torch.multiprocessing) -> None:
+        super().share_memory()
+        self.lock = ctx.RLock()
+
+    def _locked(self):
+        return self.lock if self.lock is not None else contextlib.nullcontext()
+
+    def save_arrays(self, path: str) -> None:
+        # A consistent snapshot while actors keep adding experiences
+        with self._locked():
+            super().save_arrays(path)
+
+    def add_frames(self, observations: np.ndarray, valid_moves: Optional[np.ndarray] = None) -> np.ndarray:
+        """Stores a batch of observations.
+
+        Args:
+            observations: (B, obs_size) observations
+            valid_moves: (B, n_actions) legal masks of the observations (all moves legal if None)
 
-    def __len__(self) -> None:
-        return len(self.buffer)
+        Returns:
+            the frame ids of the observations
+        """
+        n = len(observations)
+        with self._locked():
+            ids = self.num_frames + np.arange(n)
+            slots = ids % self.frame_capacity
+            self._invalidate(self.frame_owners[slots])
+            self.frame_owners[slots] = -1
+            self.frames[slots] = observations
+            self.frame_valid_moves[slots] = True if valid_moves is None else valid_moves
+            self.num_frames += n
+        return ids
+
+    def add_frame(self, observation: np.ndarray, valid_moves: Optional[np.ndarray] = None) -> int:
+        """Stores an observation, see add_frames"""
+        return int(self.add_frames(observation[np.newaxis],
+                                   None if valid_moves is None else np.asarray(valid_moves)[np.newaxis])[0])
+
+    def _invalidate(self, indices: np.ndarray) -> None:
+        indices = indices[indices >= 0]
+        indices = indices[self.valid[indices]]
+        self.valid[indices] = False
+        self.num_valid -= len(indices)
 
     def append(self, experience: Experience) -> None:
         """Add experience to the buffer.
 
         Args:
-            experience: tuple (state, action, reward, done, new_state)
+            experience: tuple (state, action, reward, done, new_state, valid_moves, n_steps),
+                state and new_state are frame ids or observations,
+                valid_moves is the legal mask of an observation new_state (all moves legal if None),
+                reward is the discounted return of the n_steps steps leading to new_state
         """
-        self.buffer.append(experience)
+        valid_moves = None if experience.valid_moves is None else np.asarray(experience.valid_moves)[np.newaxis]
+        self.extend(np.asarray(experience.state)[np.newaxis], [experience.action], [experience.reward],
+                    [experience.done], np.asarray(experience.new_state)[np.newaxis], valid_moves,
+                    experience.n_steps)
 
-    def sample(self, batch_size: int) -> Tuple:
-        print("Batch Size : ", batch_size)
-        indices = np.random.choice(len(self.buffer), batch_size, replace=False)
-        states, actions, rewards, dones, next_states = zip(*(self.buffer[idx] for idx in indices))
+    def extend(self, states, actions, rewards, dones, next_states, valid_moves=None, n_steps=1) -> np.ndarray:
+        """Add a batch of experiences to the buffer, each argument has the batch as its first dimension.
 
+        states and next_states are either (B,) frame ids or (B, obs_size) observations.
+
+        Returns:
+            the buffer indices of the experiences
+        """
+        with self._locked():
+            states = np.asarray(states)
+            if states.ndim == 1:
+                state_frames, next_frames = states, np.asarray(next_states)
+            else:
+                state_frames = self.add_frames(states)
+                next_frames = self.add_frames(np.asarray(next_states), valid_moves)
+
+            n = len(state_frames)
+            indices = (self.index + np.arange(n)) % self.capacity
+
+            # Release the frames of the overwritten experiences
+            old = indices[self.valid[indices]]
+            old_slots = self.state_frames[old] % self.frame_capacity
+            self.frame_owners[old_slots[self.frame_owners[old_slots] == old]] = -1
+            self._invalidate(old)
+
+            self.state_frames[indices] = state_frames
+            self.actions[indices] = actions
+            self.rewards[indices] = rewards
+            self.dones[indices] = dones
+            self.next_frames[indices] = next_frames
+            self.n_steps[indices] = n_steps
+            self.experience_ids[indices] = self.num_added + np.arange(n)
+            self.num_added += n
+
+            # Experiences are valid while their state frame is in the frame ring
+            live = state_frames >= self.num_frames - self.frame_capacity
+            self.frame_owners[state_frames[live] % self.frame_capacity] = indices[live]
+            self.valid[indices] = live
+            self.num_valid += int(np.count_nonzero(live))
+
+            self.index = (self.index + n) % self.capacity
+            self.size = min(self.size + n, self.capacity)
+        return indices
+
+    def _gather(self, indices: np.ndarray, weights: np.ndarray) -> Tuple:
+        state_slots = self.state_frames[indices] % self.frame_capacity
+        next_slots = self.next_frames[indices] % self.frame_capacity
         return (
-            np.array(states),
-            np.array(actions),
-            np.array(rewards, dtype=np.float32),
-            np.array(dones, dtype=np.bool),
-            np.array(next_states),
+            self.frames[state_slots],
+            self.actions[indices],
+            self.rewards[indices],
+            self.dones[indices],
+            self.frames[next_slots],
+            self.frame_valid_moves[next_slots],
+            self.n_steps[indices],
+            self.experience_ids[indices],
+            weights,
         )
 
+    def sample(self, batch_size: int) -> Tuple:
+        """Uniformly samples a batch of experiences (with replacement).
+
+        Returns:
+            states, actions, rewards, dones, next_states, valid_moves, n_steps arrays,
+            and the experience ids and (uniform) importance-sampling weights of the samples
+        """
+        with self._locked():
+            assert self.num_valid > 0, "Sampling from an empty replay buffer"
+            indices = np.random.randint(0, self.size, size=batch_size)
+            # Redraw the experiences whose frames were overwritten
+            invalid = ~self.valid[indices]
+            while invalid.any():
+                indices[invalid] = np.random.randint(0, self.size, size=np.count_nonzero(invalid))
+                invalid = ~self.valid[indices]
+            return self._gather(indices, np.ones(batch_size, dtype=np.float32))
+
+    def update_priorities(self, ids: np.ndarray, td_errors: np.ndarray) -> None:
+        """Uniform replay has no priorities."""
+
+    def sample_tensors(self, batch_size: int) -> Tuple:
+        """Same as sample, but as torch tensors sharing the memory of the sampled arrays."""
+        return tuple(torch.from_numpy(x) for x in self.sample(batch_size))
+
+
+class NStepWindow:
+    """Assembles n-step experiences from 1-step experiences as they arrive.
+
+    Keeps a window of at most n pending experiences per environment, whose discounted returns are
+    updated with every new reward. An experience is complete after n steps, or when its episode ends,
+    and then bootstraps from the latest new_state. With n_steps=1 experiences pass through unchanged.
+
+    Args:
+        n_steps: maximum number of rewards in a return
+        gamma: discount factor
+    """
+
+    def __init__(self, n_steps: int = 1, gamma: float = 0.99) -> None:
+        self.n_steps = n_steps
+        self.gamma = gamma
+        # env id -> pending [state, action, return, number of rewards]
+        self.pending = defaultdict(deque)
+        self.last = {}
+
+    def push(self, experience: Experience, env_id: int = 0) -> List[Experience]:
+        """Adds the next 1-step experience of an environment.
+
+        Returns:
+            the experiences completed by it
+        """
+        window = self.pending[env_id]
+        window.append([experience.state, experience.action, 0.0, 0])
+        for item in window:
+            item[2] += self.gamma ** item[3] * experience.reward
+            item[3] += 1
+        self.last[env_id] = experience
+
+        if experience.done:
+            return self.flush(env_id)
+        if len(window) == self.n_steps:
+            return [self._complete(window.popleft(), experience)]
+        return []
+
+    def flush(self, env_id: int = 0) -> List[Experience]:
+        """Completes all pending experiences of an environment, e.g. when it is reset before the episode ended."""
+        window = self.pending[env_id]
+        completed = [self._complete(item, self.last[env_id]) for item in window]
+        window.clear()
+        return completed
+
+    @staticmethod
+    def _complete(item: list, last: Experience) -> Experience:
+        state, action, ret, n_steps = item
+        return Experience(state, action, ret, last.done, last.new_state, last.valid_moves, n_steps)
+
+
+class SumTree(SharedArrays):
+    """Binary sum tree stored in a flat array.
+
+    Node i has the children 2i and 2i + 1, the root is node 1 and leaf j is node `leaf_start + j`.
+    Updates and searches work on whole batches of leaves/values, one tree level at a time.
+
+    Args:
+        capacity: number of leaves
+    """
+
+    def __init__(self, capacity: int) -> None:
+        self.leaf_start = 1 << (capacity - 1).bit_length()
+        self.tree = np.zeros(2 * self.leaf_start)
+
+    def total(self) -> float:
+        return self.tree[1]
+
+    def get(self, leaves: np.ndarray) -> np.ndarray:
+        return self.tree[leaves + self.leaf_start]
+
+    def update(self, leaves: np.ndarray, values: np.ndarray) -> None:
+        nodes = np.asarray(leaves) + self.leaf_start
+        if len(nodes) == 0:
+            return
+        self.tree[nodes] = values
+        nodes = np.unique(nodes // 2)
+        while nodes[0] >= 1:
+            self.tree[nodes] = self.tree[2 * nodes] + self.tree[2 * nodes + 1]
+            nodes = np.unique(nodes // 2)
+
+    def find(self, values: np.ndarray) -> np.ndarray:
+        """Returns the leaves whose prefix-sum interval contains each value."""
+        nodes = np.ones(len(values), dtype=np.int64)
+        values = np.array(values, dtype=np.float64)
+        while nodes[0] < self.leaf_start:
+            left = 2 * nodes
+            go_right = values >= self.tree[left]
+            values -= self.tree[left] * go_right
+            nodes = left + go_right
+        return nodes - self.leaf_start
+
+
+class PrioritizedReplayBuffer(ReplayBuffer):
+    """Replay Buffer which samples experiences proportionally to their priority (|TD error| + eps) ** alpha.
+
+    New experiences get the largest priority seen so far. Importance-sampling weights
+    (N * P(i)) ** -beta are normalized by the largest weight of the batch.
+
+    Args:
+        capacity: size of the buffer
+        obs_size: size of the (flattened) observations
+        n_actions: number of discrete actions, the size of the legal masks
+        alpha: how much prioritization is used (0 is uniform)
+        beta: importance-sampling correction (1 is full correction)
+        eps: added to the absolute TD errors so no experience has zero priority
+    """
+
+    def __init__(self, capacity: int, obs_size: int, n_actions: int, alpha: float = 0.6, beta: float = 0.4,
+                 eps: float = 1e-6, obs_dtype=np.float32, frame_capacity: Optional[int] = None) -> None:
+        super().__init__(capacity, obs_size, n_actions, obs_dtype, frame_capacity)
+        self.tree = SumTree(capacity)
+        self.alpha = alpha
+        self.beta = beta
+        self.eps = eps
+        self.priority_stats = np.ones(1)
+
+    @property
+    def max_priority(self) -> float:
+        return float(self.priority_stats[0])
+
+    @max_priority.setter
+    def max_priority(self, value: float) -> None:
+        self.priority_stats[0] = value
+
+    def _invalidate(self, indices: np.ndarray) -> None:
+        super()._invalidate(indices)
+        indices = indices[indices >= 0]
+        if len(indices) > 0:
+            self.tree.update(indices, 0.0)
+
+    def extend(self, states, actions, rewards, dones, next_states, valid_moves=None, n_steps=1) -> np.ndarray:
+        with self._locked():
+            indices = super().extend(states, actions, rewards, dones, next_states, valid_moves, n_steps)
+            self.tree.update(indices, np.where(self.valid[indices], self.max_priority ** self.alpha, 0.0))
+        return indices
+
+    def sample(self, batch_size: int) -> Tuple:
+        """Samples one experience from each of batch_size equal segments of the total priority.
+
+        Invalid experiences have zero priority, a search that still ends on one (through rounding of the sums)
+        is redrawn uniformly over the total priority.
+        """
+        with self._locked():
+            total = self.tree.total()
+            assert total > 0, "Sampling from an empty replay buffer"
+            segments = (np.arange(batch_size) + np.random.random(batch_size)) * (total / batch_size)
+            indices = self.tree.find(segments)
+            empty = self.tree.get(indices) <= 0
+            while empty.any():
+                indices[empty] = self.tree.find(np.random.random(np.count_nonzero(empty)) * total)
+                empty = self.tree.get(indices) <= 0
+
+            probs = self.tree.get(indices) / total
+            weights = (self.size * probs) ** -self.beta
+            weights /= weights.max()
+            return self._gather(indices, weights.astype(np.float32))
+
+    def update_priorities(self, ids: np.ndarray, td_errors: np.ndarray) -> None:
+        """Sets the priorities of sampled experiences from their TD errors.
+
+        Experiences that were invalidated or overwritten since they were sampled keep their priority (zero if
+        invalid), so they are not drawn again with the frames of other boards.
+        """
+        priorities = np.abs(td_errors) + self.eps
+        with self._locked():
+            indices = ids % self.capacity
+            current = self.valid[indices] & (self.experience_ids[indices] == ids)
+            if current.any():
+                self.max_priority = max(self.max_priority, priorities[current].max())
+                self.tree.update(indices[current], priorities[current] ** self.alpha)
+
 
 # In[4]:
 
@@ -103,52 +513,299 @@ class ReplayBuffer:
 class RLDataset(IterableDataset):
     """Iterable Dataset containing the ExperienceBuffer which will be updated with new experiences during training.
 
+    Streams ready-made mini-batches: every batch is freshly sampled from the buffer when it is requested,
+    so it includes the experiences added since the previous batch. Use it with `DataLoader(batch_size=None)`.
+
     Args:
         buffer: replay buffer
-        sample_size: number of experiences to sample at a time
+        batch_size: number of experiences in each batch
+        num_batches: number of batches per iteration (epoch), infinite if None
     """
 
-    def __init__(self, buffer: ReplayBuffer, sample_size: int = 300) -> None:
+    def __init__(self, buffer: ReplayBuffer, batch_size: int = 64, num_batches: Optional[int] = None) -> None:
         self.buffer = buffer
-        self.sample_size = sample_size
+        self.batch_size = batch_size
+        self.num_batches = num_batches
 
-    def __iter__(self) -> Tuple:
-        states, actions, rewards, dones, new_states = self.buffer.sample(self.buffer.__len__() )
-        for i in range(len(dones)):
-            yield states[i], actions[i], rewards[i], dones[i], new_states[i]
+    def __iter__(self) -> Iterator[Tuple[Tensor, ...]]:
+        batches = itertools.count() if self.num_batches is None else range(self.num_batches)
+        for _ in batches:
+            yield self.buffer.sample_tensors(self.batch_size)
 
 
 # In[5]:
 from pathlib import Path
 
 
-def pickFileName():
+def pickFileName(log_dir: str = '/log/trainingvals/'):
     
-    Path("/log/trainingvals/").mkdir(parents=True, exist_ok=True)
+    Path(log_dir).mkdir(parents=True, exist_ok=True)
     
-    files = os.listdir('/log/trainingvals/')
+    files = os.listdir(log_dir)
     
     return '{}.csv'.format(len(files)+1)
 
 
-import random
+class MetricsWriter:
+    """Buffers scalar metrics of the training loop and writes them to CSV and TensorBoard on a background thread.
+
+    Every `log` call writes one row into a preallocated block. A block is handed to the writer thread once it is
+    full or older than flush_interval seconds, and logging continues in a free block. The learner only waits on
+    file IO when all blocks are still queued, which `stats` counts as stalls.
+    Metrics can be logged as tensors (e.g. the detached loss), which are only read on the writer thread,
+    so logging them does not wait for the device.
+
+    Args:
+        path: CSV file, each row holds the step followed by the metrics, None for no CSV
+        names: names of the metrics
+        summary_writer: TensorBoard SummaryWriter the metrics are added to (e.g. TensorBoardLogger.experiment),
+            None for no TensorBoard
+        block_size: rows per block
+        num_blocks: number of preallocated blocks
+        flush_interval: seconds after which a partially filled block is handed to the writer thread
+    """
+
+    def __init__(
+        self,
+        path: Optional[str],
+        names: List[str],
+        summary_writer=None,
+        block_size: int = 1024,
+        num_blocks: int = 4,
+        flush_interval: float = 5.0,
+    ) -> None:
+        self.names = list(names)
+        self.summary_writer = summary_writer
+        self.block_size = block_size
+        self.flush_interval = flush_interval
+
+        self.free_blocks = queue.Queue()
+        for _ in range(num_blocks):
+            self.free_blocks.put(np.zeros((block_size, 1 + len(self.names))))
+        self.full_blocks = queue.Queue()
+        self.block = self.free_blocks.get()
+        self.row = 0
+        # (row, column, tensor) of the metrics of the block logged as tensors
+        self.tensors = []
+
+        self.file = None if path is None else open(path, "w", newline="")
+        self.csv_writer = None if self.file is None else csv.writer(self.file)
+        self.error = None
+
+        self.start_time = self.block_time = time.monotonic()
+        self.first_step = self.last_step = None
+        # Learner side and writer thread side counters
+        self.logged = {"rows": 0, "stalls": 0}
+        self.written = {"rows": 0, "flushes": 0, "seconds": 0.0}
+
+        self.thread = threading.Thread(target=self._run, name="metrics-writer", daemon=True)
+        self.thread.start()
+
+    def log(self, step: int, *values: Union[float, Tensor]) -> None:
+        """Buffers the metrics of a step, in the order of names"""
+        row = self.block[self.row]
+        row[0] = step
+        for column, value in enumerate(values, 1):
+            if isinstance(value, Tensor):
+                self.tensors.append((self.row, column, value))
+            else:
+                row[column] = value
+        self.row += 1
+        if self.first_step is None:
+            self.first_step = step
+        self.last_step = step
+        if self.row == self.block_size or time.monotonic() - self.block_time > self.flush_interval:
+            self._submit()
+
+    def _submit(self) -> None:
+        self.full_blocks.put((self.block, self.row, self.tensors))
+        self.tensors = []
+        self.logged["rows"] += self.row
+        if self.free_blocks.empty():
+            self.logged["stalls"] += 1
+        self.block = self.free_blocks.get()
+        self.row = 0
+        self.block_time = time.monotonic()
+
+    def _run(self) -> None:
+        while True:
+            item = self.full_blocks.get()
+            if item is None:
+                self.full_blocks.task_done()
+                return
+            block, num_rows, tensors = item
+            start = time.perf_counter()
+            try:
+                if self.error is None:
+                    for row, column, tensor in tensors:
+                        block[row, column] = tensor.item()
+                    self._write(block[:num_rows])
+            except Exception as e:
+                self.error = e
+            finally:
+                self.written["rows"] += num_rows
+                self.written["flushes"] += 1
+                self.written["seconds"] += time.perf_counter() - start
+                self.free_blocks.put(block)
+                self.full_blocks.task_done()
+
+    def _write(self, rows: np.ndarray) -> None:
+        if self.csv_writer is not None:
+            self.csv_writer.writerows([int(row[0])] + row[1:] for row in rows.tolist())
+            self.file.flush()
+        if self.summary_writer is not None:
+            for row in rows.tolist():
+                for name, value in zip(self.names, row[1:]):
+                    self.summary_writer.add_scalar(name, value, int(row[0]))
+            stats = self.stats()
+            self.summary_writer.add_scalar("metrics/steps_per_sec", stats["steps_per_sec"], int(rows[-1, 0]))
+
+    def flush(self) -> None:
+        """Hands the buffered rows to the writer thread and waits until they are written."""
+        if self.row > 0:
+            self._submit()
+        self.full_blocks.join()
+        if self.error is not None:
+            raise self.error
+
+    def stats(self) -> dict:
+        """Throughput of the learner and the writer thread."""
+        elapsed = max(time.monotonic() - self.start_time, 1e-9)
+        rows = self.logged["rows"] + self.row
+        steps = 0 if self.first_step is None else self.last_step - self.first_step
+        return {
+            "rows": rows,
+            "rows_per_sec": rows / elapsed,
+            "steps_per_sec": steps / elapsed,
+            "rows_written": self.written["rows"],
+            "flushes": self.written["flushes"],
+            "write_seconds": self.written["seconds"],
+            "pending_blocks": self.full_blocks.qsize(),
+            "stalls": self.logged["stalls"],
+        }
+
+    def close(self) -> None:
+        """Writes the remaining rows and stops the writer thread."""
+        if not self.thread.is_alive():
+            return
+        try:
+            self.flush()
+        finally:
+            self.full_blocks.put(None)
+            self.thread.join()
+            if self.file is not None:
+                self.file.close()
+            if self.summary_writer is not None:
+                self.summary_writer.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+@torch.no_grad()
+def select_actions(
+    net: nn.Module,
+    observations: np.ndarray,
+    valid_moves: np.ndarray,
+    epsilon: float,
+    device: str = "cpu",
+) -> np.ndarray:
+    """Epsilon-greedy actions for a batch of observations with one forward pass of the network.
+
+    Illegal moves are masked with -inf before the argmax, and exploring rows pick a uniformly random legal move.
+
+    Args:
+        net: DQN network
+        observations: (B, obs_size) observations
+        valid_moves: (B, n_actions) legal masks
+        epsilon: probability of taking a random action, per row
+        device: current device
+
+    Returns:
+        (B,) actions
+    """
+    masks = torch.as_tensor(np.asarray(valid_moves), dtype=torch.bool)
+    n = len(masks)
+
+    # Uniformly random legal moves: the argmax of random scores over the legal moves
+    actions = torch.rand(masks.shape).masked_fill(~masks, -1.0).argmax(dim=1)
+    greedy = torch.rand(n) >= epsilon
+    if greedy.any():
+        states = torch.as_tensor(np.asarray(observations)[greedy.numpy()])
+        greedy_masks = masks[greedy]
+        if device not in ["cpu"]:
+            states = states.cuda(device)
+            greedy_masks = greedy_masks.cuda(device)
+        q_values = net(states).masked_fill(~greedy_masks, float("-inf"))
+        actions[greedy] = q_values.argmax(dim=1).cpu()
+    return actions.numpy()
+
+
 class Agent:
-    """Base Agent class handeling the interaction with the environment."""
+    """Base Agent class handeling the interaction with the environment.
+
+    The agent plays black. Like in `VectorActor`, a step is the agent's move and the opponent's reply, and its
+    experience goes from the board before the move to the board after the reply.
+    """
 
-    def __init__(self, env: gym.Env, replay_buffer: ReplayBuffer) -> None:
+    def __init__(self, env: gym.Env, replay_buffer: ReplayBuffer, n_steps: int = 1, gamma: float = 0.99,
+                 opponents: Optional["OpponentPool"] = None) -> None:
         """
         Args:
             env: training environment
             replay_buffer: replay buffer storing experiences
+            n_steps: number of steps of the returns stored in the replay buffer
+            gamma: discount factor of the returns
+            opponents: pool the opponent of every episode is sampled from, a random player if None
         """
         self.env = env
         self.replay_buffer = replay_buffer
+        self.window = NStepWindow(n_steps, gamma)
+        self.opponents = opponents
+        self.opponent_id = None
         self.reset()
-        self.state = self.env.reset()
 
     def reset(self) -> None:
         """Resents the environment and updates the state."""
+        for exp in self.window.flush():
+            self.replay_buffer.append(exp)
         self.state = self.env.reset()
+        # Experiences reference the boards stored once in the replay buffer
+        self.frame = self.replay_buffer.add_frame(self.state, self.env.valid_moves())
+        if self.opponents is not None:
+            self.opponent_id = self.opponents.sample(1)
+
+    def state_dict(self) -> dict:
+        """The current game and the pending n-step experiences, to resume the episode from a checkpoint."""
+        env = self.env.unwrapped
+        return {
+            "env_state": env.state_.copy(),
+            "timestep": env.timestep,
+            "state": self.state,
+            "frame": self.frame,
+            "pending": copy.deepcopy(dict(self.window.pending)),
+            "last": dict(self.window.last),
+            "opponent_id": self.opponent_id,
+        }
+
+    def load_state_dict(self, state_dict: dict) -> None:
+        """Continues the episode saved by state_dict, the frames it references must be in the replay buffer."""
+        env = self.env.unwrapped
+        env.state_ = state_dict["env_state"]
+        env.timestep = state_dict["timestep"]
+        env.done = env.game_ended()
+        env._reward = None
+        env._info = None
+        env.reset_history()
+        self.state = state_dict["state"]
+        self.frame = state_dict["frame"]
+        self.window.pending.clear()
+        self.window.pending.update(copy.deepcopy(state_dict["pending"]))
+        self.window.last = dict(state_dict["last"])
+        self.opponent_id = state_dict["opponent_id"]
 
     def get_action(self, net: nn.Module, epsilon: float, device: str) -> int:
         """Using the given network, decide what action to carry out using an epsilon-greedy policy.
@@ -161,34 +818,16 @@ class Agent:
         Returns:
             action
         """
-        if np.random.random() < epsilon:
-            action = random.choice([i for i, e in enumerate(self.env.valid_moves()) if e == 1])
-            #maybe with high epsilon at the start, replay buffer disproportionately fills up with pass, as pass is always a choice?
-        else:
-            state = torch.tensor([self.state])
-
-            if device not in ["cpu"]:
-                state = state.cuda(device)
-
-            q_values = net(state)
-            print("q_values : ",q_values)
-            #masking invalid actions
-            mask = torch.tensor(self.env.valid_moves(),dtype=torch.float)
-            print("mask : ",mask)
-            if device not in ["cpu"]:
-                mask = mask.cuda(device)
-
-            masked = q_values * mask
-            print("masked : ",masked)
-            if(torch.count_nonzero(masked).item() == 0):
-                print("ALL ZEROS! Picking at random")
-                _, action = torch.max(mask, dim=0)
-            else:
-                _, action = torch.max(masked, dim=1)
-            print("picked : ",action)
-            action = int(action.item())
-            print("action : ",action)
-        return action
+        valid_moves = self.env.valid_moves()
+        actions = select_actions(net, self.state[np.newaxis], valid_moves[np.newaxis], epsilon, device)
+        return int(actions[0])
+
+    def get_reply(self, state: np.ndarray) -> int:
+        """The opponent's move on the board state, after the agent's move."""
+        if self.opponent_id is None:
+            return self.env.uniform_random_action()
+        return int(self.opponents.select_actions(state[np.newaxis], self.env.valid_moves()[np.newaxis],
+                                                 self.opponent_id)[0])
 
     @torch.no_grad()
     def play_step(
@@ -197,7 +836,7 @@ class Agent:
         epsilon: float = 0.0,
         device: str = "cpu",
     ) -> Tuple[float, bool]:
-        """Carries out a single interaction step between the agent and the environment.
+        """Carries out the agent's move and the opponent's reply in the environment.
 
         Args:
             net: DQN network
@@ -205,26 +844,745 @@ class Agent:
             device: current device
 
         Returns:
-            reward, done
+            reward of both moves, done
         """
 
         action = self.get_action(net, epsilon, device)
 
         # do step in the environment
         new_state, reward, done, _ = self.env.step(action)
-        print("done , ",done)
 
-        exp = Experience(self.state, action, reward, done, new_state)
+        # opponent replies
+        if not done:
+            new_state, reply_reward, done, _ = self.env.step(self.get_reply(new_state))
+            reward += reply_reward
+
+        new_frame = self.replay_buffer.add_frame(new_state, self.env.valid_moves())
+        exp = Experience(self.frame, action, reward, done, new_frame)
 
-        self.replay_buffer.append(exp)
+        for n_step_exp in self.window.push(exp):
+            self.replay_buffer.append(n_step_exp)
 
         self.state = new_state
+        self.frame = new_frame
         if done:
-            print("resetting")
             self.reset()
         return reward, done
 
 
+def canonical_observations(observations: np.ndarray) -> np.ndarray:
+    """Flat observations of the player to move as black, the perspective the DQN is trained in.
+
+    Args:
+        observations: (B, 3 * size * size) black, white and turn channels
+    """
+    boards = np.array(observations).reshape(len(observations), 3, -1)
+    white = boards[:, 2, 0] == 1
+    boards[white] = boards[white][:, [1, 0, 2]]
+    boards[white, 2] = 0
+    return boards.reshape(len(observations), -1)
+
+
+def heuristic_actions(observations: np.ndarray, valid_moves: np.ndarray) -> np.ndarray:
+    """Moves of a simple heuristic player: captures the most stones it can, then saves its own stones in atari,
+    and otherwise plays a random legal move.
+
+    Args:
+        observations: (B, 3 * size * size) observations of the boards
+        valid_moves: (B, size * size + 1) legal masks
+    """
+    n = len(observations)
+    board_size = int(round((np.shape(valid_moves)[1] - 1) ** 0.5))
+    states = np.asarray(observations).reshape(n, 3, board_size, board_size)
+    planes = features.batch_liberty_features(states)
+    scores = 2 * planes[:, features.CAPTURE_SIZE] + planes[:, features.THREAT_SIZE]
+    # Passing is the last resort, random noise breaks ties
+    scores = np.concatenate([scores.reshape(n, -1), np.full((n, 1), -1.0)], axis=1)
+    scores += 0.5 * np.random.random(scores.shape)
+    scores[~np.asarray(valid_moves, dtype=bool)] = -np.inf
+    return scores.argmax(axis=1)
+
+
+class OpponentPool(SharedArrays):
+    """Opponents for the agent: frozen snapshots of past networks plus a random and a heuristic player.
+
+    Opponents are sampled per episode. The moves of a batch of boards are selected with one batched call per
+    opponent, a single forward pass for every snapshot. Snapshots see the boards from their own perspective
+    (see `canonical_observations`), and the heuristic player is `heuristic_actions`.
+    `share_memory` moves the snapshots to shared memory, so the snapshots added by the learner reach the actors.
+
+    Args:
+        obs_size: size of the (flattened) observations
+        n_actions: number of discrete actions
+        max_snapshots: number of snapshots kept, the oldest is replaced first
+        random_prob: probability of playing an episode against the random player
+        heuristic_prob: probability of playing an episode against the heuristic player, the other episodes
+            are played against a uniformly sampled snapshot (while there are none, the probabilities of
+            the random and heuristic players are rescaled)
+    """
+
+    RANDOM = 0
+    HEURISTIC = 1
+
+    num_snapshots = _counter(0)
+    next_slot = _counter(1)
+
+    def __init__(self, obs_size: int, n_actions: int, max_snapshots: int = 10, random_prob: float = 0.2,
+                 heuristic_prob: float = 0.2) -> None:
+        self.counters = np.zeros(2, dtype=np.int64)
+        self.random_prob = random_prob
+        self.heuristic_prob = heuristic_prob
+        self.snapshots = [DQN(obs_size, n_actions).eval() for _ in range(max_snapshots)]
+        for snapshot in self.snapshots:
+            snapshot.requires_grad_(False)
+
+    def share_memory(self) -> None:
+        super().share_memory()
+        for snapshot in self.snapshots:
+            snapshot.share_memory()
+
+    def add_snapshot(self, net: nn.Module) -> None:
+        """Freezes a copy of the current weights of the network."""
+        self.snapshots[self.next_slot].load_state_dict(net.state_dict())
+        self.next_slot = (self.next_slot + 1) % len(self.snapshots)
+        self.num_snapshots = min(self.num_snapshots + 1, len(self.snapshots))
+
+    def sample(self, n: int) -> np.ndarray:
+        """Samples the opponents of n episodes.
+
+        Returns:
+            (n,) opponent ids: RANDOM, HEURISTIC or the snapshot slot + 2
+        """
+        num_snapshots = self.num_snapshots
+        other_prob = 1.0 - self.random_prob - self.heuristic_prob if num_snapshots > 0 else 0.0
+        probs = np.array([self.random_prob, self.heuristic_prob] + [other_prob / max(num_snapshots, 1)] * num_snapshots)
+        return np.random.choice(len(probs), size=n, p=probs / probs.sum())
+
+    @torch.no_grad()
+    def select_actions(self, observations: np.ndarray, valid_moves: np.ndarray, opponents: np.ndarray) -> np.ndarray:
+        """Moves of the given opponents on a batch of boards.
+
+        Args:
+            observations: (B, obs_size) observations of the boards, the opponents are to move
+            valid_moves: (B, n_actions) legal masks
+            opponents: (B,) opponent ids, see sample
+
+        Returns:
+            (B,) actions
+        """
+        observations, valid_moves = np.asarray(observations), np.asarray(valid_moves)
+        actions = np.zeros(len(opponents), dtype=np.int64)
+        for opponent in np.unique(opponents):
+            rows = np.nonzero(opponents == opponent)[0]
+            if opponent == self.RANDOM:
+                actions[rows] = select_actions(None, observations[rows], valid_moves[rows], epsilon=1.0)
+            elif opponent == self.HEURISTIC:
+                actions[rows] = heuristic_actions(observations[rows], valid_moves[rows])
+            else:
+                snapshot = self.snapshots[opponent - 2]
+                actions[rows] = select_actions(snapshot, canonical_observations(observations[rows]),
+                                               valid_moves[rows], epsilon=0.0)
+        return actions
+
+
+class VectorActor:
+    """Plays a batch of environments in lockstep against an opponent and stores the experiences.
+
+    The agent's moves for all environments are selected with one forward pass (see `select_actions`),
+    and so are the opponent's replies (see `OpponentPool`).
+    An experience goes from the board before the agent's move to the board after the opponent's reply,
+    with the rewards of both moves.
+
+    Args:
+        envs: environments, the agent plays black
+        replay_buffer: replay buffer storing experiences
+        n_steps: number of steps of the returns stored in the replay buffer
+        gamma: discount factor of the returns
+        opponents: pool the opponent of every episode is sampled from, a random player if None
+    """
+
+    def __init__(self, envs: List[gym.Env], replay_buffer: ReplayBuffer, n_steps: int = 1, gamma: float = 0.99,
+                 opponents: Optional[OpponentPool] = None) -> None:
+        self.envs = envs
+        self.replay_buffer = replay_buffer
+        self.opponents = opponents
+        self.opponent_ids = None if opponents is None else opponents.sample(len(envs))
+        self.window = NStepWindow(n_steps, gamma)
+        self.states = np.stack([env.reset() for env in envs])
+        self.frames = replay_buffer.add_frames(self.states, self.valid_moves())
+        self.episode_rewards = np.zeros(len(envs))
+
+    def valid_moves(self) -> np.ndarray:
+        return np.stack([env.valid_moves() for env in self.envs])
+
+    @torch.no_grad()
+    def play_step(self, net: nn.Module, epsilon: float = 0.0, device: str = "cpu") -> List[float]:
+        """Carries out one agent move and the opponent's reply in every environment.
+
+        Returns:
+            total rewards of the episodes that ended
+        """
+        actions = select_actions(net, self.states, self.valid_moves(), epsilon, device)
+
+        new_states, rewards, dones = [], np.zeros(len(self.envs)), np.zeros(len(self.envs), dtype=bool)
+        for i, (env, action) in enumerate(zip(self.envs, actions)):
+            new_state, rewards[i], dones[i], _ = env.step(action)
+            new_states.append(new_state)
+        new_states = np.stack(new_states)
+
+        # opponent replies
+        replying = np.nonzero(~dones)[0]
+        if self.opponents is None:
+            replies = [self.envs[i].uniform_random_action() for i in replying]
+        else:
+            replies = self.opponents.select_actions(new_states[replying],
+                                                    np.stack([self.envs[i].valid_moves() for i in replying]),
+                                                    self.opponent_ids[replying])
+        for i, reply in zip(replying, replies):
+            new_states[i], reward, dones[i], _ = self.envs[i].step(reply)
+            rewards[i] += reward
+
+        new_frames = self.replay_buffer.add_frames(new_states, self.valid_moves())
+
+        experiences = []
+        for i in range(len(self.envs)):
+            exp = Experience(self.frames[i], actions[i], rewards[i], dones[i], new_frames[i])
+            experiences.extend(self.window.push(exp, env_id=i))
+        if experiences:
+            self.replay_buffer.extend(*map(np.array, zip(*(exp[:5] for exp in experiences))),
+                                      n_steps=np.array([exp.n_steps for exp in experiences]))
+
+        self.states, self.frames = new_states, new_frames
+        self.episode_rewards += rewards
+        finished = self.episode_rewards[dones].tolist()
+        self.episode_rewards[dones] = 0
+        for i in np.nonzero(dones)[0]:
+            self.states[i] = self.envs[i].reset()
+            self.frames[i] = self.replay_buffer.add_frame(self.states[i], self.envs[i].valid_moves())
+        if self.opponents is not None and dones.any():
+            self.opponent_ids[dones] = self.opponents.sample(int(dones.sum()))
+        return finished
+
+
+class InferenceClient:
+    """Handle of one actor on an InferenceServer, callable like the network: `client(states)` returns Q-values.
+
+    The observations are written to the actor's slot of the shared request arrays, and the call blocks until the
+    server has evaluated them in a batch with the requests of the other actors. Pass it to an actor process
+    (e.g. to select_actions) instead of the network.
+    """
+
+    def __init__(self, client_id: int, observations: Tensor, q_values: Tensor, requests, ready) -> None:
+        self.client_id = client_id
+        self.observations = observations
+        self.q_values = q_values
+        self.requests = requests
+        self.ready = ready
+
+    def __call__(self, states: Tensor) -> Tensor:
+        n = len(states)
+        assert n <= self.observations.shape[1], f"{n} observations do not fit the request slot"
+        self.observations[self.client_id, :n] = states
+        self.ready.clear()
+        self.requests.put((self.client_id, n, time.monotonic()))
+        self.ready.wait()
+        return self.q_values[self.client_id, :n].clone()
+
+
+class InferenceServer:
+    """Evaluates the Q-values requested by many actor processes with batched forward passes.
+
+    Requests are collected until max_batch_size observations are waiting, or the oldest request has waited
+    max_latency seconds, and then evaluated with one forward pass. The observations and Q-values are passed
+    through shared arrays with a slot per client, so only (client id, number of rows, time) goes through the
+    request queue. The server runs on a thread of the learner process, and `update_weights` swaps in new
+    weights between batches.
+
+    Args:
+        net: network whose weights the server starts with, the server evaluates a copy of it
+        obs_size: size of the (flattened) observations
+        n_actions: number of discrete actions
+        num_clients: number of clients (actors)
+        max_rows: maximum number of observations per request, e.g. the number of envs per actor
+        max_batch_size: number of observations a batch is evaluated at
+        max_latency: seconds after which the waiting requests are evaluated anyway
+        device: device the network is evaluated on
+        ctx: multiprocessing context of the clients
+    """
+
+    def __init__(
+        self,
+        net: nn.Module,
+        obs_size: int,
+        n_actions: int,
+        num_clients: int,
+        max_rows: int,
+        max_batch_size: int = 256,
+        max_latency: float = 0.002,
+        device: str = "cpu",
+        ctx=torch.multiprocessing,
+    ) -> None:
+        self.net = copy.deepcopy(net).to(device).eval()
+        self.device = device
+        self.max_batch_size = max_batch_size
+        self.max_latency = max_latency
+        self.observations = torch.zeros(num_clients, max_rows, obs_size).share_memory_()
+        self.q_values = torch.zeros(num_clients, max_rows, n_actions).share_memory_()
+        self.requests = ctx.Queue()
+        self.ready = [ctx.Event() for _ in range(num_clients)]
+        self.weights_lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.thread = None
+        self.counters = defaultdict(float)
+
+    def client(self, client_id: int) -> InferenceClient:
+        return InferenceClient(client_id, self.observations, self.q_values, self.requests, self.ready[client_id])
+
+    def update_weights(self, net: nn.Module) -> None:
+        """Copies the weights of the network, the batch being evaluated finishes with the previous weights."""
+        with self.weights_lock:
+            self.net.load_state_dict(net.state_dict())
+
+    def start(self) -> None:
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self._run, name="inference-server", daemon=True)
+        self.thread.start()
+
+    def stop(self) -> None:
+        if self.thread is not None:
+            self.stop_event.set()
+            self.thread.join()
+            self.thread = None
+
+    def _collect(self) -> List[Tuple[int, int, float]]:
+        """Waits for a batch of requests, an empty list if there were none for 0.1 seconds."""
+        try:
+            batch = [self.requests.get(timeout=0.1)]
+        except queue.Empty:
+            return []
+        rows = batch[0][1]
+        deadline = batch[0][2] + self.max_latency
+        while rows < self.max_batch_size:
+            timeout = deadline - time.monotonic()
+            try:
+                request = self.requests.get(timeout=timeout) if timeout > 0 else self.requests.get_nowait()
+            except queue.Empty:
+                break
+            batch.append(request)
+            rows += request[1]
+        return batch
+
+    @torch.no_grad()
+    def _run(self) -> None:
+        while not self.stop_event.is_set():
+            batch = self._collect()
+            if not batch:
+                continue
+            start = time.monotonic()
+            states = torch.cat([self.observations[client_id, :n] for client_id, n, _ in batch])
+            with self.weights_lock:
+                q_values = self.net(states.to(self.device)).cpu()
+            offset = 0
+            for client_id, n, _ in batch:
+                self.q_values[client_id, :n] = q_values[offset:offset + n]
+                offset += n
+                self.ready[client_id].set()
+
+            latencies = [start - request_time for _, _, request_time in batch]
+            self.counters["batches"] += 1
+            self.counters["requests"] += len(batch)
+            self.counters["rows"] += len(states)
+            self.counters["queue_seconds"] += sum(latencies)
+            self.counters["max_queue_seconds"] = max(self.counters["max_queue_seconds"], max(latencies))
+            self.counters["forward_seconds"] += time.monotonic() - start
+
+    def stats(self) -> dict:
+        """Batch fill (observations per batch / max_batch_size) and queue latency of the requests."""
+        batches = max(self.counters["batches"], 1)
+        requests = max(self.counters["requests"], 1)
+        return {
+            "batches": int(self.counters["batches"]),
+            "requests": int(self.counters["requests"]),
+            "rows_per_batch": self.counters["rows"] / batches,
+            "batch_fill": self.counters["rows"] / batches / self.max_batch_size,
+            "mean_queue_seconds": self.counters["queue_seconds"] / requests,
+            "max_queue_seconds": self.counters["max_queue_seconds"],
+            "mean_forward_seconds": self.counters["forward_seconds"] / batches,
+        }
+
+
+def run_actor(
+    actor_id: int,
+    replay_buffer: ReplayBuffer,
+    shared_net: Union[nn.Module, InferenceClient],
+    epsilon: "multiprocessing.Value",
+    last_reward: "multiprocessing.Value",
+    stop: "multiprocessing.Event",
+    env_kwargs: dict,
+    num_envs: int = 16,
+    n_steps: int = 1,
+    gamma: float = 0.99,
+    opponents: Optional[OpponentPool] = None,
+    sync_interval: int = 10,
+) -> None:
+    """Actor process: plays vector environments with a local copy of the shared network, which is refreshed
+    every sync_interval steps, and streams the experiences into the shared replay buffer until stopped.
+    If shared_net is an InferenceClient, the moves are evaluated by the inference server instead.
+    """
+    torch.set_num_threads(1)
+    np.random.seed(actor_id)
+    torch.manual_seed(actor_id)
+    local_copy = not isinstance(shared_net, InferenceClient)
+    net = copy.deepcopy(shared_net) if local_copy else shared_net
+    envs = [gym.make("gym_go:go-v1", **env_kwargs) for _ in range(num_envs)]
+    actor = VectorActor(envs, replay_buffer, n_steps, gamma, opponents)
+    step = 0
+    while not stop.is_set():
+        if local_copy and step % sync_interval == 0:
+            net.load_state_dict(shared_net.state_dict())
+        for reward in actor.play_step(net, epsilon.value):
+            last_reward.value = reward
+        step += 1
+
+
+def random_transitions(
+    num_transitions: int,
+    board_size: int,
+    komi: float = 0.0,
+    num_boards: int = 256,
+    max_moves: Optional[int] = None,
+    n_steps: int = 1,
+    gamma: float = 0.99,
+    seed: Optional[int] = None,
+    backend: Optional[str] = None,
+) -> Tuple[np.ndarray, ...]:
+    """Plays random games on a batch of boards with the batched engine and records the agent's (black's) experiences.
+
+    Follows the environment rules of the actors: the agent and the opponent both play uniformly random legal
+    moves, a game is cut off after max_moves moves, and the reward is the result in black's perspective
+    (see GoEnv.reward). Every board is recorded once, as a frame, and the experiences reference their frames.
+    At most num_transitions // 64 games are played in lockstep, so every board plays several games and
+    the experiences are not skewed towards the openings.
+
+    Args:
+        num_transitions: number of experiences
+        board_size: size of the boards
+        komi: komi of the results
+        num_boards: maximum number of games played in lockstep
+        max_moves: moves (of both players) after which a game is cut off, no limit if None
+        n_steps: number of steps of the returns
+        gamma: discount factor of the returns
+        seed: seed of the random moves
+        backend: rule engine backend (see gym_go.backends)
+
+    Returns:
+        frames, frame_valid_moves, and the state_frames, actions, rewards, dones, next_frames and n_steps of the
+        experiences, with frame references indexing frames
+    """
+    rng = np.random.default_rng(seed)
+    num_boards = max(1, min(num_boards, num_transitions // 64))
+    window = NStepWindow(n_steps, gamma)
+    frames, frame_valid_moves, experiences = [], [], []
+    num_frames = 0
+
+    def add_frames(batch_states: np.ndarray) -> np.ndarray:
+        nonlocal num_frames
+        frames.append(batch_states[:, :govars.TURN_CHNL + 1].reshape(len(batch_states), -1).astype(np.float32))
+        frame_valid_moves.append(gogame.batch_valid_moves(batch_states).astype(bool))
+        num_frames += len(batch_states)
+        return num_frames - len(batch_states) + np.arange(len(batch_states))
+
+    def random_moves(batch_states: np.ndarray) -> np.ndarray:
+        valid_moves = gogame.batch_valid_moves(batch_states) > 0
+        return np.where(valid_moves, rng.random(valid_moves.shape), -1.0).argmax(axis=1)
+
+    def play(rows: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Plays a random move on the given boards, returns the actions, rewards and whether the games are over"""
+        actions = random_moves(batch_states[rows])
+        batch_states[rows] = gogame.batch_next_states(batch_states[rows], actions, backend=backend)
+        num_moves[rows] += 1
+        ended = gogame.batch_game_ended(batch_states[rows]) > 0
+        # Only the finished games are scored
+        rewards = np.zeros(len(rows))
+        if ended.any():
+            rewards[ended] = gogame.batch_winning(batch_states[rows[ended]], komi)
+        if max_moves is not None:
+            ended |= num_moves[rows] >= max_moves
+        return actions, rewards, ended
+
+    batch_states = gogame.batch_init_state(num_boards, board_size)
+    num_moves = np.zeros(num_boards, dtype=np.int64)
+    state_frames = add_frames(batch_states)
+    all_boards = np.arange(num_boards)
+    while len(experiences) < num_transitions:
+        actions, rewards, dones = play(all_boards)
+
+        # opponent replies, unless every game ended on the agent's move
+        replying = all_boards[~dones]
+        if len(replying) > 0:
+            _, reply_rewards, reply_dones = play(replying)
+            rewards[replying] += reply_rewards
+            dones[replying] = reply_dones
+
+        next_frames = add_frames(batch_states)
+        for i in all_boards:
+            experiences.extend(window.push(
+                Experience(state_frames[i], actions[i], rewards[i], dones[i], next_frames[i]), env_id=i))
+
+        state_frames = next_frames
+        if dones.any():
+            batch_states[dones] = gogame.batch_init_state(int(dones.sum()), board_size)
+            num_moves[dones] = 0
+            state_frames[dones] = add_frames(batch_states[dones])
+
+    experiences = experiences[:num_transitions]
+    state_frames = np.array([exp.state for exp in experiences], dtype=np.int64)
+    next_frames = np.array([exp.new_state for exp in experiences], dtype=np.int64)
+    # Only the frames of the experiences are kept, e.g. not the boards of the games still in progress
+    used = np.unique(np.concatenate([state_frames, next_frames]))
+    return (
+        np.concatenate(frames)[used],
+        np.concatenate(frame_valid_moves)[used],
+        np.searchsorted(used, state_frames),
+        np.array([exp.action for exp in experiences], dtype=np.int64),
+        np.array([exp.reward for exp in experiences], dtype=np.float32),
+        np.array([exp.done for exp in experiences], dtype=bool),
+        np.searchsorted(used, next_frames),
+        np.array([exp.n_steps for exp in experiences], dtype=np.int64),
+    )
+
+
+def _random_transitions(kwargs: dict) -> Tuple[np.ndarray, ...]:
+    torch.set_num_threads(1)
+    return random_transitions(**kwargs)
+
+
+def warm_start(
+    replay_buffer: ReplayBuffer,
+    num_transitions: int,
+    board_size: int,
+    num_workers: int = 0,
+    **kwargs,
+) -> int:
+    """Fills the replay buffer with random-play experiences generated by random_transitions.
+
+    The experiences are split evenly between num_workers processes, which generate them in parallel
+    (in this process if 0). The experiences of every process are added to the buffer with one add_frames and
+    one extend call.
+
+    Args:
+        replay_buffer: replay buffer the experiences are added to
+        num_transitions: number of experiences
+        board_size: size of the boards
+        num_workers: number of worker processes
+        kwargs: other arguments of random_transitions
+
+    Returns:
+        number of experiences added
+    """
+    num_chunks = max(num_workers, 1)
+    chunks = [dict(kwargs, num_transitions=len(part), board_size=board_size,
+                   seed=None if kwargs.get("seed") is None else kwargs["seed"] + i)
+              for i, part in enumerate(np.array_split(np.arange(num_transitions), num_chunks)) if len(part) > 0]
+
+    def add(chunk: Tuple[np.ndarray, ...]) -> int:
+        frames, frame_valid_moves, state_frames, actions, rewards, dones, next_frames, n_steps = chunk
+        ids = replay_buffer.add_frames(frames, frame_valid_moves)
+        replay_buffer.extend(ids[state_frames], actions, rewards, dones, ids[next_frames], n_steps=n_steps)
+        return len(actions)
+
+    if num_workers == 0:
+        return sum(add(random_transitions(**chunk)) for chunk in chunks)
+    ctx = torch.multiprocessing.get_context("spawn")
+    with ctx.Pool(num_workers) as pool:
+        return sum(add(chunk) for chunk in pool.imap_unordered(_random_transitions, chunks))
+
+
+# Result of an arena match, in the perspective of the first policy
+ArenaResult = namedtuple(
+    "ArenaResult",
+    field_names=["games", "wins", "draws", "losses", "score", "score_low", "score_high", "elo", "elo_low", "elo_high",
+                 "significant"],
+)
+
+
+def load_policy(path: str) -> nn.Module:
+    """The network of a DQNLightning checkpoint."""
+    # The checkpoint also holds the agent state (numpy arrays), which torch >= 2 refuses to load by default
+    load_kwargs = {"weights_only": False} if "weights_only" in inspect.signature(torch.load).parameters else {}
+    state_dict = torch.load(path, map_location="cpu", **load_kwargs)["state_dict"]
+    weights = {name[len("net."):]: value for name, value in state_dict.items() if name.startswith("net.")}
+    hidden_size, obs_size = weights["net.0.weight"].shape
+    net = DQN(obs_size, weights["net.4.weight"].shape[0], hidden_size)
+    net.load_state_dict(weights)
+    return net.eval()
+
+
+@torch.no_grad()
+def policy_actions(policy, observations: np.ndarray, valid_moves: np.ndarray) -> np.ndarray:
+    """Moves of a policy for a batch of boards.
+
+    Args:
+        policy: "random", "heuristic" (see heuristic_actions) or a network, which plays greedily from the
+            perspective of the player to move (see canonical_observations)
+        observations: (B, 3 * size * size) observations of the boards
+        valid_moves: (B, size * size + 1) legal masks
+    """
+    if isinstance(policy, str):
+        if policy == "random":
+            return select_actions(None, observations, valid_moves, epsilon=1.0)
+        if policy == "heuristic":
+            return heuristic_actions(observations, valid_moves)
+        raise ValueError(f"Unknown policy {policy}")
+    return select_actions(policy, canonical_observations(observations), valid_moves, epsilon=0.0)
+
+
+def play_games(
+    policy_a,
+    policy_b,
+    num_games: int,
+    board_size: int,
+    komi: float = 0.0,
+    max_moves: Optional[int] = None,
+    seed: Optional[int] = None,
+    backend: Optional[str] = None,
+) -> np.ndarray:
+    """Plays games between two policies on a batch of boards in lockstep, policy_a plays black in the even games.
+
+    The moves of each policy are selected for all boards it is to move on at once (see policy_actions).
+    Games cut off after max_moves moves are scored as they stand.
+
+    Returns:
+        (num_games,) results in the perspective of policy_a, 1 win, 0 draw, -1 loss
+    """
+    if seed is not None:
+        np.random.seed(seed)
+        torch.manual_seed(seed)
+    batch_states = gogame.batch_init_state(num_games, board_size)
+    a_black = np.arange(num_games) % 2 == 0
+    num_moves = 0
+    playing = np.arange(num_games)
+    while len(playing) > 0:
+        states = batch_states[playing]
+        observations = states[:, :govars.TURN_CHNL + 1].reshape(len(playing), -1).astype(np.float32)
+        valid_moves = gogame.batch_valid_moves(states)
+        a_to_move = (gogame.batch_turn(states) == govars.BLACK) == a_black[playing]
+        actions = np.zeros(len(playing), dtype=np.int64)
+        for policy, rows in [(policy_a, a_to_move), (policy_b, ~a_to_move)]:
+            if rows.any():
+                actions[rows] = policy_actions(policy, observations[rows], valid_moves[rows])
+        batch_states[playing] = gogame.batch_next_states(states, actions, backend=backend)
+        num_moves += 1
+        ended = gogame.batch_game_ended(batch_states[playing]) > 0
+        if max_moves is not None and num_moves >= max_moves:
+            ended[:] = True
+        playing = playing[~ended]
+
+    black_results = gogame.batch_winning(batch_states, komi)
+    return np.where(a_black, black_results, -black_results).astype(np.int64)
+
+
+def _play_games(kwargs: dict) -> np.ndarray:
+    torch.set_num_threads(1)
+    return play_games(**kwargs)
+
+
+def arena_result(results: np.ndarray, confidence: float = 0.95) -> ArenaResult:
+    """Win rate and Elo difference of game results, with Wilson score confidence intervals (draws score 1/2).
+
+    No games give an even score with the widest intervals, which is never significant.
+    """
+    games = len(results)
+    wins, draws = int(np.sum(results > 0)), int(np.sum(results == 0))
+
+    def elo(p: float) -> float:
+        p = min(max(p, 1e-6), 1 - 1e-6)
+        return -400 * np.log10(1 / p - 1)
+
+    if games == 0:
+        return ArenaResult(0, 0, 0, 0, 0.5, 0.0, 1.0, 0.0, elo(0.0), elo(1.0), False)
+    score = (wins + 0.5 * draws) / games
+    z = statistics.NormalDist().inv_cdf(0.5 + confidence / 2)
+    center = (score + z ** 2 / (2 * games)) / (1 + z ** 2 / games)
+    margin = z / (1 + z ** 2 / games) * np.sqrt(score * (1 - score) / games + z ** 2 / (4 * games ** 2))
+    low, high = max(center - margin, 0.0), min(center + margin, 1.0)
+    return ArenaResult(games, wins, draws, games - wins - draws, score, low, high, elo(score), elo(low), elo(high),
+                       low > 0.5 or high < 0.5)
+
+
+def arena(
+    policy_a,
+    policy_b,
+    num_games: int,
+    board_size: int,
+    komi: float = 0.0,
+    max_moves: Optional[int] = None,
+    num_boards: int = 64,
+    num_workers: int = 0,
+    confidence: float = 0.95,
+    min_games: int = 64,
+    seed: Optional[int] = None,
+    backend: Optional[str] = None,
+) -> ArenaResult:
+    """Plays up to num_games games between two policies, alternating colours, and stops early once the win rate
+    of policy_a differs from 1/2 with the given confidence.
+
+    The games are played in rounds of num_boards games in lockstep per worker process (in this process if
+    num_workers is 0). Significance is checked after every round, once min_games games are played. Since every
+    check is another chance of a false positive, each is made at confidence 1 - (1 - confidence) / K for the K
+    planned checks (Bonferroni correction), and so are the intervals of the result: when the policies are equally
+    strong, the chance of any significant result over the whole match is at most 1 - confidence. A checkpoint
+    is gated by requiring a significant result with a score above 1/2.
+
+    Args:
+        policy_a: "random", "heuristic" or a network (e.g. a snapshot, or load_policy of a checkpoint)
+        policy_b: the other policy
+        num_games: maximum number of games
+        board_size: size of the boards
+        komi: komi of the results
+        max_moves: moves (of both players) after which a game is scored as it stands, no limit if None
+        num_boards: number of games a worker plays in lockstep
+        num_workers: number of worker processes
+        confidence: confidence level of the match, i.e. one minus its family-wise false positive rate
+        min_games: number of games played before stopping early
+        seed: seed of the random moves, each round uses seed + round
+        backend: rule engine backend (see gym_go.backends)
+
+    Returns:
+        ArenaResult in the perspective of policy_a
+    """
+    # Networks are evaluated on the CPU, in this process or in the workers
+    policy_a, policy_b = [policy if isinstance(policy, str) else copy.deepcopy(policy).cpu().eval()
+                          for policy in (policy_a, policy_b)]
+
+    # Even rounds, so both policies play black equally often
+    num_boards += num_boards % 2
+
+    def rounds() -> Iterator[dict]:
+        for i, start in enumerate(range(0, num_games, num_boards)):
+            yield dict(policy_a=policy_a, policy_b=policy_b, num_games=min(num_boards, num_games - start),
+                       board_size=board_size, komi=komi, max_moves=max_moves,
+                       seed=None if seed is None else seed + i, backend=backend)
+
+    # Bonferroni correction over the checks after the rounds that end with at least min_games games
+    round_ends = np.minimum(np.arange(num_boards, num_games + num_boards, num_boards), num_games)
+    num_checks = max(int(np.sum(round_ends >= min_games)), 1)
+    confidence = 1 - (1 - confidence) / num_checks
+
+    results = np.zeros(0, dtype=np.int64)
+    pool = None if num_workers == 0 else torch.multiprocessing.get_context("spawn").Pool(num_workers)
+    try:
+        round_results = map(_play_games, rounds()) if pool is None else pool.imap(_play_games, rounds())
+        for round_result in round_results:
+            results = np.concatenate([results, round_result])
+            if len(results) >= min_games and arena_result(results, confidence).significant:
+                break
+    finally:
+        if pool is not None:
+            pool.terminate()
+    return arena_result(results, confidence)
+
+
 # In[6]:
 
 
@@ -245,6 +1603,35 @@ class DQNLightning(LightningModule):
         eps_end: float = 0.01,
         episode_length: int = 200,
         warm_start_steps: int = 1,
+        warm_start_workers: int = 0,
+        warm_start_boards: int = 256,
+        warm_start_backend: Optional[str] = None,
+        batches_per_epoch: int = 200,
+        prioritized: bool = False,
+        priority_alpha: float = 0.6,
+        priority_beta: float = 0.4,
+        priority_beta_frames: int = 10000,
+        n_steps: int = 1,
+        num_actors: int = 0,
+        envs_per_actor: int = 16,
+        actor_sync_rate: int = 50,
+        inference_server: bool = False,
+        inference_batch_size: int = 256,
+        inference_max_latency: float = 0.002,
+        snapshot_rate: int = 0,
+        max_snapshots: int = 10,
+        opponent_random_prob: float = 0.2,
+        opponent_heuristic_prob: float = 0.2,
+        metrics_dir: str = "/log/trainingvals/",
+        metrics_block_size: int = 1024,
+        metrics_flush_interval: float = 5.0,
+        checkpoint_dir: str = "/log/checkpoints/",
+        checkpoint_rate: int = 1000,
+        eval_rate: int = 0,
+        eval_games: int = 400,
+        eval_opponent: str = "random",
+        eval_workers: int = 0,
+        eval_backend: Optional[str] = None,
     ) -> None:
         """
         Args:
@@ -254,29 +1641,213 @@ class DQNLightning(LightningModule):
             gamma: discount factor
             sync_rate: how many frames do we update the target network
             replay_size: capacity of the replay buffer
-            warm_start_size: how many samples do we use to fill our buffer at the start of training
+            warm_start_size: how many samples do we use to fill our buffer at the start of training,
+                generated with batched random games (see warm_start)
             eps_last_frame: what frame should epsilon stop decaying
             eps_start: starting value of epsilon
             eps_end: final value of epsilon
             episode_length: max length of an episode
             warm_start_steps: max episode reward in the environment
+            warm_start_workers: number of processes generating the warm start samples, 0 to generate them in
+                this process
+            warm_start_boards: number of games each warm start process plays in lockstep
+            warm_start_backend: rule engine backend of the warm start games (see gym_go.backends), None for
+                the reference engine, "numba" is much faster when numba is installed
+            batches_per_epoch: number of mini-batches sampled from the replay buffer per epoch
+            prioritized: whether to use prioritized experience replay
+            priority_alpha: how much prioritization is used (0 is uniform)
+            priority_beta: initial importance-sampling correction, annealed to 1
+            priority_beta_frames: what frame should the importance-sampling correction reach 1
+            n_steps: number of steps of the returns the targets are computed from
+            num_actors: number of actor processes generating experiences while the network learns,
+                if 0 the agent plays one move before every training step instead
+            envs_per_actor: number of environments each actor plays in lockstep
+            actor_sync_rate: how many frames do we update the network of the actors
+            inference_server: whether the actors' moves are evaluated in batches by an inference server on the
+                learner instead of by the actors' copies of the network
+            inference_batch_size: number of observations the inference server evaluates at once
+            inference_max_latency: seconds after which the inference server evaluates the waiting requests anyway
+            snapshot_rate: how many frames do we add a snapshot of the network to the opponent pool,
+                if 0 the opponent always plays random
+            max_snapshots: number of snapshots in the opponent pool
+            opponent_random_prob: probability of an episode against the random player of the opponent pool
+            opponent_heuristic_prob: probability of an episode against the heuristic player of the opponent pool
+            metrics_dir: directory of the numbered CSV files of the training metrics
+            metrics_block_size: number of steps of metrics buffered before they are written
+            metrics_flush_interval: seconds after which buffered metrics are written anyway
+            checkpoint_dir: directory of the checkpoints and the replay buffer snapshots
+            checkpoint_rate: how many frames do we save a checkpoint
+            eval_rate: how many frames do we play the network against eval_opponent in the arena, 0 for never
+            eval_games: maximum number of arena games per evaluation, fewer once the result is significant
+            eval_opponent: "random", "heuristic" or the path of a checkpoint whose network is the opponent
+            eval_workers: number of processes playing the arena games, 0 to play them in this process
+            eval_backend: rule engine backend of the arena games (see gym_go.backends), None for the reference
+                engine
         """
         super().__init__()
         self.save_hyperparameters()
 
-        self.env = gym.make('gym_go:go-v1', size=5, komi=6.5)
+        self.env_kwargs = {"size": 5, "komi": 6.5}
+        self.env = gym.make('gym_go:go-v1', **self.env_kwargs)
         obs_size = self.env.observation_space.shape[0]
         n_actions = self.env.action_space.n
 
         self.net = DQN(obs_size, n_actions)
         self.target_net = DQN(obs_size, n_actions)
 
-        self.buffer = ReplayBuffer(self.hparams.replay_size)
-        self.agent = Agent(self.env, self.buffer)
+        if self.hparams.prioritized:
+            self.buffer = PrioritizedReplayBuffer(self.hparams.replay_size, obs_size, n_actions,
+                                                  self.hparams.priority_alpha, self.hparams.priority_beta)
+        else:
+            self.buffer = ReplayBuffer(self.hparams.replay_size, obs_size, n_actions)
+        self.opponents = None
+        if self.hparams.snapshot_rate > 0:
+            self.opponents = OpponentPool(obs_size, n_actions, self.hparams.max_snapshots,
+                                          self.hparams.opponent_random_prob, self.hparams.opponent_heuristic_prob)
+        self.agent = Agent(self.env, self.buffer, self.hparams.n_steps, self.hparams.gamma, self.opponents)
         self.total_reward = 0
         self.episode_reward = 0
+        self.metrics = None
+        if self.hparams.warm_start_size > 0:
+            start = time.time()
+            num_added = warm_start(
+                self.buffer,
+                self.hparams.warm_start_size,
+                self.env_kwargs["size"],
+                num_workers=self.hparams.warm_start_workers,
+                komi=self.env_kwargs["komi"],
+                num_boards=self.hparams.warm_start_boards,
+                max_moves=self.env.spec.max_episode_steps,
+                n_steps=self.hparams.n_steps,
+                gamma=self.hparams.gamma,
+                backend=self.hparams.warm_start_backend,
+            )
+            print(f"Warm start: {num_added} samples in {time.time() - start:.1f} SEC")
         self.populate(self.hparams.warm_start_steps)
 
+        self.actors = []
+        self.inference = None
+        if self.hparams.num_actors > 0:
+            ctx = torch.multiprocessing.get_context("spawn")
+            self.buffer.share_memory(ctx)
+            if self.opponents is not None:
+                self.opponents.share_memory()
+            # CPU copy of the network the actors refresh their own copies from
+            self.actor_net = copy.deepcopy(self.net).cpu().share_memory()
+            self.actor_epsilon = ctx.Value("d", self.hparams.eps_start)
+            self.actor_reward = ctx.Value("d", 0.0)
+            self.actor_stop = ctx.Event()
+            self.actor_ctx = ctx
+
+    def on_train_start(self) -> None:
+        """Opens the metrics writer, starts the inference server and the actor processes and waits until the replay
+        buffer holds a batch.
+        """
+        summary_writer = self.logger.experiment if isinstance(self.logger, TensorBoardLogger) else None
+        self.metrics = MetricsWriter(
+            os.path.join(self.hparams.metrics_dir, pickFileName(self.hparams.metrics_dir)),
+            ["total_reward", "train_loss", "reward"],
+            summary_writer,
+            block_size=self.hparams.metrics_block_size,
+            flush_interval=self.hparams.metrics_flush_interval,
+        )
+        if self.hparams.num_actors > 0 and self.hparams.inference_server:
+            self.inference = InferenceServer(
+                self.net,
+                self.env.observation_space.shape[0],
+                self.env.action_space.n,
+                self.hparams.num_actors,
+                self.hparams.envs_per_actor,
+                max_batch_size=self.hparams.inference_batch_size,
+                max_latency=self.hparams.inference_max_latency,
+                device=self.device,
+                ctx=self.actor_ctx,
+            )
+            self.inference.start()
+        for actor_id in range(self.hparams.num_actors):
+            net = self.actor_net if self.inference is None else self.inference.client(actor_id)
+            actor = self.actor_ctx.Process(
+                target=run_actor,
+                args=(actor_id, self.buffer, net, self.actor_epsilon, self.actor_reward, self.actor_stop,
+                      self.env_kwargs, self.hparams.envs_per_actor, self.hparams.n_steps, self.hparams.gamma,
+                      self.opponents),
+                daemon=True,
+            )
+            actor.start()
+            self.actors.append(actor)
+        if self.actors:
+            # The network may have been restored from a checkpoint
+            self.actor_net.load_state_dict(self.net.state_dict())
+        while self.actors and len(self.buffer) < self.hparams.batch_size:
+            time.sleep(0.1)
+
+    def on_train_end(self) -> None:
+        """Stops the actor processes and the inference server and writes the remaining metrics."""
+        if self.metrics is not None:
+            self.metrics.close()
+            print("Metrics:", self.metrics.stats())
+        if self.actors:
+            self.actor_stop.set()
+            for actor in self.actors:
+                actor.join()
+            self.actors = []
+        if self.inference is not None:
+            # Stopped after the actors, which may be waiting for their last moves
+            self.inference.stop()
+            print("Inference:", self.inference.stats())
+            self.inference = None
+
+    def on_save_checkpoint(self, checkpoint: dict) -> None:
+        """Adds the replay buffer, the current episode and the opponent pool to the checkpoint.
+
+        The network, target network, optimizer and step counters are saved by Lightning (the epsilon and
+        importance-sampling schedules follow the global step). The replay buffer arrays are written as .npy
+        files to `replay-step=<global step>` in the checkpoint directory, and only the newest snapshot is kept.
+        """
+        replay_dir = os.path.join(self.hparams.checkpoint_dir, f"replay-step={self.global_step}")
+        if not os.path.isdir(replay_dir):
+            # Written to a temporary directory first, so an interrupted save never replaces a complete snapshot
+            tmp_dir = replay_dir + ".tmp"
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            self.buffer.save_arrays(tmp_dir)
+            os.replace(tmp_dir, replay_dir)
+            for name in os.listdir(self.hparams.checkpoint_dir):
+                path = os.path.join(self.hparams.checkpoint_dir, name)
+                if name.startswith("replay-step=") and path != replay_dir:
+                    shutil.rmtree(path, ignore_errors=True)
+
+        checkpoint["dqn"] = {
+            "replay_dir": replay_dir,
+            "agent": self.agent.state_dict(),
+            "total_reward": self.total_reward,
+            "episode_reward": self.episode_reward,
+        }
+        if self.opponents is not None:
+            checkpoint["dqn"]["opponents"] = {
+                "counters": self.opponents.counters.copy(),
+                "snapshots": [snapshot.state_dict() for snapshot in self.opponents.snapshots],
+            }
+
+    def on_load_checkpoint(self, checkpoint: dict) -> None:
+        """Maps the replay buffer snapshot of the checkpoint back and continues its episode.
+
+        The buffer arrays are memory-mapped, so resuming does not read or deserialize the whole buffer.
+        """
+        state = checkpoint.get("dqn")
+        if state is None:
+            return
+        if not os.path.isdir(state["replay_dir"]):
+            print(f"Replay buffer snapshot {state['replay_dir']} not found, resuming with the warm start buffer")
+            return
+        self.buffer.load_arrays(state["replay_dir"])
+        self.agent.load_state_dict(state["agent"])
+        self.total_reward = state["total_reward"]
+        self.episode_reward = state["episode_reward"]
+        if self.opponents is not None and "opponents" in state:
+            self.opponents.counters[:] = state["opponents"]["counters"]
+            for snapshot, snapshot_state in zip(self.opponents.snapshots, state["opponents"]["snapshots"]):
+                snapshot.load_state_dict(snapshot_state)
+
     def populate(self, steps: int = 1000) -> None:
         """Carries out several random steps through the environment to initially fill up the replay buffer with
         experiences.
@@ -286,14 +1857,31 @@ class DQNLightning(LightningModule):
         """
         print("populating...")
         for i in range(steps):
-            _, done = self.agent.play_step(self.net, epsilon=1.0)
-            #opponent plays random
-            if not done:
-                _,_,done,_ = self.env.step(self.env.uniform_random_action())
-                if done: 
-                    self.env.reset()
+            self.agent.play_step(self.net, epsilon=1.0)
         print("Finished populating")
-        self.env.reset()
+        self.agent.reset()
+
+    def evaluate(self) -> ArenaResult:
+        """Plays the network against the evaluation opponent in the arena and logs its win rate."""
+        opponent = self.hparams.eval_opponent
+        if opponent not in ("random", "heuristic"):
+            opponent = load_policy(opponent)
+        result = arena(
+            self.net,
+            opponent,
+            self.hparams.eval_games,
+            self.env_kwargs["size"],
+            self.env_kwargs["komi"],
+            max_moves=self.env.spec.max_episode_steps,
+            num_workers=self.hparams.eval_workers,
+            backend=self.hparams.eval_backend,
+        )
+        print(f"Arena vs {self.hparams.eval_opponent}: {result.wins}-{result.draws}-{result.losses}, "
+              f"win rate {result.score:.3f} [{result.score_low:.3f}, {result.score_high:.3f}], "
+              f"Elo {result.elo:+.0f} [{result.elo_low:+.0f}, {result.elo_high:+.0f}]")
+        self.log("win_rate", float(result.score), on_step=True, on_epoch=False, prog_bar=True, logger=True)
+        self.log("elo", float(result.elo), on_step=True, on_epoch=False, logger=True)
+        return result
 
     def forward(self, x: Tensor) -> Tensor:
         """Passes in a state x through the network and gets the q_values of each action as an output.
@@ -316,18 +1904,25 @@ class DQNLightning(LightningModule):
         Returns:
             loss
         """
-        states, actions, rewards, dones, next_states = batch
+        states, actions, rewards, dones, next_states, valid_moves, n_steps, ids, weights = batch
 
         state_action_values = self.net(states).gather(1, actions.unsqueeze(-1)).squeeze(-1)
 
         with torch.no_grad():
-            next_state_values = self.target_net(next_states).max(1)[0]
+            # Only bootstrap from legal moves of the next state
+            next_q_values = self.target_net(next_states).masked_fill(~valid_moves, float("-inf"))
+            next_state_values = next_q_values.max(1)[0]
             next_state_values[dones] = 0.0
             next_state_values = next_state_values.detach()
 
-        expected_state_action_values = next_state_values * self.hparams.gamma + rewards
+        # rewards are n-step returns, which bootstrap from the state n steps later
+        expected_state_action_values = next_state_values * self.hparams.gamma ** n_steps + rewards
+
+        td_errors = expected_state_action_values - state_action_values
+        self.buffer.update_priorities(ids.cpu().numpy(), td_errors.detach().cpu().numpy())
 
-        return nn.MSELoss()(state_action_values, expected_state_action_values)
+        # Importance-sampling weighted MSE, the plain MSE for uniform replay
+        return (weights * td_errors ** 2).mean()
 
     def training_step(self, batch: Tuple[Tensor, Tensor], nb_batch) -> OrderedDict:
         """Carries out a single step through the environment to update the replay buffer. Then calculates loss
@@ -341,29 +1936,30 @@ class DQNLightning(LightningModule):
             Training loss and log metrics
         """
 
-        global writer
-
         device = self.get_device(batch)
         epsilon = max(
             self.hparams.eps_end,
             self.hparams.eps_start - self.global_step + 1 / self.hparams.eps_last_frame,
         )
 
-        # step through environment with agent
-        print("Agent playing")
-        reward, done = self.agent.play_step(self.net, epsilon, device)
-        
-        if not done: 
-            #opponent plays random
-            print("Random move")
-            _,_,done2,_ = self.env.step(self.env.uniform_random_action())
-
-            if done2:
-                print("resetting")
-                self.env.reset()
-        else: 
-            print("Agent reset, not playing random")
-        
+        if self.hparams.prioritized:
+            self.buffer.beta = min(1.0, self.hparams.priority_beta + self.global_step * (
+                1.0 - self.hparams.priority_beta) / self.hparams.priority_beta_frames)
+
+        if self.actors:
+            # the actors play, the learner only refreshes their network and exploration rate
+            reward, done = 0.0, False
+            self.actor_epsilon.value = epsilon
+            self.total_reward = self.actor_reward.value
+            if self.global_step % self.hparams.actor_sync_rate == 0:
+                if self.inference is not None:
+                    self.inference.update_weights(self.net)
+                else:
+                    self.actor_net.load_state_dict(self.net.state_dict())
+        else:
+            # step through environment with agent, the opponent replies in the same step
+            reward, done = self.agent.play_step(self.net, epsilon, device)
+
         self.episode_reward += reward
 
         # calculates training loss
@@ -380,25 +1976,18 @@ class DQNLightning(LightningModule):
         if self.global_step % self.hparams.sync_rate == 0:
             self.target_net.load_state_dict(self.net.state_dict())
 
-        log = {
-            "total_reward": torch.tensor(self.total_reward).to(device),
-            "reward": torch.tensor(reward).to(device),
-            "train_loss": loss,
-        }
-
-        print("LOGGING!")
-        self.log("total_reward", torch.tensor(self.total_reward).to(device), on_step=True, on_epoch=True, prog_bar=True, logger=True)
-        self.log("reward", torch.tensor(reward).to(device), on_step=True, on_epoch=True, prog_bar=True, logger=True)
-        self.log("train_loss", loss, on_step=True, on_epoch=True, prog_bar=True, logger=True)
+        if self.opponents is not None and self.global_step % self.hparams.snapshot_rate == 0:
+            self.opponents.add_snapshot(self.net)
 
-        status = {
-            "steps": torch.tensor(self.global_step).to(device),
-            "total_reward": torch.tensor(self.total_reward).to(device),
-        }
+        if self.hparams.eval_rate > 0 and self.global_step % self.hparams.eval_rate == 0:
+            self.evaluate()
 
-        writer.writerow([self.global_step, self.total_reward, loss.unsqueeze(0).item()])
+        # The metrics writer buffers the scalars and writes the CSV and TensorBoard logs off the training loop,
+        # the loss is read there too, so logging does not synchronize with the device
+        self.metrics.log(self.global_step, self.total_reward, loss.detach(), reward)
+        self.log("total_reward", float(self.total_reward), on_step=True, on_epoch=False, prog_bar=True, logger=False)
 
-        return OrderedDict({"loss": loss, "log": log, "progress_bar": status})
+        return OrderedDict({"loss": loss})
 
     def configure_optimizers(self) -> List[Optimizer]:
         """Initialize Adam optimizer."""
@@ -407,10 +1996,11 @@ class DQNLightning(LightningModule):
 
     def __dataloader(self) -> DataLoader:
         """Initialize the Replay Buffer dataset used for retrieving experiences."""
-        dataset = RLDataset(self.buffer, self.hparams.episode_length)
+        dataset = RLDataset(self.buffer, self.hparams.batch_size, self.hparams.batches_per_epoch)
+        # Batches are already assembled by the dataset
         dataloader = DataLoader(
             dataset=dataset,
-            batch_size=self.hparams.batch_size,
+            batch_size=None,
         )
         return dataloader
 
@@ -426,23 +2016,27 @@ class DQNLightning(LightningModule):
 # In[ ]:
 
 
-f = open('/log/trainingvals/{}'.format(pickFileName()), 'w+')
-writer = csv.writer(f)
-
-model = DQNLightning()
-
-
-tb_logger = TensorBoardLogger("/log/") 
-trainer = Trainer(
-    #accelerator="gpu",
-    #gpus=[0],
-    accelerator="cpu",
-    max_epochs=1,
-    val_check_interval=100,
-    logger=tb_logger,
-)
-
-trainer.fit(model)
-print("F:",f)
-
-f.close()
+if __name__ == "__main__":
+    # Resume after a restart (e.g. a preempted container) from the last checkpoint and its replay buffer
+    last_checkpoint = os.path.join("/log/checkpoints/", "last.ckpt")
+    resume = os.path.exists(last_checkpoint)
+    model = DQNLightning(**({"warm_start_size": 0, "warm_start_steps": 0} if resume else {}))
+
+
+    tb_logger = TensorBoardLogger("/log/") 
+    checkpoint_callback = ModelCheckpoint(
+        dirpath=model.hparams.checkpoint_dir,
+        every_n_train_steps=model.hparams.checkpoint_rate,
+        save_last=True,
+    )
+    trainer = Trainer(
+        #accelerator="gpu",
+        #gpus=[0],
+        accelerator="cpu",
+        max_epochs=1,
+        val_check_interval=100,
+        logger=tb_logger,
+        callbacks=[checkpoint_callback],
+    )
+
+    trainer.fit(model, ckpt_path=last_checkpoint if resume else None)
@@ -0,0 +1,229 @@
+import collections
+
+import numpy as np
+
+from gym_go import gogame, govars
+
+"""
+Memory-mapped game archive
+
+One file holding many games, laid out as
+* a fixed size header (magic, version, snapshot interval, number of games, offset of the index)
+* per game, its int16 1D actions followed by optional bit-packed snapshots of the states before
+  moves 0, K, 2K, ... (K = snapshot interval)
+* the index, one fixed size record per game (board size, komi, result, number of actions, offsets),
+  so any game is found in O(1)
+
+Readers open the file with `np.memmap`, so the index and the actions of a game are zero-copy views.
+Snapshots are states packed with `gogame.pack_states`.
+`GameArchive.state(i, t)` unpacks the closest snapshot before move t and replays the remaining moves.
+
+Usage:
+    with ArchiveWriter('games.goa', snapshot_interval=16) as writer:
+        writer.add_game(actions, board_size=9, komi=7.5, result=1)
+
+    archive = GameArchive('games.goa')
+    actions = archive.actions(i)
+    state = archive.state(i, 42)
+"""
+
+MAGIC = b'GOARCHV1'
+VERSION = 1
+
+HEADER_DTYPE = np.dtype([
+    ('magic', 'S8'),
+    ('version', '<u4'),
+    ('snapshot_interval', '<u4'),
+    ('num_games', '<u8'),
+    ('index_offset', '<u8'),
+    ('reserved', 'u1', (32,)),
+])
+
+INDEX_DTYPE = np.dtype([
+    ('board_size', '<u2'),
+    ('result', 'i1'),
+    ('komi', '<f4'),
+    ('num_actions', '<u4'),
+    ('actions_offset', '<u8'),
+    ('num_snapshots', '<u4'),
+    ('snapshots_offset', '<u8'),
+])
+
+ALIGNMENT = 8
+
+ArchivedGame = collections.namedtuple('ArchivedGame', ['size', 'komi', 'result', 'actions'])
+
+
+def snapshot_nbytes(board_size):
+    return gogame.packed_size(board_size)
+
+
+def pack_snapshots(batch_states):
+    """
+    :param batch_states: (N, NUM_CHNLS, SIZE, SIZE) states
+    :return: (N, snapshot_nbytes(SIZE)) uint8 array, see gogame.pack_states
+    """
+    return gogame.pack_states(batch_states)
+
+
+def unpack_snapshots(packed, board_size, out=None):
+    """
+    :param packed: (N, snapshot_nbytes(SIZE)) uint8 array
+    :param out: optional (N, NUM_CHNLS, SIZE, SIZE) array to unpack into
+    :return: (N, NUM_CHNLS, SIZE, SIZE) states
+    """
+    return gogame.unpack_states(packed, board_size, out=out)
+
+
+class ArchiveWriter:
+    """
+    Appends games to a new archive file. The index and header are written on close.
+    """
+
+    def __init__(self, path, snapshot_interval=0, backend=None):
+        """
+        :param snapshot_interval: K, store a snapshot of the state every K moves, no snapshots if 0
+        :param backend: rule engine backend used to replay games for the snapshots (see gym_go.backends)
+        """
+        self.path = path
+        self.snapshot_interval = snapshot_interval
+        self.backend = backend
+        self.index = []
+        self._file = open(path, 'wb')
+        self._file.write(bytes(HEADER_DTYPE.itemsize))
+
+    def _align(self):
+        offset = self._file.tell()
+        padding = -offset % ALIGNMENT
+        self._file.write(bytes(padding))
+        return offset + padding
+
+    def _snapshots(self, actions, board_size):
+        states = []
+        state = gogame.init_state(board_size)
+        for t, action in enumerate(actions):
+            if t % self.snapshot_interval == 0:
+                states.append(state)
+            state = gogame.next_state(state, action, backend=self.backend)
+        return np.array(states).reshape(-1, govars.NUM_CHNLS, board_size, board_size)
+
+    def add_game(self, actions, board_size, komi=0, result=0):
+        """
+        :param actions: 1D actions of the game
+        :param result: 1 black won, -1 white won, 0 draw or unknown
+        :return: index of the game
+        """
+        actions = np.asarray(actions, dtype='<i2')
+        actions_offset = self._align()
+        self._file.write(actions.tobytes())
+
+        num_snapshots, snapshots_offset = 0, 0
+        if self.snapshot_interval > 0 and len(actions) > 0:
+            packed = pack_snapshots(self._snapshots(actions, board_size))
+            num_snapshots = len(packed)
+            snapshots_offset = self._align()
+            self._file.write(packed.tobytes())
+
+        self.index.append((board_size, result, komi, len(actions), actions_offset, num_snapshots, snapshots_offset))
+        return len(self.index) - 1
+
+    def add_games(self, games):
+        """
+        :param games: iterable of (size, komi, result, actions) records, e.g. from gym_go.sgf.iter_games
+        """
+        for size, komi, result, actions in games:
+            self.add_game(actions, size, komi, result)
+
+    def close(self):
+        if self._file.closed:
+            return
+        index_offset = self._align()
+        self._file.write(np.array(self.index, dtype=INDEX_DTYPE).tobytes())
+
+        header = np.zeros(1, dtype=HEADER_DTYPE)
+        header['magic'] = MAGIC
+        header['version'] = VERSION
+        header['snapshot_interval'] = self.snapshot_interval
+        header['num_games'] = len(self.index)
+        header['index_offset'] = index_offset
+        self._file.seek(0)
+        self._file.write(header.tobytes())
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+class GameArchive:
+    """
+    Read-only, memory-mapped view of an archive
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.data = np.memmap(path, dtype=np.uint8, mode='r')
+        header = self.data[:HEADER_DTYPE.itemsize].view(HEADER_DTYPE)[0]
+        if header['magic'] != MAGIC:
+            raise ValueError('{} is not a game archive'.format(path))
+        if header['version'] != VERSION:
+            raise ValueError('Unsupported archive version {}'.format(header['version']))
+        self.snapshot_interval = int(header['snapshot_interval'])
+        num_games = int(header['num_games'])
+        index_offset = int(header['index_offset'])
+        self.index = self.data[index_offset:index_offset + num_games * INDEX_DTYPE.itemsize].view(INDEX_DTYPE)
+
+    def __len__(self):
+        return len(self.index)
+
+    def actions(self, i):
+        """
+        :return: zero-copy int16 view of the actions of game i
+        """
+        record = self.index[i]
+        offset = int(record['actions_offset'])
+        return self.data[offset:offset + 2 * int(record['num_actions'])].view('<i2')
+
+    def game(self, i):
+        record = self.index[i]
+        return ArchivedGame(int(record['board_size']), float(record['komi']), int(record['result']), self.actions(i))
+
+    def __getitem__(self, i):
+        return self.game(i)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self.game(i)
+
+    def snapshots(self, i):
+        """
+        :return: zero-copy (num_snapshots, gogame.packed_size(SIZE)) view of the packed snapshots of game i
+        """
+        record = self.index[i]
+        nbytes = snapshot_nbytes(int(record['board_size']))
+        offset = int(record['snapshots_offset'])
+        num_snapshots = int(record['num_snapshots'])
+        return self.data[offset:offset + num_snapshots * nbytes].reshape(num_snapshots, nbytes)
+
+    def state(self, i, t):
+        """
+        :return: the state of game i before move t (t = number of actions gives the final state)
+        """
+        record = self.index[i]
+        board_size = int(record['board_size'])
+        actions = self.actions(i)
+        assert 0 <= t <= len(actions), (t, len(actions))
+
+        num_snapshots = int(record['num_snapshots'])
+        if num_snapshots > 0:
+            k = min(t // self.snapshot_interval, num_snapshots - 1)
+            state = unpack_snapshots(self.snapshots(i)[k:k + 1], board_size)[0]
+            start = k * self.snapshot_interval
+        else:
+            state = gogame.init_state(board_size)
+            start = 0
+        for action in actions[start:t]:
+            state = gogame.next_state(state, action)
+        return state
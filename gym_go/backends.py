@@ -0,0 +1,171 @@
+import argparse
+import importlib
+import time
+
+import numpy as np
+
+"""
+Registry of rule engine backends
+
+A backend is a module that implements the same state transitions as `gogame`:
+* next_state(state, action1d, canonical=False)
+* batch_next_states(batch_states, batch_action1d, canonical=False)
+and may optionally provide its own
+* batch_valid_moves(batch_states)
+* batch_areas(batch_states)
+otherwise the ones of `gogame` are used on its states.
+
+'scipy' is the reference implementation (`gogame` itself).
+Backends are selected with `gym.make('gym_go:go-v0', backend=...)` or the `backend` argument of
+`gogame.next_state`, `gogame.batch_next_states` and `gogame.children`.
+
+`verify_backends` plays random games through every backend and asserts that they produce identical
+states, legal masks and scores to the reference. It can also be run from the command line:
+
+    python -m gym_go.backends --games 1000 --boardsize 7 --batchsize 32
+"""
+
+REFERENCE = 'scipy'
+
+_BACKENDS = {
+    'scipy': 'gym_go.gogame',
+    'numba': 'gym_go.numba_backend',
+    'torch': 'gym_go.torch_backend',
+}
+
+
+def register_backend(name, module_name):
+    """
+    :param name: name to select the backend with
+    :param module_name: importable module implementing the backend interface
+    """
+    _BACKENDS[name] = module_name
+
+
+def get_backend(name=None):
+    """
+    :param name: backend name, the reference backend if None
+    :return: the backend module
+    """
+    if name is None:
+        name = REFERENCE
+    if name not in _BACKENDS:
+        raise ValueError('Unknown backend {}, choose from {}'.format(name, list(_BACKENDS)))
+    backend = importlib.import_module(_BACKENDS[name])
+    if not getattr(backend, 'available', True):
+        raise ValueError('Backend {} is not available, its dependencies are not installed'.format(name))
+    return backend
+
+
+def available_backends():
+    """
+    :return: names of the backends whose dependencies are installed
+    """
+    names = []
+    for name in _BACKENDS:
+        try:
+            get_backend(name)
+        except (ValueError, ImportError):
+            continue
+        names.append(name)
+    return names
+
+
+def _valid_moves(backend, batch_states):
+    from gym_go import gogame
+    return np.asarray(getattr(backend, 'batch_valid_moves', gogame.batch_valid_moves)(batch_states))
+
+
+def _areas(backend, batch_states):
+    from gym_go import gogame
+    black_areas, white_areas = getattr(backend, 'batch_areas', gogame.batch_areas)(batch_states)
+    return np.stack([np.asarray(black_areas), np.asarray(white_areas)])
+
+
+def assert_equal_batch(name, batch_states, reference_states, context=''):
+    """
+    Asserts that the states, legal masks and scores of a backend match the reference ones
+    """
+    backend = get_backend(name)
+    reference = get_backend(REFERENCE)
+    batch_states = np.asarray(batch_states)
+    checks = [
+        ('states', batch_states, reference_states),
+        ('legal masks', _valid_moves(backend, batch_states), _valid_moves(reference, reference_states)),
+        ('scores', _areas(backend, batch_states), _areas(reference, reference_states)),
+    ]
+    for what, result, expected in checks:
+        if result.shape != expected.shape or not (result == expected).all():
+            mismatch = np.argwhere(result != expected) if result.shape == expected.shape else None
+            raise AssertionError('Backend {} differs from {} in {} {}: {}'.format(name, REFERENCE, what, context,
+                                                                                mismatch))
+
+
+def verify_backends(names=None, num_games=100, board_size=7, batch_size=16, seed=None, max_steps=None):
+    """
+    Plays random games through the reference backend and asserts that every other backend produces
+    identical states, legal masks and scores after every move.
+    Both the single state and the batched transitions of each backend are checked.
+    :param names: backends to verify, all available backends if None
+    :return: number of moves verified
+    """
+    from gym_go import gogame
+
+    if names is None:
+        names = [name for name in available_backends() if name != REFERENCE]
+    backends = {name: get_backend(name) for name in names}
+    rng = np.random.default_rng(seed)
+    if max_steps is None:
+        max_steps = 2 * board_size ** 2
+
+    num_moves = 0
+    games_left = num_games
+    while games_left > 0:
+        n = min(batch_size, games_left)
+        games_left -= n
+
+        batch_states = gogame.batch_init_state(n, board_size)
+        for step in range(max_steps):
+            # Random valid moves, passing only with small probability so games get long
+            batch_valid_moves = gogame.batch_valid_moves(batch_states)
+            weights = batch_valid_moves * rng.random(batch_valid_moves.shape)
+            weights[:, -1] *= 0.05
+            actions = np.argmax(weights, axis=1)
+
+            reference_states = gogame.batch_next_states(batch_states, actions)
+            for name, backend in backends.items():
+                context = '(board size {}, step {}, actions {})'.format(board_size, step, actions)
+                assert_equal_batch(name, backend.batch_next_states(batch_states, actions), reference_states,
+                                   context)
+                single_states = [backend.next_state(state, action) for state, action in zip(batch_states, actions)]
+                assert_equal_batch(name, single_states, reference_states, context)
+
+            num_moves += n
+            batch_states = reference_states[gogame.batch_game_ended(reference_states) == 0]
+            if len(batch_states) == 0:
+                break
+
+    return num_moves
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Verify rule engine backends against the reference')
+    parser.add_argument('--backends', nargs='+', default=None)
+    parser.add_argument('--games', type=int, default=1000)
+    parser.add_argument('--boardsize', type=int, nargs='+', default=[5, 7, 9])
+    parser.add_argument('--batchsize', type=int, default=32)
+    parser.add_argument('--seed', type=int, default=None)
+    args = parser.parse_args(argv)
+
+    names = args.backends
+    if names is None:
+        names = [name for name in available_backends() if name != REFERENCE]
+    for board_size in args.boardsize:
+        start = time.time()
+        num_moves = verify_backends(names, args.games, board_size, args.batchsize, args.seed)
+        print(f"Board size {board_size}: {args.games} games, {num_moves} moves identical for {names} "
+              f"({time.time() - start:.1f} SEC)", flush=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,133 @@
+import numpy as np
+
+from gym_go import govars, state_utils
+
+"""
+Compact state of the game
+
+Only the black and white pieces are kept as (2, SIZE, SIZE) boolean planes.
+The turn, pass, game over and ko-protection channels each only encode a scalar, so they are stored as such.
+The invalid moves channel is derived from the pieces, the turn and the ko point, and is only
+computed when it is needed (legality checks, valid moves or materializing the full state).
+
+`to_state` materializes the regular [NUM_CHNLS, SIZE, SIZE] state of `gogame` for network observations.
+"""
+
+
+class CompactState:
+    __slots__ = ('pieces', 'turn', 'passed', 'done', 'ko', '_invalid')
+
+    def __init__(self, pieces, turn=govars.BLACK, passed=False, done=False, ko=-1):
+        """
+        @param pieces: (2, SIZE, SIZE) boolean array of the black and white pieces
+        @param turn: govars.BLACK/govars.WHITE
+        @param passed: whether the previous move was a pass
+        @param done: whether the game is over
+        @param ko: 1D index of the ko-protected location, -1 if there is none
+        """
+        self.pieces = pieces
+        self.turn = turn
+        self.passed = passed
+        self.done = done
+        self.ko = ko
+        self._invalid = None
+
+    @classmethod
+    def init(cls, size):
+        return cls(np.zeros((2, size, size), dtype=bool))
+
+    @classmethod
+    def from_state(cls, state):
+        """
+        :param state: (NUM_CHNLS, SIZE, SIZE) state
+        :return: compact form of the state
+        """
+        pieces = state[[govars.BLACK, govars.WHITE]] > 0
+        turn = int(np.max(state[govars.TURN_CHNL]))
+        passed = bool(np.max(state[govars.PASS_CHNL]) == 1)
+        done = bool(np.max(state[govars.DONE_CHNL]) == 1)
+
+        # The ko point is the only location that is invalid only because of ko-protection
+        ko = -1
+        if not passed:
+            invalid_no_ko = state_utils.compute_invalid_moves(pieces, 1 - turn)
+            ko_locs = np.argwhere((state[govars.INVD_CHNL] > 0) & ~invalid_no_ko)
+            if len(ko_locs) > 0:
+                ko = int(ko_locs[0, 0] * state.shape[2] + ko_locs[0, 1])
+
+        return cls(pieces, turn, passed, done, ko)
+
+    @property
+    def size(self):
+        return self.pieces.shape[1]
+
+    def copy(self):
+        return CompactState(np.copy(self.pieces), self.turn, self.passed, self.done, self.ko)
+
+    def invalid_moves(self):
+        """
+        Computed on first call and cached
+        :return: (SIZE, SIZE) boolean array of invalid moves for the player whose turn it is
+        """
+        if self._invalid is None:
+            ko_protect = None if self.ko < 0 else divmod(self.ko, self.size)
+            self._invalid = state_utils.compute_invalid_moves(self.pieces, 1 - self.turn, ko_protect)
+        return self._invalid
+
+    def valid_moves(self):
+        """
+        Same as gogame.valid_moves
+        :return: fixed size binary vector, the last move is passing
+        """
+        if self.done:
+            return np.ones(self.size ** 2 + 1)
+        return np.append(1 - self.invalid_moves().flatten(), 1)
+
+    def next_state(self, action1d):
+        """
+        Same as gogame.next_state
+        :return: the next compact state, this state is not modified
+        """
+        size = self.size
+        player = self.turn
+
+        if action1d == size ** 2:
+            return CompactState(self.pieces, 1 - player, True, self.done or self.passed, -1)
+
+        action2d = divmod(action1d, size)
+        assert not self.invalid_moves()[action2d], ("Invalid move", action2d)
+
+        # Add piece
+        pieces = np.copy(self.pieces)
+        pieces[player][action2d] = True
+
+        # Get adjacent location and check whether the piece will be surrounded by opponent's piece
+        adj_locs, surrounded = state_utils.adj_data(pieces, action2d, player)
+
+        # Update pieces
+        killed_groups = state_utils.update_pieces(pieces, adj_locs, player)
+
+        # If only killed one group, and that one group was one piece, and piece set is surrounded,
+        # activate ko protection
+        ko = -1
+        if len(killed_groups) == 1 and surrounded:
+            killed_group = killed_groups[0]
+            if len(killed_group) == 1:
+                ko = int(killed_group[0][0] * size + killed_group[0][1])
+
+        return CompactState(pieces, 1 - player, False, self.done, ko)
+
+    def to_state(self, out=None):
+        """
+        Materializes the full state
+        :param out: optional (NUM_CHNLS, SIZE, SIZE) array to write the state into
+        :return: (NUM_CHNLS, SIZE, SIZE) state
+        """
+        if out is None:
+            out = np.empty((govars.NUM_CHNLS, self.size, self.size))
+        out[[govars.BLACK, govars.WHITE]] = self.pieces
+        out[govars.TURN_CHNL] = self.turn
+        out[govars.INVD_CHNL] = self.invalid_moves()
+        out[govars.PASS_CHNL] = self.passed
+        out[govars.DONE_CHNL] = self.done
+        return out
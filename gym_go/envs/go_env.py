@@ -1,10 +1,11 @@
-import collections
 from enum import Enum
 
 import gym
 import numpy as np
 
-from gym_go import govars, rendering, gogame
+from gym_go import govars, rendering, gogame, backends
+from gym_go.compact import CompactState
+from gym_go.history import BoardHistory
 
 
 
@@ -18,26 +19,119 @@ class RewardMethod(Enum):
     HEURISTIC = 'heuristic'
 
 
+class ObservationMode(Enum):
+    """
+    FLAT: a new flattened (3 * BOARD_SIZE**2,) array of the black, white and turn channels every step
+    BUFFER: the same channels written into a preallocated (3 * BOARD_SIZE**2,) buffer of obs_dtype.
+    The returned array is the buffer itself, so it is overwritten on the next step
+    PACKED: the same channels bit-packed (np.packbits) into a preallocated uint8 buffer
+    """
+    FLAT = 'flat'
+    BUFFER = 'buffer'
+    PACKED = 'packed'
+
+
+class LazyInfo(dict):
+    """
+    Info dict whose values are only computed on first access and then cached.
+    Iterating, comparing, printing or pickling it computes all remaining values.
+    """
+
+    def __init__(self, fns):
+        """
+        @param fns: dict of key -> function without arguments computing the value
+        """
+        super().__init__()
+        self._fns = fns
+
+    def __getitem__(self, key):
+        if not dict.__contains__(self, key) and key in self._fns:
+            dict.__setitem__(self, key, self._fns[key]())
+        return dict.__getitem__(self, key)
+
+    def get(self, key, default=None):
+        return self[key] if key in self else default
+
+    def __contains__(self, key):
+        return key in self._fns or dict.__contains__(self, key)
+
+    def materialize(self):
+        for key in self._fns:
+            self[key]
+        return self
+
+    def __iter__(self):
+        return dict.__iter__(self.materialize())
+
+    def __len__(self):
+        return dict.__len__(self.materialize())
+
+    def __eq__(self, other):
+        return dict.__eq__(self.materialize(), other)
+
+    def __repr__(self):
+        return dict.__repr__(self.materialize())
+
+    def keys(self):
+        return dict.keys(self.materialize())
+
+    def values(self):
+        return dict.values(self.materialize())
+
+    def items(self):
+        return dict.items(self.materialize())
+
+    def copy(self):
+        return dict(self.items())
+
+    def __reduce__(self):
+        # The functions are local closures, so a plain dict of the values is pickled instead
+        return dict, (self.copy(),)
+
+
 class GoEnv(gym.Env):
     metadata = {'render.modes': ['terminal', 'human']}
     govars = govars
     gogame = gogame
     timestep = 0
 
-    def __init__(self, size, komi=0, reward_method='real'):
+    def __init__(self, size, komi=0, reward_method='real', obs_mode='flat', obs_dtype=np.float64, obs_buffer=None,
+                 history_len=govars.NO_TIMESTEPS, intermediate_rewards=True, backend=None, compact=False):
         '''
         @param reward_method: either 'heuristic' or 'real'
         heuristic: gives # black pieces - # white pieces.
         real: gives 0 for in-game move, 1 for winning, -1 for losing,
             0 for draw, all from black player's perspective
+        @param obs_mode: either 'flat', 'buffer' or 'packed' (see ObservationMode)
+        @param obs_dtype: dtype of the observation in 'flat' and 'buffer' mode (e.g. np.uint8, np.float32)
+        @param obs_buffer: optional caller-supplied buffer for 'buffer' and 'packed' mode.
+            Must be of shape (3 * size**2,) and obs_dtype for 'buffer', and (ceil(3 * size**2 / 8),) uint8 for 'packed'
+        @param history_len: number of recent positions kept for history_observation, 0 to disable
+        @param intermediate_rewards: if False, the heuristic reward is 0 until the game ends,
+            which skips scoring the board on every step. step has to return the reward, so this is the way
+            to avoid the cost, the reward cannot be computed lazily like info
+        @param backend: rule engine backend (see gym_go.backends), the scipy reference if None
+        @param compact: keep the game as a CompactState (see gym_go.compact), whose turn, pass, done and ko are
+            scalars. Steps, observations, valid moves and info only read the compact state, the full state is
+            materialized when it is accessed (state(), children, scoring, rendering). Requires the reference backend
         '''
         self.timestep = 0
         self.size = size
         self.komi = komi
+        backends.get_backend(backend)
+        if compact and backend not in (None, backends.REFERENCE):
+            raise ValueError('The compact state requires the reference backend, got {}'.format(backend))
+        self.backend = backend
+        self.compact = compact
+        self.compact_state = None
         self.state_ = gogame.init_state(size)
-        self.history = x = collections.deque(govars.NO_TIMESTEPS*np.zeros((govars.NUM_CHNLS, size, size)), govars.NO_TIMESTEPS)
+        self.history = BoardHistory(size, history_len) if history_len > 0 else None
+        self.reset_history()
 
         self.reward_method = RewardMethod(reward_method)
+        self.intermediate_rewards = intermediate_rewards
+        self._reward = None
+        self._info = None
         """ space = {'observation' : gym.spaces.Box(np.float32(0), np.float32(3),
                                                 shape=(size*size*3,)),
                                 'legal_moves' : gym.spaces.Box(np.int64(0),np.int64(1),
@@ -45,8 +139,28 @@ class GoEnv(gym.Env):
                                 }
 
         self.observation_space =  gym.spaces.Dict(space)  """
-        self.observation_space =gym.spaces.Box(np.float32(0), np.float32(5),
-                                                shape=(size*size*3,))
+        self.obs_mode = ObservationMode(obs_mode)
+        self.obs_dtype = np.dtype(np.uint8 if self.obs_mode == ObservationMode.PACKED else obs_dtype)
+        obs_size = 3 * size * size
+        if self.obs_mode == ObservationMode.PACKED:
+            obs_size = (obs_size + 7) // 8
+        if self.obs_mode == ObservationMode.FLAT:
+            assert obs_buffer is None, 'obs_buffer requires the buffer or packed observation mode'
+            self.obs_buffer = None
+        elif obs_buffer is None:
+            self.obs_buffer = np.zeros(obs_size, dtype=self.obs_dtype)
+        else:
+            assert obs_buffer.shape == (obs_size,), (obs_buffer.shape, obs_size)
+            assert obs_buffer.dtype == self.obs_dtype, (obs_buffer.dtype, self.obs_dtype)
+            self.obs_buffer = obs_buffer
+
+        if self.obs_mode == ObservationMode.PACKED:
+            self.observation_space = gym.spaces.Box(0, 255, shape=(obs_size,), dtype=np.uint8)
+        elif self.obs_mode == ObservationMode.FLAT and self.obs_dtype == np.float64:
+            self.observation_space =gym.spaces.Box(np.float32(0), np.float32(5),
+                                                    shape=(size*size*3,))
+        else:
+            self.observation_space = gym.spaces.Box(0, 1, shape=(obs_size,), dtype=self.obs_dtype)
 
         self.action_space = gym.spaces.Discrete(gogame.action_size(self.state_))
         self.done = False
@@ -56,16 +170,23 @@ class GoEnv(gym.Env):
         Reset state, go_board, curr_player, prev_player_passed,
         done, return state
         '''
-        self.state_ = gogame.init_state(self.size)
+        if self.compact:
+            self.compact_state = CompactState.init(self.size)
+            self._state = None
+        else:
+            self.state_ = gogame.init_state(self.size)
         self.done = False
         self.timestep = 0
+        self._reward = None
+        self._info = None
+        self.reset_history()
         print("RESET!!")
 
         """ observations_and_legal_moves = {'observation' : np.copy(self.state_)[:3].flatten(),
                                         'legal_moves' : 1-self.state_[govars.INVD_CHNL].flatten()
                                         }
         return observations_and_legal_moves """
-        return np.copy(self.state_)[:3].flatten()
+        return self.observation()
 
     def step(self, action):
 
@@ -87,9 +208,17 @@ class GoEnv(gym.Env):
         elif action is None:
             action = self.size ** 2
 
-        prev = np.copy(self.state_)
-        self.state_ = gogame.next_state(self.state_, action, canonical=False)
-        self.done = gogame.game_ended(self.state_)
+        if self.compact:
+            self.compact_state = self.compact_state.next_state(action)
+            self._state = None
+            self.done = self.compact_state.done
+        else:
+            self.state_ = gogame.next_state(self.state_, action, canonical=False, backend=self.backend)
+            self.done = gogame.game_ended(self.state_)
+        self._reward = None
+        self._info = None
+        if self.history is not None:
+            self.history.push(self.observation_planes())
         print("returning done as",self.done)
         self.timestep += 1
         """ observations_and_legal_moves = {'observation' : np.copy(self.state_)[:3].flatten(),
@@ -98,18 +227,89 @@ class GoEnv(gym.Env):
 
         return observations_and_legal_moves, self.reward(), self.done, self.info() """
 
-        return np.copy(self.state_)[:3].flatten(), self.reward(), self.done, self.info()
+        return self.observation(), self.reward(), self.done, self.info()
+
+    def observation_planes(self):
+        """
+        Built from the compact state in compact mode, without materializing the full state
+        :return: (3, SIZE, SIZE) black, white and turn channels of the state
+        """
+        if self.compact:
+            planes = np.empty((govars.TURN_CHNL + 1, self.size, self.size))
+            planes[[govars.BLACK, govars.WHITE]] = self.compact_state.pieces
+            planes[govars.TURN_CHNL] = self.compact_state.turn
+            return planes
+        return self.state_[:govars.TURN_CHNL + 1]
+
+    def observation(self):
+        """
+        Only the black, white and turn channels are read, so the cost does not depend on NUM_CHNLS
+        :return: observation of the current state according to obs_mode
+        """
+        planes = self.observation_planes()
+        if self.obs_mode == ObservationMode.FLAT:
+            return planes.astype(self.obs_dtype).reshape(-1)
+        elif self.obs_mode == ObservationMode.BUFFER:
+            # Assigned through the buffer itself, a reshape of a non-contiguous caller buffer would be a copy
+            self.obs_buffer[...] = planes.reshape(-1)
+        else:
+            self.obs_buffer[:] = np.packbits(planes.reshape(-1).astype(bool))
+        return self.obs_buffer
+
+    def reset_history(self):
+        if self.history is not None:
+            self.history.reset()
+            self.history.push(self.observation_planes())
+
+    def history_observation(self):
+        """
+        The returned array is a view that changes with every step, copy it to keep it
+        :return: (2 * history_len + 1, BOARD_SIZE, BOARD_SIZE) black and white planes of the last history_len
+        positions (oldest first) followed by the turn channel
+        """
+        assert self.history is not None, 'History is disabled (history_len=0)'
+        return self.history.observation()
+
+    def unpack_observation(self, packed_obs, dtype=np.float64):
+        """
+        :param packed_obs: observation returned in 'packed' mode, or a batch of them
+        :return: the flattened (..., 3 * BOARD_SIZE**2) observation
+        """
+        obs_size = 3 * self.size * self.size
+        return np.unpackbits(packed_obs, axis=-1, count=obs_size).astype(dtype)
 
     def game_ended(self):
         return self.done
 
+    @property
+    def state_(self):
+        """
+        Materialized from the compact state on first access after every step in compact mode
+        :return: the (NUM_CHNLS, SIZE, SIZE) state
+        """
+        if self._state is None:
+            self._state = self.compact_state.to_state()
+        return self._state
+
+    @state_.setter
+    def state_(self, state):
+        self._state = state
+        if self.compact:
+            self.compact_state = CompactState.from_state(state)
+
     def turn(self):
+        if self.compact:
+            return self.compact_state.turn
         return gogame.turn(self.state_)
 
     def prev_player_passed(self):
+        if self.compact:
+            return self.compact_state.passed
         return gogame.prev_player_passed(self.state_)
 
     def valid_moves(self):
+        if self.compact:
+            return self.compact_state.valid_moves()
         return gogame.valid_moves(self.state_)
 
     def uniform_random_action(self):
@@ -120,13 +320,25 @@ class GoEnv(gym.Env):
 
     def info(self):
         """
+        Values are computed on first access and cached until the next step
         :return: Debugging info for the state
         """
-        return {
-            'turn': gogame.turn(self.state_),
-            'invalid_moves': gogame.invalid_moves(self.state_),
-            'prev_player_passed': gogame.prev_player_passed(self.state_),
-        }
+        if self._info is None:
+            if self.compact:
+                compact_state = self.compact_state
+                self._info = LazyInfo({
+                    'turn': lambda: compact_state.turn,
+                    'invalid_moves': lambda: 1 - compact_state.valid_moves(),
+                    'prev_player_passed': lambda: compact_state.passed,
+                })
+            else:
+                state = self.state_
+                self._info = LazyInfo({
+                    'turn': lambda: gogame.turn(state),
+                    'invalid_moves': lambda: gogame.invalid_moves(state),
+                    'prev_player_passed': lambda: gogame.prev_player_passed(state),
+                })
+        return self._info
 
     def state(self):
         """
@@ -144,13 +356,14 @@ class GoEnv(gym.Env):
         """
         :return: Same as get_children, but in canonical form
         """
-        return gogame.children(self.state_, canonical, padded)
+        return gogame.children(self.state_, canonical, padded, self.backend)
 
     def winning(self):
         """
         :return: Who's currently winning in BLACK's perspective, regardless if the game is over
         """
-        return gogame.winning(self.state_, self.komi)
+        # Scoring only reads the pieces, which does not materialize a compact state
+        return gogame.winning(self.observation_planes(), self.komi)
 
     def winner(self):
         """
@@ -172,12 +385,21 @@ class GoEnv(gym.Env):
             Winning and losing based on the Area rule
             Also known as Trump Taylor Scoring
         Area rule definition: https://en.wikipedia.org/wiki/Rules_of_Go#End
+
+        The reward is cached until the next step
         '''
+        if self._reward is None:
+            self._reward = self.compute_reward()
+        return self._reward
+
+    def compute_reward(self):
         if self.reward_method == RewardMethod.REAL:
             return self.winner()
 
         elif self.reward_method == RewardMethod.HEURISTIC:
-            black_area, white_area = gogame.areas(self.state_)
+            if not self.intermediate_rewards and not self.game_ended():
+                return 0
+            black_area, white_area = gogame.areas(self.observation_planes())
             area_difference = black_area - white_area
             komi_correction = area_difference - self.komi
             if self.game_ended():
@@ -0,0 +1,103 @@
+import numpy as np
+from scipy.ndimage import measurements
+
+from gym_go import govars, state_utils
+
+"""
+Batched liberty and atari feature planes
+
+All features are in the perspective of the player whose turn it is ("own") and computed for a whole
+(B, C, SIZE, SIZE) batch at once: groups are labeled with one 3D label call and liberties are counted with
+bincounts over the (group, empty point) pairs, so the cost does not grow with the number of groups.
+
+Feature planes:
+* OWN_LIBERTIES + k / OPP_LIBERTIES + k: stones whose group has k + 1 liberties (the last bucket is 4+)
+* CAPTURE: empty points where playing captures opponent stones
+* CAPTURE_SIZE: number of opponent stones captured by playing there
+* THREAT: empty points where the opponent would capture own stones (own groups in atari)
+* THREAT_SIZE: number of own stones the opponent would capture by playing there
+"""
+
+NUM_LIBERTY_BUCKETS = 4
+
+OWN_LIBERTIES = 0
+OPP_LIBERTIES = OWN_LIBERTIES + NUM_LIBERTY_BUCKETS
+CAPTURE = OPP_LIBERTIES + NUM_LIBERTY_BUCKETS
+CAPTURE_SIZE = CAPTURE + 1
+THREAT = CAPTURE_SIZE + 1
+THREAT_SIZE = THREAT + 1
+
+NUM_FEATURES = THREAT_SIZE + 1
+
+
+def _neighbors(batch_board):
+    """
+    :param batch_board: (B, SIZE, SIZE) array
+    :return: (4, B, SIZE, SIZE) values of the up, down, left and right neighbour of every point (0 off-board)
+    """
+    padded = np.pad(batch_board, ((0, 0), (1, 1), (1, 1)))
+    return np.stack([padded[:, :-2, 1:-1], padded[:, 2:, 1:-1], padded[:, 1:-1, :-2], padded[:, 1:-1, 2:]])
+
+
+def _unique_neighbor_labels(labels, empties):
+    """
+    :return: (4, B, SIZE, SIZE) labels of the groups adjacent to each empty point, each group only once per point
+    """
+    neighbor_labels = _neighbors(labels) * empties
+    unique_labels = np.copy(neighbor_labels)
+    for k in range(1, 4):
+        for j in range(k):
+            unique_labels[k][neighbor_labels[k] == neighbor_labels[j]] = 0
+    return unique_labels
+
+
+def _group_data(pieces, empties):
+    """
+    :return: labels, liberty count per label, size per label, unique adjacent labels of every empty point
+    """
+    labels, num_labels = measurements.label(pieces, state_utils.group_struct)
+    unique_labels = _unique_neighbor_labels(labels, empties)
+    liberty_counts = np.bincount(unique_labels.ravel(), minlength=num_labels + 1)
+    liberty_counts[0] = 0
+    sizes = np.bincount(labels.ravel(), minlength=num_labels + 1)
+    sizes[0] = 0
+    return labels, liberty_counts, sizes, unique_labels
+
+
+def batch_liberty_features(batch_state, dtype=np.float32):
+    """
+    :param batch_state: (B, C, SIZE, SIZE) states, only the pieces and turn channels are read
+    :return: (B, NUM_FEATURES, SIZE, SIZE) feature planes
+    """
+    n = len(batch_state)
+    idcs = np.arange(n)
+    batch_player = batch_state[:, govars.TURN_CHNL, 0, 0].astype(int)
+    own_pieces = batch_state[idcs, batch_player] > 0
+    opp_pieces = batch_state[idcs, 1 - batch_player] > 0
+    empties = ~(own_pieces | opp_pieces)
+
+    features = np.zeros((n, NUM_FEATURES, *batch_state.shape[2:]), dtype=dtype)
+    planes = [(own_pieces, OWN_LIBERTIES, THREAT, THREAT_SIZE), (opp_pieces, OPP_LIBERTIES, CAPTURE, CAPTURE_SIZE)]
+    for pieces, liberties_chnl, atari_chnl, atari_size_chnl in planes:
+        labels, liberty_counts, sizes, unique_labels = _group_data(pieces, empties)
+
+        # Bucketed liberty counts of the group of each stone
+        buckets = np.minimum(liberty_counts[labels], NUM_LIBERTY_BUCKETS)
+        for k in range(NUM_LIBERTY_BUCKETS):
+            features[:, liberties_chnl + k] = pieces & (buckets == k + 1)
+
+        # Empty points that are the last liberty of adjacent groups, and the number of stones in those groups
+        in_atari = (unique_labels > 0) & (liberty_counts[unique_labels] == 1)
+        atari_sizes = np.sum(sizes[unique_labels] * in_atari, axis=0)
+        features[:, atari_chnl] = atari_sizes > 0
+        features[:, atari_size_chnl] = atari_sizes
+
+    return features
+
+
+def liberty_features(state, dtype=np.float32):
+    """
+    :param state: (C, SIZE, SIZE) state
+    :return: (NUM_FEATURES, SIZE, SIZE) feature planes
+    """
+    return batch_liberty_features(state[np.newaxis], dtype)[0]
@@ -2,7 +2,7 @@ import numpy as np
 from scipy import ndimage
 from sklearn import preprocessing
 
-from gym_go import state_utils, govars
+from gym_go import state_utils, govars, backends
 
 """
 The state of the game is a numpy array
@@ -31,7 +31,10 @@ def batch_init_state(batch_size, board_size):
     return batch_state
 
 
-def next_state(state, action1d, canonical=False):
+def next_state(state, action1d, canonical=False, backend=None):
+    if backend is not None and backend != backends.REFERENCE:
+        return backends.get_backend(backend).next_state(state, action1d, canonical)
+
     # Deep copy the state to modify
     state = np.copy(state)
 
@@ -94,7 +97,10 @@ def next_state(state, action1d, canonical=False):
     return state
 
 
-def batch_next_states(batch_states, batch_action1d, canonical=False):
+def batch_next_states(batch_states, batch_action1d, canonical=False, backend=None):
+    if backend is not None and backend != backends.REFERENCE:
+        return backends.get_backend(backend).batch_next_states(batch_states, batch_action1d, canonical)
+
     # Deep copy the state to modify
     batch_states = np.copy(batch_states)
 
@@ -180,12 +186,12 @@ def batch_valid_moves(batch_state):
     return 1 - batch_invalid_moves(batch_state)
 
 
-def children(state, canonical=False, padded=True):
+def children(state, canonical=False, padded=True, backend=None):
     valid_moves_bool = valid_moves(state)
     n = len(valid_moves_bool)
     valid_move_idcs = np.argwhere(valid_moves_bool).flatten()
     batch_states = np.tile(state[np.newaxis], (len(valid_move_idcs), 1, 1, 1))
-    children = batch_next_states(batch_states, valid_move_idcs, canonical)
+    children = batch_next_states(batch_states, valid_move_idcs, canonical, backend)
 
     if padded:
         padded_children = np.zeros((n, *state.shape))
@@ -345,6 +351,64 @@ def batch_canonical_form(batch_state):
     return batch_state
 
 
+PACKED_PLANES = [govars.BLACK, govars.WHITE, govars.INVD_CHNL]
+PACKED_SCALARS = [govars.TURN_CHNL, govars.PASS_CHNL, govars.DONE_CHNL]
+
+
+def _packed_chnls(num_chnls):
+    planes = [c for c in PACKED_PLANES if c < num_chnls]
+    scalars = [c for c in PACKED_SCALARS if c < num_chnls]
+    return planes, scalars
+
+
+def packed_size(board_size, num_chnls=govars.NUM_CHNLS):
+    """
+    :return: number of bytes of a packed state
+    """
+    planes, scalars = _packed_chnls(num_chnls)
+    return len(planes) * ((board_size ** 2 + 7) // 8) + len(scalars)
+
+
+def pack_states(batch_state, out=None):
+    """
+    Bit-packs the black, white and invalid moves channels of each state and stores the turn,
+    pass and game over channels (which are constant planes) as one byte each.
+    Also accepts the first channels of states only, e.g. (B, 3, SIZE, SIZE) observations.
+    :param batch_state: (B, C, SIZE, SIZE) states
+    :param out: optional (B, packed_size(SIZE, C)) uint8 array to pack into
+    :return: (B, packed_size(SIZE, C)) uint8 array
+    """
+    n, num_chnls, size, _ = batch_state.shape
+    planes, scalars = _packed_chnls(num_chnls)
+    if out is None:
+        out = np.empty((n, packed_size(size, num_chnls)), dtype=np.uint8)
+    num_bits = len(planes) * ((size ** 2 + 7) // 8)
+    bits = np.packbits(batch_state[:, planes].reshape(n, len(planes), -1) > 0, axis=-1)
+    out[:, :num_bits] = bits.reshape(n, -1)
+    out[:, num_bits:] = batch_state[:, scalars, 0, 0]
+    return out
+
+
+def unpack_states(packed, board_size, num_chnls=govars.NUM_CHNLS, out=None, dtype=np.float64):
+    """
+    Inverse of pack_states
+    :param packed: (B, packed_size(SIZE, C)) uint8 array
+    :param out: optional (B, C, SIZE, SIZE) array to unpack into, e.g. a preallocated training batch
+    :return: (B, C, SIZE, SIZE) states
+    """
+    n = len(packed)
+    planes, scalars = _packed_chnls(num_chnls)
+    if out is None:
+        out = np.empty((n, num_chnls, board_size, board_size), dtype=dtype)
+    area = board_size ** 2
+    num_bytes = (area + 7) // 8
+    bits = packed[:, :len(planes) * num_bytes].reshape(n, len(planes), num_bytes)
+    unpacked = np.unpackbits(bits, axis=-1, count=area).reshape(n, len(planes), board_size, board_size)
+    out[:, planes] = unpacked
+    out[:, scalars] = packed[:, len(planes) * num_bytes:, np.newaxis, np.newaxis]
+    return out
+
+
 def random_symmetry(image):
     """
     Returns a random symmetry of the image
@@ -0,0 +1,79 @@
+import numpy as np
+
+from gym_go import govars
+
+"""
+Ring buffer of the most recent board planes
+
+The black and white planes of the last `history_len` positions are kept in a buffer of
+2 * history_len slots (2 channels each). Every position is written twice, at slot `p` and its
+mirror `p + history_len`, so the last `history_len` positions are always the contiguous slots
+[head, head + history_len). The slot right after the window is the mirror of the oldest
+position, which is overwritten by the next push anyway, so the extra channels (e.g. turn) are
+written there. This makes the stacked observation
+
+    [black_{t-T+1}, white_{t-T+1}, ..., black_t, white_t, *extra_chnls]
+
+of shape (2 * history_len + k, SIZE, SIZE) a view into the buffer. Each push writes
+2 * 2 + k planes and never reallocates.
+"""
+
+
+class BoardHistory:
+    def __init__(self, size, history_len=govars.NO_TIMESTEPS, batch_size=None, extra_chnls=(govars.TURN_CHNL,),
+                 dtype=np.float32):
+        """
+        @param size: board size
+        @param history_len: number of positions kept
+        @param batch_size: None for a single env, otherwise the number of envs of a vector env
+        @param extra_chnls: state channels appended after the board planes (at most 2)
+        @param dtype: dtype of the buffer
+        """
+        assert history_len > 0
+        assert len(extra_chnls) <= 2, 'At most 2 extra channels fit after the history window'
+        self.size = size
+        self.history_len = history_len
+        self.batch_size = batch_size
+        self.extra_chnls = list(extra_chnls)
+        self.num_chnls = 2 * history_len + len(self.extra_chnls)
+
+        batch_shape = () if batch_size is None else (batch_size,)
+        self.buffer = np.zeros((*batch_shape, 2 * 2 * history_len, size, size), dtype=dtype)
+        self.head = 0
+
+    def reset(self, idcs=None):
+        """
+        Clears the history to empty boards
+        :param idcs: batch indices to clear, all if None
+        """
+        if idcs is None:
+            self.buffer[...] = 0
+        else:
+            self.buffer[idcs] = 0
+
+    def push(self, state):
+        """
+        Adds the position of the state(s) as the most recent board
+        :param state: (NUM_CHNLS, SIZE, SIZE) or (B, NUM_CHNLS, SIZE, SIZE) for batched histories
+        """
+        buffer = self.buffer if self.batch_size is None else np.moveaxis(self.buffer, 0, 1)
+        state = state if self.batch_size is None else np.moveaxis(state, 0, 1)
+        pieces = state[[govars.BLACK, govars.WHITE]]
+
+        # The oldest position expires and its slot receives the newest one
+        slot = self.head
+        buffer[2 * slot:2 * slot + 2] = pieces
+        buffer[2 * (slot + self.history_len):2 * (slot + self.history_len) + 2] = pieces
+        self.head = (self.head + 1) % self.history_len
+
+        if self.extra_chnls:
+            start = 2 * (self.head + self.history_len)
+            buffer[start:start + len(self.extra_chnls)] = state[self.extra_chnls]
+
+    def observation(self):
+        """
+        The returned array is a view into the buffer and changes with every push
+        :return: (2 * history_len + k, SIZE, SIZE) or (B, 2 * history_len + k, SIZE, SIZE) stacked history
+        """
+        start = 2 * self.head
+        return self.buffer[..., start:start + self.num_chnls, :, :]
@@ -0,0 +1,279 @@
+import numpy as np
+
+from gym_go import gogame, govars
+
+"""
+Numba compiled rule engine
+
+Implements group finding, liberty counting, captures and move legality as plain loops over the board,
+which avoids the call overhead of the many small scipy calls of `gogame` on small boards.
+The resulting states are bit-identical to the ones of `gogame`.
+
+Kernels are compiled on first use and cached on disk (numba's `cache=True`),
+so later runs load them instead of compiling again.
+If numba is not installed, the functions fall back to `gogame`.
+"""
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+available = numba is not None
+
+BLACK = govars.BLACK
+WHITE = govars.WHITE
+TURN_CHNL = govars.TURN_CHNL
+INVD_CHNL = govars.INVD_CHNL
+PASS_CHNL = govars.PASS_CHNL
+DONE_CHNL = govars.DONE_CHNL
+
+# Same order as state_utils.neighbor_deltas
+NEIGHBOR_DR = (-1, 1, 0, 0)
+NEIGHBOR_DC = (0, 0, -1, 1)
+
+
+def _jit(fn):
+    if numba is None:
+        return fn
+    return numba.njit(cache=True, nogil=True)(fn)
+
+
+@_jit
+def _label(pieces, labels, stack):
+    """
+    Labels the 4-connected groups of pieces in place
+    :param pieces: (SIZE, SIZE) pieces of one player
+    :param labels: (SIZE, SIZE) int array, overwritten with 0 for no group and 1..N for the groups
+    :param stack: (SIZE * SIZE, 2) int scratch space
+    :return: N
+    """
+    m, n = pieces.shape
+    labels[:] = 0
+    num_groups = 0
+    for i in range(m):
+        for j in range(n):
+            if pieces[i, j] > 0 and labels[i, j] == 0:
+                num_groups += 1
+                labels[i, j] = num_groups
+                stack[0, 0] = i
+                stack[0, 1] = j
+                top = 1
+                while top > 0:
+                    top -= 1
+                    r = stack[top, 0]
+                    c = stack[top, 1]
+                    for d in range(4):
+                        nr = r + NEIGHBOR_DR[d]
+                        nc = c + NEIGHBOR_DC[d]
+                        if 0 <= nr < m and 0 <= nc < n and pieces[nr, nc] > 0 and labels[nr, nc] == 0:
+                            labels[nr, nc] = num_groups
+                            stack[top, 0] = nr
+                            stack[top, 1] = nc
+                            top += 1
+    return num_groups
+
+
+@_jit
+def _liberty_counts(labels, num_groups, all_pieces):
+    """
+    :return: (N + 1,) number of distinct empty points adjacent to each group (index 0 is unused)
+    """
+    m, n = labels.shape
+    counts = np.zeros(num_groups + 1, dtype=np.int64)
+    adj = np.zeros(4, dtype=np.int64)
+    for i in range(m):
+        for j in range(n):
+            if all_pieces[i, j] > 0:
+                continue
+            num_adj = 0
+            for d in range(4):
+                nr = i + NEIGHBOR_DR[d]
+                nc = j + NEIGHBOR_DC[d]
+                if 0 <= nr < m and 0 <= nc < n and labels[nr, nc] > 0:
+                    label = labels[nr, nc]
+                    seen = False
+                    for k in range(num_adj):
+                        if adj[k] == label:
+                            seen = True
+                    if not seen:
+                        adj[num_adj] = label
+                        num_adj += 1
+                        counts[label] += 1
+    return counts
+
+
+@_jit
+def _compute_invalid_moves(state, player, ko_r, ko_c, out):
+    """
+    Same as state_utils.compute_invalid_moves. Writes the invalid moves of the OPPONENT of `player` into out
+    """
+    m, n = state.shape[1:]
+    all_pieces = state[BLACK] + state[WHITE]
+    own_labels = np.empty((m, n), dtype=np.int64)
+    opp_labels = np.empty((m, n), dtype=np.int64)
+    stack = np.empty((m * n, 2), dtype=np.int64)
+    num_own = _label(state[player], own_labels, stack)
+    num_opp = _label(state[1 - player], opp_labels, stack)
+    own_libs = _liberty_counts(own_labels, num_own, all_pieces)
+    opp_libs = _liberty_counts(opp_labels, num_opp, all_pieces)
+
+    for i in range(m):
+        for j in range(n):
+            if all_pieces[i, j] > 0:
+                out[i, j] = 1
+                continue
+
+            out[i, j] = 0
+            surrounded = True
+            possible_invalid = False
+            definite_valid = False
+            for d in range(4):
+                nr = i + NEIGHBOR_DR[d]
+                nc = j + NEIGHBOR_DC[d]
+                if not (0 <= nr < m and 0 <= nc < n):
+                    continue
+                if all_pieces[nr, nc] == 0:
+                    surrounded = False
+                own = own_labels[nr, nc]
+                opp = opp_labels[nr, nc]
+                if own > 0:
+                    if own_libs[own] > 1:
+                        possible_invalid = True
+                    else:
+                        definite_valid = True
+                if opp > 0:
+                    if opp_libs[opp] == 1:
+                        possible_invalid = True
+                    else:
+                        definite_valid = True
+
+            if surrounded and possible_invalid and not definite_valid:
+                out[i, j] = 1
+
+    if ko_r >= 0:
+        out[ko_r, ko_c] = 1
+
+
+@_jit
+def _next_state(state, action1d):
+    """
+    Same as gogame.next_state (non-canonical), modifies the state in place
+    """
+    m, n = state.shape[1:]
+    player = int(state[TURN_CHNL, 0, 0])
+    previously_passed = state[PASS_CHNL, 0, 0] == 1
+    ko_r, ko_c = -1, -1
+
+    if action1d == m * n:
+        state[PASS_CHNL] = 1
+        if previously_passed:
+            state[DONE_CHNL] = 1
+    else:
+        state[PASS_CHNL] = 0
+        r, c = action1d // m, action1d % n
+        state[player, r, c] = 1
+        opponent = 1 - player
+
+        # Whether the piece is surrounded by opponent's pieces
+        surrounded = True
+        for d in range(4):
+            nr = r + NEIGHBOR_DR[d]
+            nc = c + NEIGHBOR_DC[d]
+            if 0 <= nr < m and 0 <= nc < n and state[opponent, nr, nc] <= 0:
+                surrounded = False
+
+        # Kill adjacent opponent groups without liberties
+        opp_labels = np.empty((m, n), dtype=np.int64)
+        stack = np.empty((m * n, 2), dtype=np.int64)
+        num_opp = _label(state[opponent], opp_labels, stack)
+        all_pieces = state[BLACK] + state[WHITE]
+        opp_libs = _liberty_counts(opp_labels, num_opp, all_pieces)
+
+        killed = np.zeros(num_opp + 1, dtype=np.bool_)
+        num_killed_groups = 0
+        for d in range(4):
+            nr = r + NEIGHBOR_DR[d]
+            nc = c + NEIGHBOR_DC[d]
+            if 0 <= nr < m and 0 <= nc < n:
+                label = opp_labels[nr, nc]
+                if label > 0 and opp_libs[label] == 0 and not killed[label]:
+                    killed[label] = True
+                    num_killed_groups += 1
+
+        num_killed_pieces = 0
+        for i in range(m):
+            for j in range(n):
+                if killed[opp_labels[i, j]] and opp_labels[i, j] > 0:
+                    state[opponent, i, j] = 0
+                    num_killed_pieces += 1
+                    ko_r, ko_c = i, j
+
+        # If only killed one group, and that one group was one piece, and piece set is surrounded,
+        # activate ko protection
+        if not (num_killed_groups == 1 and num_killed_pieces == 1 and surrounded):
+            ko_r, ko_c = -1, -1
+
+    # Update invalid moves
+    _compute_invalid_moves(state, player, ko_r, ko_c, state[INVD_CHNL])
+
+    # Switch turn
+    state[TURN_CHNL] = 1 - state[TURN_CHNL]
+
+
+@_jit
+def _batch_next_states(batch_states, batch_action1d):
+    for i in range(len(batch_states)):
+        _next_state(batch_states[i], batch_action1d[i])
+
+
+def _check_valid(batch_states, batch_action1d):
+    board_shape = batch_states.shape[2:]
+    non_pass = np.nonzero(batch_action1d != np.prod(board_shape))[0]
+    actions = batch_action1d[non_pass]
+    assert (batch_states[non_pass, govars.INVD_CHNL, actions // board_shape[0], actions % board_shape[1]] == 0).all(), \
+        ("Invalid move", actions)
+
+
+def next_state(state, action1d, canonical=False):
+    if not available:
+        return gogame.next_state(state, action1d, canonical)
+
+    # Deep copy the state to modify
+    state = np.array(state, order='C')
+    _check_valid(state[np.newaxis], np.array([action1d]))
+    _next_state(state, int(action1d))
+
+    if canonical:
+        state = gogame.canonical_form(state)
+    return state
+
+
+def batch_next_states(batch_states, batch_action1d, canonical=False):
+    if not available:
+        return gogame.batch_next_states(batch_states, batch_action1d, canonical)
+
+    # Deep copy the states to modify
+    batch_states = np.array(batch_states, order='C')
+    batch_action1d = np.asarray(batch_action1d, dtype=np.int64)
+    _check_valid(batch_states, batch_action1d)
+    _batch_next_states(batch_states, batch_action1d)
+
+    if canonical:
+        batch_states = gogame.batch_canonical_form(batch_states)
+    return batch_states
+
+
+def compute_invalid_moves(state, player, ko_protect=None):
+    """
+    Same as state_utils.compute_invalid_moves
+    """
+    if not available:
+        from gym_go import state_utils
+        return state_utils.compute_invalid_moves(state, player, ko_protect)
+
+    state = np.ascontiguousarray(state, dtype=np.float64)
+    invalid_moves = np.empty(state.shape[1:])
+    ko_r, ko_c = (-1, -1) if ko_protect is None else ko_protect
+    _compute_invalid_moves(state, player, ko_r, ko_c, invalid_moves)
+    return invalid_moves > 0
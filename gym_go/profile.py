@@ -0,0 +1,194 @@
+"""
+Profile the Go engine under self-play
+
+Plays a number of games with a random or scripted policy through the low level
+`gogame` API under cProfile and writes:
+* `engine.prof` - the raw cProfile dump (loadable with pstats/snakeviz)
+* `hotspots_<key>.txt` - hotspot tables sorted by each requested key
+* `engine.collapsed` - collapsed stacks consumable by flamegraph.pl / speedscope
+* `summary.txt` - games, moves and throughput
+
+Usage:
+    python -m gym_go.profile --games 64 --boardsize 9 --batchsize 8 --policy random --out profile_out
+"""
+import argparse
+import cProfile
+import os
+import pstats
+import time
+
+import numpy as np
+
+from gym_go import gogame
+
+
+def random_actions(batch_valid_moves, rng):
+    """
+    Uniformly random valid moves, but does not pass if another move is possible
+    :param batch_valid_moves: (B, ACTION_SIZE) binary array
+    :return: (B,) 1D actions
+    """
+    weights = np.copy(batch_valid_moves)
+    can_play = weights[:, :-1].sum(axis=1) > 0
+    weights[can_play, -1] = 0
+    weights /= weights.sum(axis=1, keepdims=True)
+    cum_weights = np.cumsum(weights, axis=1)
+    samples = rng.random((len(weights), 1))
+    actions = (cum_weights < samples).sum(axis=1)
+    return np.minimum(actions, weights.shape[1] - 1)
+
+
+def scripted_actions(batch_valid_moves, rng=None):
+    """
+    Deterministically plays the lowest indexed valid move, passing only when nothing else is possible
+    :param batch_valid_moves: (B, ACTION_SIZE) binary array
+    :return: (B,) 1D actions
+    """
+    return np.argmax(batch_valid_moves, axis=1)
+
+
+POLICIES = {
+    'random': random_actions,
+    'scripted': scripted_actions,
+}
+
+
+def play_games(num_games, board_size, batch_size, policy='random', seed=None, max_steps=None, backend=None):
+    """
+    Plays `num_games` games in waves of `batch_size` boards.
+    A batch size of 1 goes through the single state API (`next_state`),
+    otherwise the batched API (`batch_next_states`) is used.
+    :param backend: rule engine backend (see gym_go.backends)
+    :return: Number of moves played
+    """
+    rng = np.random.default_rng(seed)
+    policy_fn = POLICIES[policy]
+    if max_steps is None:
+        max_steps = 2 * board_size ** 2
+
+    num_moves = 0
+    games_left = num_games
+    while games_left > 0:
+        n = min(batch_size, games_left)
+        games_left -= n
+
+        if batch_size == 1:
+            state = gogame.init_state(board_size)
+            for _ in range(max_steps):
+                valid_moves = gogame.valid_moves(state)
+                action = policy_fn(valid_moves[np.newaxis], rng)[0]
+                state = gogame.next_state(state, action, backend=backend)
+                num_moves += 1
+                if gogame.game_ended(state):
+                    break
+        else:
+            batch_states = gogame.batch_init_state(n, board_size)
+            active = np.arange(n)
+            for _ in range(max_steps):
+                active_states = batch_states[active]
+                batch_valid_moves = gogame.batch_valid_moves(active_states)
+                actions = policy_fn(batch_valid_moves, rng)
+                batch_states[active] = gogame.batch_next_states(active_states, actions, backend=backend)
+                num_moves += len(active)
+                active = active[gogame.batch_game_ended(batch_states[active]) == 0]
+                if len(active) == 0:
+                    break
+
+    return num_moves
+
+
+def collapsed_stacks(stats):
+    """
+    Approximates collapsed stacks from cProfile's caller/callee graph.
+    cProfile only records single caller edges, so the time of a function is split among its
+    callers proportionally to the cumulative time each caller attributed to it.
+    :param stats: pstats.Stats
+    :return: dict of 'root;...;leaf' -> microseconds of self time
+    """
+    raw = stats.stats
+    callees = {func: [] for func in raw}
+    for func, (_, _, _, _, callers) in raw.items():
+        for caller, edge in callers.items():
+            if caller in callees:
+                callees[caller].append((func, edge[3]))
+
+    def label(func):
+        filename, lineno, name = func
+        if filename == '~':
+            return name
+        return '{}:{}({})'.format(os.path.basename(filename), lineno, name)
+
+    stacks = {}
+
+    def walk(func, path, weight):
+        _, _, tottime, cumtime, _ = raw[func]
+        path = path + (label(func),)
+        self_us = int(round(tottime * weight * 1e6))
+        if self_us > 0:
+            key = ';'.join(path)
+            stacks[key] = stacks.get(key, 0) + self_us
+        for callee, edge_cumtime in callees[func]:
+            callee_cumtime = raw[callee][3]
+            if callee_cumtime <= 0 or label(callee) in path:
+                continue
+            walk(callee, path, weight * edge_cumtime / callee_cumtime)
+
+    roots = [func for func, (_, _, _, _, callers) in raw.items()
+             if not any(caller in raw for caller in callers)]
+    for root in roots:
+        walk(root, (), 1.0)
+
+    return stacks
+
+
+def write_reports(profiler, out_dir, sort_keys, limit):
+    os.makedirs(out_dir, exist_ok=True)
+    profiler.dump_stats(os.path.join(out_dir, 'engine.prof'))
+
+    for key in sort_keys:
+        with open(os.path.join(out_dir, 'hotspots_{}.txt'.format(key)), 'w') as f:
+            stats = pstats.Stats(profiler, stream=f)
+            stats.strip_dirs().sort_stats(key).print_stats(limit)
+
+    stacks = collapsed_stacks(pstats.Stats(profiler))
+    with open(os.path.join(out_dir, 'engine.collapsed'), 'w') as f:
+        for stack, us in sorted(stacks.items()):
+            f.write('{} {}\n'.format(stack, us))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Profile the Go engine under self-play')
+    parser.add_argument('--games', type=int, default=32)
+    parser.add_argument('--boardsize', type=int, default=9)
+    parser.add_argument('--batchsize', type=int, default=1)
+    parser.add_argument('--policy', choices=sorted(POLICIES), default='random')
+    parser.add_argument('--max-steps', type=int, default=None)
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--backend', default=None)
+    parser.add_argument('--sort', nargs='+', default=['cumulative', 'tottime'])
+    parser.add_argument('--limit', type=int, default=40)
+    parser.add_argument('--out', default='profile_out')
+    args = parser.parse_args(argv)
+
+    profiler = cProfile.Profile()
+    start = time.time()
+    profiler.enable()
+    num_moves = play_games(args.games, args.boardsize, args.batchsize, args.policy, args.seed, args.max_steps,
+                           args.backend)
+    profiler.disable()
+    dur = time.time() - start
+
+    write_reports(profiler, args.out, args.sort, args.limit)
+
+    summary = (f"Games: {args.games}, Board size: {args.boardsize}, Batch size: {args.batchsize}, "
+               f"Policy: {args.policy}, Backend: {args.backend or 'scipy'}\n"
+               f"Moves: {num_moves}, Time: {dur:.3f} SEC, {num_moves / dur:.1f} MOVES/SEC, "
+               f"{args.games / dur:.2f} GAMES/SEC\n")
+    with open(os.path.join(args.out, 'summary.txt'), 'w') as f:
+        f.write(summary)
+    print(summary, end='')
+    print(f"Reports written to {args.out}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,327 @@
+"""
+Streaming SGF loader
+
+Reads SGF game records lazily from files or directories (one game in memory at a time, files are read in
+chunks), replays them through the batched engine in chunks of games and writes the resulting
+states, actions and outcomes to disk, one `.npz` file per chunk:
+* `states` - (N, NUM_CHNLS, SIZE, SIZE) uint8 states before each move
+* `actions` - (N,) int16 1D actions
+* `outcomes` - (N,) int8 game result in black's perspective (1 black won, -1 white won, 0 draw or unknown)
+* `game_idcs` - (N,) int32 index of the game in the converted corpus
+
+Only the main line of each record is used. Games with setup stones (e.g. handicap) or non-alternating
+moves are skipped, and games are truncated at the first move that is illegal under these rules.
+
+Usage:
+    python -m gym_go.sgf games/ more_games.sgf --boardsize 19 --out sgf_out --chunksize 64 --backend numba
+"""
+import argparse
+import collections
+import os
+import re
+import time
+
+import numpy as np
+
+from gym_go import gogame, govars
+
+SgfGame = collections.namedtuple('SgfGame', ['size', 'komi', 'result', 'actions'])
+
+_special_re = re.compile(r'[\[()]')
+_value_end_re = re.compile(r'(?:\\.|[^\]\\])*\]', re.S)
+_token_re = re.compile(r'\s*(?:(\()|(\))|(;)|([A-Za-z]+)\s*((?:\[(?:\\.|[^\]\\])*\]\s*)+))', re.S)
+_value_re = re.compile(r'\[((?:\\.|[^\]\\])*)\]', re.S)
+
+SETUP_PROPERTIES = {'AB', 'AW', 'AE'}
+
+
+def iter_sgf_paths(paths):
+    """
+    :param paths: SGF files or directories, which are searched recursively for .sgf files
+    :return: generator of SGF file paths
+    """
+    for path in paths:
+        if os.path.isdir(path):
+            for root, dirs, files in os.walk(path):
+                dirs.sort()
+                for name in sorted(files):
+                    if name.lower().endswith('.sgf'):
+                        yield os.path.join(root, name)
+        else:
+            yield path
+
+
+def iter_game_texts(f, read_size=1 << 20):
+    """
+    Splits a (possibly huge) SGF collection into the texts of its top level game trees
+    without reading the whole file
+    :param f: text file object
+    :return: generator of game tree strings
+    """
+    buffer = ''
+    pos = 0
+    depth = 0
+    start = None
+    eof = False
+    while True:
+        match = _special_re.search(buffer, pos)
+        end = None
+        if match is not None and match.group() == '[':
+            end = _value_end_re.match(buffer, match.end())
+
+        if match is None or (match.group() == '[' and end is None):
+            # Need more data
+            if eof:
+                return
+            keep_from = start if start is not None else (pos if match is None else match.start())
+            buffer = buffer[keep_from:]
+            pos -= keep_from
+            if match is not None:
+                pos = match.start() - keep_from
+            if start is not None:
+                start = 0
+            chunk = f.read(read_size)
+            eof = not chunk
+            buffer += chunk
+            continue
+
+        char = match.group()
+        if char == '[':
+            pos = end.end()
+        elif char == '(':
+            if depth == 0:
+                start = match.start()
+            depth += 1
+            pos = match.end()
+        else:
+            pos = match.end()
+            if depth > 0:
+                depth -= 1
+                if depth == 0:
+                    yield buffer[start:pos]
+                    buffer = buffer[pos:]
+                    pos = 0
+                    start = None
+
+
+def _result(value):
+    value = value.strip().upper()
+    if value.startswith('B+'):
+        return 1
+    if value.startswith('W+'):
+        return -1
+    return 0
+
+
+def parse_game(text):
+    """
+    :param text: SGF game tree
+    :return: SgfGame of the main line, None if the record is malformed or not supported
+    """
+    size, komi, result = 19, 0.0, 0
+    actions = []
+    expected_color = 'B'
+
+    # Per open game tree, whether its first variation was already seen
+    child_seen = []
+    skip_depth = None
+    pos = 0
+    while pos < len(text):
+        match = _token_re.match(text, pos)
+        if match is None:
+            if text[pos:].strip() == '':
+                break
+            return None
+        pos = match.end()
+        open_tree, close_tree, _, ident, values = match.groups()
+
+        if open_tree:
+            if skip_depth is None and child_seen and child_seen[-1]:
+                # Only the first variation is the main line
+                skip_depth = len(child_seen)
+            if child_seen:
+                child_seen[-1] = True
+            child_seen.append(False)
+        elif close_tree:
+            if not child_seen:
+                return None
+            child_seen.pop()
+            if skip_depth is not None and len(child_seen) == skip_depth:
+                skip_depth = None
+        elif ident and skip_depth is None:
+            ident = ident.upper()
+            values = _value_re.findall(values)
+            if ident == 'SZ':
+                try:
+                    size = int(values[0].split(':')[0])
+                except ValueError:
+                    return None
+            elif ident == 'KM':
+                try:
+                    komi = float(values[0])
+                except ValueError:
+                    komi = 0.0
+            elif ident == 'RE':
+                result = _result(values[0])
+            elif ident in SETUP_PROPERTIES:
+                return None
+            elif ident in ('B', 'W'):
+                if ident != expected_color:
+                    return None
+                expected_color = 'W' if ident == 'B' else 'B'
+                move = values[0].strip()
+                if move == '' or (move == 'tt' and size <= 19):
+                    actions.append(size ** 2)
+                else:
+                    if len(move) != 2:
+                        return None
+                    col, row = ord(move[0]) - ord('a'), ord(move[1]) - ord('a')
+                    if not (0 <= row < size and 0 <= col < size):
+                        return None
+                    actions.append(row * size + col)
+
+    return SgfGame(size, komi, result, np.array(actions, dtype=np.int16))
+
+
+def iter_games(paths, stats=None):
+    """
+    :param paths: SGF files or directories
+    :param stats: optional dict which counts 'files', 'games_read' and 'games_skipped'
+    :return: generator of SgfGame
+    """
+    if stats is None:
+        stats = {}
+    for path in iter_sgf_paths(paths):
+        stats['files'] = stats.get('files', 0) + 1
+        with open(path, encoding='utf-8', errors='replace') as f:
+            for text in iter_game_texts(f):
+                stats['games_read'] = stats.get('games_read', 0) + 1
+                game = parse_game(text)
+                if game is None:
+                    stats['games_skipped'] = stats.get('games_skipped', 0) + 1
+                    continue
+                yield game
+
+
+def replay_chunk(games, backend=None):
+    """
+    Replays a chunk of games of the same board size synchronously through batch_next_states.
+    Games are truncated at the first illegal move or move after the game ended.
+    :return: states, actions, outcomes, chunk game indices, number of truncated games
+    """
+    n = len(games)
+    size = games[0].size
+    lengths = np.array([len(game.actions) for game in games])
+    max_length = lengths.max(initial=0)
+    padded_actions = np.full((n, max_length), size ** 2, dtype=np.int64)
+    for i, game in enumerate(games):
+        padded_actions[i, :len(game.actions)] = game.actions
+    results = np.array([game.result for game in games], dtype=np.int8)
+
+    batch_states = gogame.batch_init_state(n, size)
+    active = np.nonzero(lengths > 0)[0]
+    num_truncated = 0
+    all_states, all_actions, all_game_idcs = [], [], []
+    for t in range(max_length):
+        states = batch_states[active]
+        actions = padded_actions[active, t]
+
+        # Drop games whose recorded move is illegal here
+        flat_invalid = states[:, govars.INVD_CHNL].reshape(len(active), -1)
+        non_pass = actions < size ** 2
+        illegal = np.zeros(len(active), dtype=bool)
+        illegal[non_pass] = flat_invalid[non_pass, actions[non_pass]] > 0
+        illegal |= gogame.batch_game_ended(states) > 0
+        if illegal.any():
+            num_truncated += np.count_nonzero(illegal)
+            active, states, actions = active[~illegal], states[~illegal], actions[~illegal]
+
+        all_states.append(states.astype(np.uint8))
+        all_actions.append(actions.astype(np.int16))
+        all_game_idcs.append(active)
+        if len(active) > 0:
+            batch_states[active] = gogame.batch_next_states(states, actions, backend=backend)
+
+        active = active[lengths[active] > t + 1]
+        if len(active) == 0:
+            break
+
+    game_idcs = np.concatenate(all_game_idcs) if all_game_idcs else np.zeros(0, dtype=int)
+    states = np.concatenate(all_states) if all_states else np.zeros((0, govars.NUM_CHNLS, size, size), np.uint8)
+    actions = np.concatenate(all_actions) if all_actions else np.zeros(0, np.int16)
+    return states, actions, results[game_idcs], game_idcs, num_truncated
+
+
+def replay_games(games, board_size, chunk_size=64, backend=None, stats=None):
+    """
+    :param games: iterable of SgfGame, games of other board sizes are skipped
+    :return: generator of (states, actions, outcomes, game_idcs) per chunk of games,
+    game indices count the converted games
+    """
+    if stats is None:
+        stats = {}
+    num_games = 0
+    chunk = []
+    for game in games:
+        if game.size != board_size:
+            stats['games_other_size'] = stats.get('games_other_size', 0) + 1
+            continue
+        chunk.append(game)
+        if len(chunk) == chunk_size:
+            states, actions, outcomes, game_idcs, num_truncated = replay_chunk(chunk, backend)
+            stats['games_truncated'] = stats.get('games_truncated', 0) + num_truncated
+            yield states, actions, outcomes, (game_idcs + num_games).astype(np.int32)
+            num_games += len(chunk)
+            chunk = []
+    if chunk:
+        states, actions, outcomes, game_idcs, num_truncated = replay_chunk(chunk, backend)
+        stats['games_truncated'] = stats.get('games_truncated', 0) + num_truncated
+        yield states, actions, outcomes, (game_idcs + num_games).astype(np.int32)
+        num_games += len(chunk)
+    stats['games_converted'] = num_games
+
+
+def convert(paths, out_dir, board_size=19, chunk_size=64, backend=None):
+    """
+    Converts SGF files to chunks of states, actions and outcomes on disk
+    :return: dict of statistics, including games per second and games per CPU second (per core)
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    stats = {}
+    start, cpu_start = time.time(), time.process_time()
+    num_positions = 0
+    games = iter_games(paths, stats)
+    for i, (states, actions, outcomes, game_idcs) in enumerate(replay_games(games, board_size, chunk_size,
+                                                                             backend, stats)):
+        np.savez(os.path.join(out_dir, 'chunk_{:06d}.npz'.format(i)), states=states, actions=actions,
+                 outcomes=outcomes, game_idcs=game_idcs)
+        num_positions += len(actions)
+
+    stats['positions'] = num_positions
+    stats['seconds'] = time.time() - start
+    stats['cpu_seconds'] = time.process_time() - cpu_start
+    num_games = stats.get('games_converted', 0)
+    stats['games_per_sec'] = num_games / max(stats['seconds'], 1e-9)
+    stats['games_per_cpu_sec'] = num_games / max(stats['cpu_seconds'], 1e-9)
+    return stats
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Convert SGF game records to state tensors')
+    parser.add_argument('paths', nargs='+', help='SGF files or directories')
+    parser.add_argument('--boardsize', type=int, default=19)
+    parser.add_argument('--chunksize', type=int, default=64)
+    parser.add_argument('--backend', default=None)
+    parser.add_argument('--out', default='sgf_out')
+    args = parser.parse_args(argv)
+
+    stats = convert(args.paths, args.out, args.boardsize, args.chunksize, args.backend)
+    print(f"Files: {stats.get('files', 0)}, Games read: {stats.get('games_read', 0)}, "
+          f"Converted: {stats.get('games_converted', 0)}, Skipped: {stats.get('games_skipped', 0)}, "
+          f"Other size: {stats.get('games_other_size', 0)}, Truncated: {stats.get('games_truncated', 0)}")
+    print(f"Positions: {stats['positions']}, Time: {stats['seconds']:.1f} SEC, "
+          f"{stats['games_per_sec']:.1f} GAMES/SEC, {stats['games_per_cpu_sec']:.1f} GAMES/CPU SEC")
+
+
+if __name__ == '__main__':
+    main()
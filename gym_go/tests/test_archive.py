@@ -0,0 +1,77 @@
+import os
+import tempfile
+import unittest
+
+import numpy as np
+
+from gym_go import archive, gogame
+from gym_go.profile import random_actions
+
+
+def play_random_game(board_size, max_steps, rng):
+    state = gogame.init_state(board_size)
+    states, actions = [state], []
+    for _ in range(max_steps):
+        action = random_actions(gogame.valid_moves(state)[np.newaxis], rng)[0]
+        state = gogame.next_state(state, action)
+        states.append(state)
+        actions.append(action)
+        if gogame.game_ended(state):
+            break
+    return states, actions
+
+
+class TestArchive(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp_dir.name, 'games.goa')
+        rng = np.random.default_rng(0)
+        self.games = [(5, 0.5, 1, *play_random_game(5, 30, rng)), (7, 7.5, -1, *play_random_game(7, 40, rng)),
+                      (5, 0, 0, [gogame.init_state(5)], [])]
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def write(self, snapshot_interval):
+        with archive.ArchiveWriter(self.path, snapshot_interval) as writer:
+            for size, komi, result, _, actions in self.games:
+                writer.add_game(actions, size, komi, result)
+        return archive.GameArchive(self.path)
+
+    def test_metadata_and_actions(self):
+        games = self.write(0)
+        self.assertEqual(len(games), len(self.games))
+        for i, (size, komi, result, _, actions) in enumerate(self.games):
+            game = games[i]
+            self.assertEqual((game.size, game.komi, game.result), (size, komi, result))
+            np.testing.assert_array_equal(game.actions, actions)
+            # Zero-copy view into the memory-mapped file
+            if len(actions) > 0:
+                self.assertTrue(np.shares_memory(game.actions, games.data))
+
+    def test_states(self):
+        for snapshot_interval in [0, 1, 4]:
+            games = self.write(snapshot_interval)
+            for i, (_, _, _, states, _) in enumerate(self.games):
+                if snapshot_interval > 0 and len(states) > 1:
+                    self.assertEqual(len(games.snapshots(i)), (len(states) - 2) // snapshot_interval + 1)
+                for t in range(len(states)):
+                    np.testing.assert_array_equal(games.state(i, t), states[t])
+
+    def test_pack_snapshots(self):
+        _, _, _, states, _ = self.games[1]
+        states = np.array(states)
+        packed = archive.pack_snapshots(states)
+        self.assertEqual(packed.shape, (len(states), archive.snapshot_nbytes(7)))
+        np.testing.assert_array_equal(archive.unpack_snapshots(packed, 7), states)
+
+    def test_not_an_archive(self):
+        with open(self.path, 'wb') as f:
+            f.write(bytes(archive.HEADER_DTYPE.itemsize))
+        with self.assertRaises(ValueError):
+            archive.GameArchive(self.path)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,88 @@
+import unittest
+
+import gym
+import numpy as np
+
+from gym_go import backends, gogame, govars
+
+import test_invalid_moves
+import test_valid_moves
+
+
+class ReferenceCheckedEnv:
+    """
+    Env of a backend that steps an env of the reference backend alongside
+    and asserts that their states, legal masks and scores are identical after every step
+    """
+
+    def __init__(self, name, size):
+        self.name = name
+        self.env = gym.make('gym_go:go-v0', size=size, reward_method='real', backend=name)
+        self.reference_env = gym.make('gym_go:go-v0', size=size, reward_method='real')
+
+    def __getattr__(self, item):
+        return getattr(self.env, item)
+
+    def reset(self):
+        self.reference_env.reset()
+        return self.env.reset()
+
+    def step(self, action):
+        # The backend steps first, so the exceptions of invalid moves are its own
+        result = self.env.step(action)
+        self.reference_env.step(action)
+        backends.assert_equal_batch(self.name, self.env.state()[np.newaxis],
+                                    self.reference_env.state()[np.newaxis], action)
+        return result
+
+
+def backend_test_cases(test_cases):
+    """
+    :return: subclasses of the rule test cases for every other backend, whose envs are checked against the
+        reference after every step
+    """
+    subclasses = {}
+    for name in backends.available_backends():
+        if name == backends.REFERENCE:
+            continue
+
+        def make_env(self, size, name=name):
+            return ReferenceCheckedEnv(name, size)
+
+        for test_case in test_cases:
+            subclass = type(test_case.__name__ + name.capitalize(), (test_case,), {'make_env': make_env})
+            subclasses[subclass.__name__] = subclass
+    return subclasses
+
+
+globals().update(backend_test_cases([test_valid_moves.TestGoEnvValidMoves, test_invalid_moves.TestGoEnvInvalidMoves]))
+
+
+class TestBackends(unittest.TestCase):
+
+    def test_registry(self):
+        self.assertIn(backends.REFERENCE, backends.available_backends())
+        self.assertIs(backends.get_backend(), gogame)
+        with self.assertRaises(ValueError):
+            backends.get_backend('unknown')
+
+    def test_random_games(self):
+        for board_size in [3, 5, 7]:
+            num_moves = backends.verify_backends(num_games=8, board_size=board_size, batch_size=4, seed=0)
+            self.assertGreater(num_moves, 0)
+
+    def test_env_backend(self):
+        for name in backends.available_backends():
+            env = gym.make('gym_go:go-v0', size=7, backend=name)
+            env.reset()
+            for move in [(0, 1), (0, 2), (1, 0), (1, 3), (2, 1), (2, 2), (1, 2), (1, 1)]:
+                env.step(move)
+            self.assertEqual(env.state()[govars.INVD_CHNL, 1, 2], 1)
+            env.close()
+
+        with self.assertRaises(ValueError):
+            gym.make('gym_go:go-v0', size=7, backend='unknown')
+
+
+if __name__ == '__main__':
+    unittest.main()
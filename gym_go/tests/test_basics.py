@@ -1,9 +1,12 @@
+import pickle
 import unittest
+from unittest import mock
 
 import gym
 import numpy as np
 
-from gym_go import govars
+from gym_go import gogame, govars
+from gym_go.envs import GoEnv
 
 
 class TestGoEnvBasics(unittest.TestCase):
@@ -67,6 +70,13 @@ class TestGoEnvBasics(unittest.TestCase):
             self.assertIn('turn', info)
             self.assertEqual(info['turn'], 1 if i % 2 == 0 else 0)
 
+    def test_pickle_info(self):
+        _, _, _, info = self.env.step((0, 0))
+        unpickled = pickle.loads(pickle.dumps(info))
+        self.assertEqual(unpickled['turn'], 1)
+        self.assertEqual(set(unpickled), set(info))
+        self.assertTrue((unpickled['invalid_moves'] == info['invalid_moves']).all())
+
     def test_multiple_action_formats(self):
         for _ in range(10):
             action_1d = np.random.randint(50)
@@ -288,6 +298,50 @@ class TestGoEnvBasics(unittest.TestCase):
 
         env.close()
 
+    def test_lazy_info(self):
+        state, reward, done, info = self.env.step((0, 0))
+        self.assertEqual(dict.__len__(info), 0)
+        self.assertIn('invalid_moves', info)
+        self.assertEqual(info['turn'], 1)
+        self.assertEqual(dict.__len__(info), 1)
+        self.assertTrue((info['invalid_moves'] == self.env.gogame.invalid_moves(self.env.state())).all())
+        self.assertIs(self.env.info(), info)
+
+        # Values are bound to the state of their step
+        self.env.step((1, 1))
+        self.assertIsNot(self.env.info(), info)
+        self.assertEqual(info['turn'], 1)
+        self.assertEqual(self.env.info()['turn'], 0)
+        self.assertEqual(set(info.keys()), {'turn', 'invalid_moves', 'prev_player_passed'})
+        self.assertFalse(dict(info)['prev_player_passed'])
+
+    def test_no_intermediate_heuristic_reward(self):
+        env = gym.make('gym_go:go-v0', size=7, reward_method='heuristic', intermediate_rewards=False)
+        env.reset()
+
+        state, reward, done, info = env.step((0, 0))
+        self.assertEqual(reward, 0)
+        state, reward, done, info = env.step(None)
+        self.assertEqual(reward, 0)
+        state, reward, done, info = env.step(None)
+        self.assertEqual(reward, 49)
+
+        env.close()
+
+    def test_rewards_score_finished_games_only(self):
+        for reward_method, intermediate_rewards in [('real', True), ('heuristic', False)]:
+            env = GoEnv(size=7, reward_method=reward_method, intermediate_rewards=intermediate_rewards)
+            env.reset()
+            with mock.patch.object(gogame, 'areas', wraps=gogame.areas) as areas:
+                for action in [0, 1, 2]:
+                    env.step(action)
+                self.assertEqual(areas.call_count, 0, reward_method)
+                env.step(None)
+                _, reward, done, _ = env.step(None)
+                self.assertTrue(done)
+                self.assertEqual(areas.call_count, 1, reward_method)
+            env.close()
+
 
 if __name__ == '__main__':
     unittest.main()
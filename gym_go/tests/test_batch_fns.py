@@ -1,5 +1,7 @@
 import unittest
 
+import numpy as np
+
 from gym_go import gogame, govars
 
 
@@ -33,6 +35,39 @@ class TestBatchFns(unittest.TestCase):
 
         self.assertTrue((canon_again == states).all())
 
+    def test_batch_next_states_mixed_passes(self):
+        # Board 1 captures the black corner stone while board 0 passes, board 0 is empty at the corner
+        states = gogame.batch_init_state(2, 5)
+        states[0] = gogame.next_state(states[0], 24)
+        for action in [0, 1, 24]:
+            states[1] = gogame.next_state(states[1], action)
+
+        actions = np.array([25, 5])
+        next_states = gogame.batch_next_states(states, actions)
+        for i in range(2):
+            self.assertTrue((next_states[i] == gogame.next_state(states[i], actions[i])).all())
+        self.assertEqual(next_states[1, govars.BLACK, 0, 0], 0)
+
+    def test_pack_states(self):
+        states = gogame.batch_init_state(4, 7)
+        for i in range(1, 4):
+            for _ in range(10 * i):
+                states[i] = gogame.next_state(states[i], gogame.random_action(states[i]))
+
+        packed = gogame.pack_states(states)
+        self.assertEqual(packed.shape, (4, gogame.packed_size(7)))
+        self.assertEqual(packed.dtype, np.uint8)
+        self.assertTrue((gogame.unpack_states(packed, 7) == states).all())
+
+        # Observations only have the first 3 channels
+        observations = states[:, :3]
+        packed = gogame.pack_states(observations)
+        self.assertEqual(packed.shape, (4, gogame.packed_size(7, 3)))
+        out = np.empty((4, 3, 7, 7), dtype=np.float32)
+        unpacked = gogame.unpack_states(packed, 7, num_chnls=3, out=out)
+        self.assertIs(unpacked, out)
+        self.assertTrue((out == observations).all())
+
 
 if __name__ == '__main__':
     unittest.main()
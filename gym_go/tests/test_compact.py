@@ -0,0 +1,103 @@
+import unittest
+
+import numpy as np
+
+from gym_go import gogame, govars
+from gym_go.compact import CompactState
+from gym_go.envs import GoEnv
+
+
+class TestCompactState(unittest.TestCase):
+
+    def test_random_games(self):
+        for size in [3, 5, 7]:
+            for _ in range(10):
+                state = gogame.init_state(size)
+                compact = CompactState.init(size)
+                for _ in range(3 * size ** 2):
+                    self.assertTrue((compact.to_state() == state).all())
+                    self.assertTrue((compact.valid_moves() == gogame.valid_moves(state)).all())
+                    self.assertEqual(compact.turn, gogame.turn(state))
+                    self.assertEqual(compact.passed, gogame.prev_player_passed(state))
+                    self.assertEqual(compact.done, gogame.game_ended(state))
+
+                    from_state = CompactState.from_state(state)
+                    self.assertEqual(from_state.ko, compact.ko)
+                    self.assertTrue((from_state.to_state() == state).all())
+
+                    if compact.done:
+                        break
+                    action = gogame.random_action(state)
+                    state = gogame.next_state(state, action)
+                    compact = compact.next_state(action)
+
+    def test_ko(self):
+        """
+        _,   B,   W,   _,
+
+        B,   W,   _,   W,
+
+        _,   B,   W,   _,
+
+        _,   _,   _,   _,
+        """
+        compact = CompactState.init(4)
+        for move in [(0, 1), (0, 2), (1, 0), (1, 3), (2, 1), (2, 2), None, (1, 1)]:
+            compact = compact.next_state(4 ** 2 if move is None else move[0] * 4 + move[1])
+        compact = compact.next_state(1 * 4 + 2)
+        self.assertEqual(compact.ko, 1 * 4 + 1)
+        self.assertTrue(compact.invalid_moves()[1, 1])
+        state = compact.to_state()
+        self.assertEqual(state[govars.INVD_CHNL, 1, 1], 1)
+        self.assertEqual(CompactState.from_state(state).ko, compact.ko)
+
+    def test_preserve_original_state(self):
+        compact = CompactState.init(5)
+        pieces = np.copy(compact.pieces)
+        compact.next_state(0)
+        self.assertTrue((compact.pieces == pieces).all())
+
+
+class TestCompactEnv(unittest.TestCase):
+
+    def test_random_games(self):
+        for size in [3, 5]:
+            for reward_method in ['real', 'heuristic']:
+                for _ in range(5):
+                    env = GoEnv(size, reward_method=reward_method)
+                    compact_env = GoEnv(size, reward_method=reward_method, compact=True)
+                    self.assertTrue((compact_env.reset() == env.reset()).all())
+                    done = False
+                    while not done:
+                        self.assertTrue((compact_env.valid_moves() == env.valid_moves()).all())
+                        self.assertTrue((compact_env.history_observation() == env.history_observation()).all())
+                        action = env.uniform_random_action()
+                        obs, reward, done, info = env.step(action)
+                        compact_obs, compact_reward, compact_done, compact_info = compact_env.step(action)
+
+                        self.assertTrue((compact_obs == obs).all())
+                        self.assertEqual(compact_reward, reward)
+                        self.assertEqual(compact_done, done)
+                        self.assertEqual(compact_info['turn'], info['turn'])
+                        self.assertEqual(compact_info['prev_player_passed'], info['prev_player_passed'])
+                        self.assertTrue((compact_info['invalid_moves'] == info['invalid_moves']).all())
+                        self.assertTrue((compact_env.state() == env.state()).all())
+
+    def test_set_state(self):
+        env = GoEnv(5)
+        for action in [0, 6, 12, 25]:
+            env.step(action)
+        compact_env = GoEnv(5, compact=True)
+        compact_env.state_ = env.state()
+        self.assertEqual(compact_env.turn(), env.turn())
+        self.assertEqual(compact_env.prev_player_passed(), env.prev_player_passed())
+        self.assertTrue((compact_env.valid_moves() == env.valid_moves()).all())
+        self.assertTrue((compact_env.step(1)[0] == env.step(1)[0]).all())
+
+    def test_requires_reference_backend(self):
+        with self.assertRaises(ValueError):
+            GoEnv(5, backend='numba', compact=True)
+
+
+if __name__ == '__main__':
+    unittest.main()
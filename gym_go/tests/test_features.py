@@ -0,0 +1,61 @@
+import unittest
+
+import numpy as np
+from scipy import ndimage
+
+from gym_go import features, gogame, govars
+
+
+class TestFeatures(unittest.TestCase):
+
+    def naive_features(self, state):
+        player = gogame.turn(state)
+        empties = 1 - state[govars.BLACK] - state[govars.WHITE]
+        expected = np.zeros((features.NUM_FEATURES, *state.shape[1:]))
+        planes = [(state[player], features.OWN_LIBERTIES, features.THREAT, features.THREAT_SIZE),
+                  (state[1 - player], features.OPP_LIBERTIES, features.CAPTURE, features.CAPTURE_SIZE)]
+        for pieces, liberties_chnl, atari_chnl, atari_size_chnl in planes:
+            labels, num_labels = ndimage.label(pieces)
+            for label in range(1, num_labels + 1):
+                group = labels == label
+                liberties = (empties * ndimage.binary_dilation(group)) > 0
+                num_liberties = np.count_nonzero(liberties)
+                expected[liberties_chnl + min(num_liberties, 4) - 1][group] = 1
+                if num_liberties == 1:
+                    expected[atari_chnl][liberties] = 1
+                    expected[atari_size_chnl][liberties] += np.count_nonzero(group)
+        return expected
+
+    def test_random_states(self):
+        for size in [5, 7]:
+            batch_states = gogame.batch_init_state(8, size)
+            for _ in range(2 * size ** 2):
+                actions = np.array([gogame.random_action(state) for state in batch_states])
+                batch_states = gogame.batch_next_states(batch_states, actions)
+                batch_features = features.batch_liberty_features(batch_states)
+                self.assertEqual(batch_features.shape, (8, features.NUM_FEATURES, size, size))
+                for state, state_features in zip(batch_states, batch_features):
+                    self.assertTrue((state_features == self.naive_features(state)).all())
+
+    def test_capture_size(self):
+        """
+        Black to play at (0, 2) captures the two white stones
+
+        W,   W,   _,   _,   _,
+
+        B,   B,   _,   _,   _,
+        """
+        state = gogame.init_state(5)
+        for move in [(1, 0), (0, 0), (1, 1), (0, 1)]:
+            state = gogame.next_state(state, move[0] * 5 + move[1])
+
+        state_features = features.liberty_features(state)
+        self.assertEqual(state_features[features.CAPTURE, 0, 2], 1)
+        self.assertEqual(state_features[features.CAPTURE_SIZE, 0, 2], 2)
+        self.assertEqual(np.count_nonzero(state_features[features.CAPTURE]), 1)
+        self.assertEqual(np.count_nonzero(state_features[features.OPP_LIBERTIES]), 2)
+        self.assertEqual(np.count_nonzero(state_features[features.OWN_LIBERTIES + 2]), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
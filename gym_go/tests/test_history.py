@@ -0,0 +1,78 @@
+import collections
+import unittest
+
+import gym
+import numpy as np
+
+from gym_go import gogame, govars
+from gym_go.history import BoardHistory
+
+
+class TestBoardHistory(unittest.TestCase):
+
+    def expected_stack(self, states, history_len):
+        boards = collections.deque([np.zeros((2, 5, 5))] * history_len, history_len)
+        for state in states:
+            boards.append(state[[govars.BLACK, govars.WHITE]])
+        return np.concatenate([*boards, states[-1][[govars.TURN_CHNL]]])
+
+    def test_matches_naive_stack(self):
+        for history_len in [1, 2, 4]:
+            history = BoardHistory(5, history_len)
+            state = gogame.init_state(5)
+            states = []
+            for _ in range(3 * history_len + 2):
+                state = gogame.next_state(state, gogame.random_action(state))
+                states.append(state)
+                history.push(state)
+                obs = history.observation()
+                self.assertEqual(obs.shape, (2 * history_len + 1, 5, 5))
+                self.assertTrue((obs == self.expected_stack(states, history_len)).all())
+
+    def test_observation_is_view(self):
+        history = BoardHistory(5, 4)
+        buffer = history.buffer
+        state = gogame.init_state(5)
+        for _ in range(10):
+            state = gogame.next_state(state, gogame.random_action(state))
+            history.push(state)
+            self.assertIs(history.observation().base, buffer)
+        self.assertIs(history.buffer, buffer)
+
+    def test_batch(self):
+        batch_size = 3
+        history = BoardHistory(5, 2, batch_size=batch_size)
+        batch_states = gogame.batch_init_state(batch_size, 5)
+        all_states = []
+        for _ in range(7):
+            actions = np.array([gogame.random_action(state) for state in batch_states])
+            batch_states = gogame.batch_next_states(batch_states, actions)
+            all_states.append(batch_states)
+            history.push(batch_states)
+            obs = history.observation()
+            self.assertEqual(obs.shape, (batch_size, 5, 5, 5))
+            for i in range(batch_size):
+                expected = self.expected_stack([states[i] for states in all_states], 2)
+                self.assertTrue((obs[i] == expected).all())
+
+        history.reset([1])
+        self.assertEqual(np.count_nonzero(history.observation()[1]), 0)
+        self.assertGreater(np.count_nonzero(history.observation()[0]), 0)
+
+    def test_env_history(self):
+        env = gym.make('gym_go:go-v0', size=5)
+        env.reset()
+        self.assertEqual(np.count_nonzero(env.history_observation()), 0)
+        states = [env.state()]
+        for action in [(0, 0), (1, 1), None, (2, 2), (3, 3)]:
+            env.step(action)
+            states.append(env.state())
+            self.assertTrue((env.history_observation() == self.expected_stack(states, govars.NO_TIMESTEPS)).all())
+
+        env.reset()
+        self.assertEqual(np.count_nonzero(env.history_observation()), 0)
+        env.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -11,7 +11,10 @@ class TestGoEnvInvalidMoves(unittest.TestCase):
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
-        self.env = gym.make('gym_go:go-v0', size=7, reward_method='real')
+        self.env = self.make_env(7)
+
+    def make_env(self, size):
+        return gym.make('gym_go:go-v0', size=size, reward_method='real')
 
     def setUp(self):
         self.env.reset()
@@ -185,7 +188,7 @@ class TestGoEnvInvalidMoves(unittest.TestCase):
         :return:
         """
 
-        self.env = gym.make('gym_go:go-v0', size=3, reward_method='real')
+        self.env = self.make_env(3)
         for move in [6, 7, 8, 5, 4, 8, 0, 1]:
             state, reward, done, info = self.env.step(move)
 
@@ -202,7 +205,7 @@ class TestGoEnvInvalidMoves(unittest.TestCase):
         :return:
         """
 
-        self.env = gym.make('gym_go:go-v0', size=3, reward_method='real')
+        self.env = self.make_env(3)
         for move in [0, 8, 6, 4, 1, 2, 3, 7]:
             state, reward, done, info = self.env.step(move)
 
@@ -0,0 +1,53 @@
+import unittest
+
+import numpy as np
+
+from gym_go import gogame, numba_backend, state_utils
+
+
+class TestNumbaBackend(unittest.TestCase):
+
+    def test_random_games(self):
+        for size in [3, 5, 7, 9]:
+            for _ in range(10):
+                state = gogame.init_state(size)
+                for _ in range(3 * size ** 2):
+                    player = 1 - gogame.turn(state)
+                    self.assertTrue((numba_backend.compute_invalid_moves(state, player) ==
+                                     state_utils.compute_invalid_moves(state, player)).all())
+                    if gogame.game_ended(state):
+                        break
+                    action = gogame.random_action(state)
+                    for canonical in [False, True]:
+                        expected = gogame.next_state(state, action, canonical)
+                        result = numba_backend.next_state(state, action, canonical)
+                        self.assertEqual(result.dtype, expected.dtype)
+                        self.assertTrue((result == expected).all(), (size, action, canonical))
+                    state = gogame.next_state(state, action)
+
+    def test_batch_random_games(self):
+        for size in [5, 9]:
+            batch_states = gogame.batch_init_state(16, size)
+            for _ in range(2 * size ** 2):
+                actions = np.array([gogame.random_action(state) for state in batch_states])
+                expected = gogame.batch_next_states(batch_states, actions)
+                result = numba_backend.batch_next_states(batch_states, actions)
+                self.assertTrue((result == expected).all())
+                for state, action, next_state in zip(batch_states, actions, result):
+                    self.assertTrue((gogame.next_state(state, action) == next_state).all())
+                batch_states = result
+
+    def test_preserve_original_state(self):
+        state = gogame.init_state(7)
+        original_state = np.copy(state)
+        numba_backend.next_state(state, 0)
+        self.assertTrue((original_state == state).all())
+
+    def test_invalid_move(self):
+        state = gogame.next_state(gogame.init_state(7), 0)
+        with self.assertRaises(AssertionError):
+            numba_backend.next_state(state, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,70 @@
+import unittest
+
+import gym
+import numpy as np
+
+from gym_go import govars
+
+
+class TestGoEnvObservations(unittest.TestCase):
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.env = gym.make('gym_go:go-v0', size=7, reward_method='real')
+
+    def setUp(self):
+        self.env.reset()
+
+    def expected_obs(self, env):
+        return env.state()[:govars.TURN_CHNL + 1].flatten()
+
+    def test_flat(self):
+        state = self.env.reset()
+        self.assertEqual(state.shape, (3 * 7 * 7,))
+        for action in [(0, 0), (0, 1), None]:
+            state, _, _, _ = self.env.step(action)
+            self.assertTrue((state == self.expected_obs(self.env)).all())
+
+    def test_buffer(self):
+        for dtype in [np.uint8, np.float32]:
+            env = gym.make('gym_go:go-v0', size=7, obs_mode='buffer', obs_dtype=dtype)
+            state = env.reset()
+            buffer = state
+            self.assertEqual(state.dtype, dtype)
+            for action in [(0, 0), (0, 1), None]:
+                state, _, _, _ = env.step(action)
+                self.assertIs(state, buffer)
+                self.assertTrue((state == self.expected_obs(env)).all())
+            env.close()
+
+    def test_caller_buffer(self):
+        buffer = np.zeros((4, 3 * 7 * 7), dtype=np.float32)
+        env = gym.make('gym_go:go-v0', size=7, obs_mode='buffer', obs_dtype=np.float32, obs_buffer=buffer[2])
+        env.reset()
+        env.step((3, 3))
+        self.assertTrue((buffer[2] == self.expected_obs(env)).all())
+        self.assertEqual(np.count_nonzero(buffer[[0, 1, 3]]), 0)
+        env.close()
+
+    def test_strided_caller_buffer(self):
+        buffer = np.zeros((3 * 7 * 7, 2), dtype=np.uint8)
+        env = gym.make('gym_go:go-v0', size=7, obs_mode='buffer', obs_dtype=np.uint8, obs_buffer=buffer[:, 1])
+        env.reset()
+        env.step((3, 3))
+        self.assertTrue((buffer[:, 1] == self.expected_obs(env)).all())
+        self.assertEqual(np.count_nonzero(buffer[:, 0]), 0)
+        env.close()
+
+    def test_packed(self):
+        env = gym.make('gym_go:go-v0', size=7, obs_mode='packed')
+        state = env.reset()
+        self.assertEqual(state.dtype, np.uint8)
+        self.assertEqual(state.shape, ((3 * 7 * 7 + 7) // 8,))
+        for action in [(0, 0), (0, 1), None]:
+            state, _, _, _ = env.step(action)
+            self.assertTrue((env.unpack_observation(state) == self.expected_obs(env)).all())
+        env.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,37 @@
+import cProfile
+import os
+import pstats
+import tempfile
+import unittest
+
+from gym_go import profile
+
+
+class TestProfile(unittest.TestCase):
+
+    def test_play_games(self):
+        for batch_size in [1, 3]:
+            for policy in profile.POLICIES:
+                num_moves = profile.play_games(4, 5, batch_size, policy, seed=0, max_steps=10)
+                self.assertGreater(num_moves, 0)
+                self.assertLessEqual(num_moves, 4 * 10)
+
+    def test_reports(self):
+        profiler = cProfile.Profile()
+        profiler.enable()
+        profile.play_games(2, 5, 2, seed=0, max_steps=5)
+        profiler.disable()
+
+        stacks = profile.collapsed_stacks(pstats.Stats(profiler))
+        self.assertTrue(any('batch_next_states' in stack for stack in stacks))
+        for us in stacks.values():
+            self.assertGreater(us, 0)
+
+        with tempfile.TemporaryDirectory() as out_dir:
+            profile.write_reports(profiler, out_dir, ['cumulative', 'tottime'], 10)
+            for name in ['engine.prof', 'engine.collapsed', 'hotspots_cumulative.txt', 'hotspots_tottime.txt']:
+                self.assertTrue(os.path.exists(os.path.join(out_dir, name)), name)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,80 @@
+import io
+import os
+import tempfile
+import unittest
+
+import numpy as np
+
+from gym_go import gogame, sgf
+
+GAME = "(;GM[1]SZ[5]KM[6.5]C[a [comment\\] (with) brackets]RE[W+3.5];B[cc];W[bc](;B[cb];W[];B[tt])(;B[dd]))"
+SETUP_GAME = "(;SZ[5]AB[aa][bb];W[cc])"
+
+
+class TestSgf(unittest.TestCase):
+
+    def test_parse_main_line(self):
+        game = sgf.parse_game(GAME)
+        self.assertEqual(game.size, 5)
+        self.assertEqual(game.komi, 6.5)
+        self.assertEqual(game.result, -1)
+        # cc -> (2, 2), bc -> row 2 col 1, cb -> row 1 col 2, passes
+        self.assertEqual(list(game.actions), [12, 11, 7, 25, 25])
+
+    def test_unsupported_games(self):
+        self.assertIsNone(sgf.parse_game(SETUP_GAME))
+        self.assertIsNone(sgf.parse_game("(;SZ[5];B[aa];B[bb])"))
+
+    def test_streaming_split(self):
+        text = GAME + '\n' + SETUP_GAME + '\n junk ' + GAME
+        for read_size in [1, 7, 1 << 20]:
+            texts = list(sgf.iter_game_texts(io.StringIO(text), read_size))
+            self.assertEqual(texts, [GAME, SETUP_GAME, GAME])
+
+    def test_replay_matches_engine(self):
+        games = [sgf.parse_game(GAME), sgf.parse_game("(;SZ[5];B[aa];W[ab])")]
+        states, actions, outcomes, game_idcs, num_truncated = sgf.replay_chunk(games)
+        self.assertEqual(num_truncated, 0)
+        self.assertEqual(len(states), 7)
+        for i, game in enumerate(games):
+            state = gogame.init_state(5)
+            for game_state, action in zip(states[game_idcs == i], game.actions):
+                np.testing.assert_array_equal(game_state, state)
+                state = gogame.next_state(state, action)
+            np.testing.assert_array_equal(actions[game_idcs == i], game.actions)
+            self.assertTrue((outcomes[game_idcs == i] == game.result).all())
+
+    def test_truncate_illegal_moves(self):
+        games = [sgf.parse_game("(;SZ[5];B[aa];W[aa];B[bb])")]
+        states, actions, outcomes, game_idcs, num_truncated = sgf.replay_chunk(games)
+        self.assertEqual(num_truncated, 1)
+        self.assertEqual(list(actions), [0])
+
+    def test_convert(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            sgf_dir = os.path.join(tmp_dir, 'games')
+            os.makedirs(os.path.join(sgf_dir, 'sub'))
+            with open(os.path.join(sgf_dir, 'a.sgf'), 'w') as f:
+                f.write(GAME * 3)
+            with open(os.path.join(sgf_dir, 'sub', 'b.sgf'), 'w') as f:
+                f.write(SETUP_GAME + "(;SZ[9];B[aa])")
+
+            out_dir = os.path.join(tmp_dir, 'out')
+            stats = sgf.convert([sgf_dir], out_dir, board_size=5, chunk_size=2)
+            self.assertEqual(stats['files'], 2)
+            self.assertEqual(stats['games_read'], 5)
+            self.assertEqual(stats['games_skipped'], 1)
+            self.assertEqual(stats['games_other_size'], 1)
+            self.assertEqual(stats['games_converted'], 3)
+            self.assertEqual(stats['positions'], 15)
+
+            chunks = sorted(os.listdir(out_dir))
+            self.assertEqual(chunks, ['chunk_000000.npz', 'chunk_000001.npz'])
+            with np.load(os.path.join(out_dir, chunks[1])) as data:
+                self.assertEqual(data['states'].shape, (5, 6, 5, 5))
+                self.assertEqual(data['states'].dtype, np.uint8)
+                self.assertTrue((data['game_idcs'] == 2).all())
+
+
+if __name__ == '__main__':
+    unittest.main()
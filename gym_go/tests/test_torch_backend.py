@@ -0,0 +1,67 @@
+import unittest
+
+import numpy as np
+
+from gym_go import gogame, govars, torch_backend
+
+if torch_backend.available:
+    import torch
+
+
+@unittest.skipUnless(torch_backend.available, 'torch is not installed')
+class TestTorchBackend(unittest.TestCase):
+
+    def test_batch_random_games(self):
+        for size in [3, 5, 7]:
+            batch_states = gogame.batch_init_state(16, size)
+            tensor_states = torch.from_numpy(batch_states)
+            for _ in range(2 * size ** 2):
+                actions = np.array([gogame.random_action(state) for state in batch_states])
+                for canonical in [False, True]:
+                    expected = gogame.batch_next_states(batch_states, actions, canonical)
+                    result = torch_backend.batch_next_states(tensor_states, torch.from_numpy(actions), canonical)
+                    self.assertTrue(torch.is_tensor(result))
+                    self.assertTrue((result.numpy() == expected).all(), (size, canonical))
+
+                batch_states = gogame.batch_next_states(batch_states, actions)
+                tensor_states = torch_backend.batch_next_states(tensor_states, torch.from_numpy(actions))
+
+                valid_moves = torch_backend.batch_valid_moves(tensor_states)
+                self.assertTrue((valid_moves.numpy() == gogame.batch_valid_moves(batch_states)).all())
+                black_areas, white_areas = torch_backend.batch_areas(tensor_states)
+                expected_black_areas, expected_white_areas = gogame.batch_areas(batch_states)
+                self.assertTrue((black_areas.numpy() == expected_black_areas).all())
+                self.assertTrue((white_areas.numpy() == expected_white_areas).all())
+
+    def test_numpy_in_numpy_out(self):
+        state = gogame.init_state(5)
+        next_state = torch_backend.next_state(state, 12)
+        self.assertIsInstance(next_state, np.ndarray)
+        self.assertTrue((next_state == gogame.next_state(state, 12)).all())
+        self.assertEqual(np.count_nonzero(state), 0)
+
+    def test_label(self):
+        pieces = torch.tensor([[[1, 1, 0, 1],
+                                [0, 1, 0, 1],
+                                [1, 0, 0, 1],
+                                [1, 0, 1, 1]]], dtype=torch.bool)
+        labels = torch_backend.label(pieces)
+        self.assertEqual(len(torch.unique(labels[pieces])), 3)
+        self.assertTrue((labels[~pieces] == 0).all())
+
+    def test_observations(self):
+        batch_states = torch.from_numpy(gogame.batch_init_state(4, 5))
+        observations = torch_backend.batch_observations(batch_states)
+        self.assertEqual(observations.shape, (4, 3 * 5 * 5))
+        self.assertEqual(observations.data_ptr(), batch_states.data_ptr())
+
+    def test_invalid_move(self):
+        batch_states = torch.from_numpy(gogame.batch_init_state(2, 5))
+        batch_states = torch_backend.batch_next_states(batch_states, torch.tensor([0, 25]))
+        with self.assertRaises(AssertionError):
+            torch_backend.batch_next_states(batch_states, torch.tensor([0, 25]))
+        self.assertEqual(batch_states[0, govars.BLACK, 0, 0], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
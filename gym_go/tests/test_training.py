@@ -0,0 +1,515 @@
+import csv
+import importlib.util
+import os
+import pickle
+import sys
+import tempfile
+import threading
+import time
+import unittest
+
+import numpy as np
+
+from gym_go import gogame
+from gym_go.envs import GoEnv
+
+try:
+    import pytorch_lightning  # noqa: F401
+    import torch
+except ImportError:
+    training = None
+else:
+    # The training script lives at the root of the repository
+    _spec = importlib.util.spec_from_file_location(
+        'Untitled', os.path.join(os.path.dirname(__file__), os.pardir, os.pardir, 'Untitled.py'))
+    training = importlib.util.module_from_spec(_spec)
+    # Registered, so its classes can be pickled
+    sys.modules['Untitled'] = training
+    _spec.loader.exec_module(training)
+
+
+@unittest.skipIf(training is None, 'pytorch_lightning is not installed')
+class TestReplayBuffer(unittest.TestCase):
+
+    def test_ring_overwrite(self):
+        # Experiences with array states store both of their boards
+        buffer = training.ReplayBuffer(4, 3, 2, frame_capacity=8)
+        for i in range(6):
+            buffer.append(training.Experience(np.full(3, i), i, float(i), False, np.full(3, i + 1)))
+        self.assertEqual(len(buffer), 4)
+        self.assertEqual(buffer.size, 4)
+        self.assertEqual(buffer.index, 2)
+        self.assertEqual(sorted(buffer.actions), [2, 3, 4, 5])
+
+        states, actions, rewards, dones, next_states, _, _, indices, weights = buffer.sample(32)
+        self.assertTrue((states[:, 0] == actions).all())
+        self.assertTrue((next_states[:, 0] == actions + 1).all())
+        self.assertTrue((rewards == actions).all())
+        self.assertTrue((weights == 1).all())
+
+    def test_frame_sharing(self):
+        buffer = training.ReplayBuffer(8, 3, 2, frame_capacity=5)
+        ids = [buffer.add_frame(np.full(3, i)) for i in range(4)]
+        buffer.extend(ids[:-1], [0, 1, 2], [0.0, 0.0, 1.0], [False, False, True], ids[1:])
+        # Consecutive experiences share their boards
+        self.assertEqual(buffer.num_frames, 4)
+        self.assertEqual(len(buffer), 3)
+
+        states, actions, _, _, next_states, _, _, indices, _ = buffer.sample(32)
+        self.assertTrue((states[:, 0] == actions).all())
+        self.assertTrue((next_states[:, 0] == actions + 1).all())
+
+        # Overwriting the state frame of the first experience in the frame ring invalidates it
+        buffer.add_frames(np.full((2, 3), 9))
+        self.assertEqual(len(buffer), 2)
+        self.assertFalse(buffer.valid[0])
+        _, actions, _, _, _, _, _, indices, _ = buffer.sample(64)
+        self.assertNotIn(0, indices)
+        self.assertTrue((actions > 0).all())
+
+    def test_dataset_streams_fresh_batches(self):
+        buffer = training.ReplayBuffer(1, 3, 2, frame_capacity=4)
+        buffer.append(training.Experience(np.zeros(3), 0, 0.0, False, np.ones(3)))
+        dataset = training.RLDataset(buffer, batch_size=16, num_batches=3)
+
+        batches = iter(dataset)
+        self.assertTrue((next(batches)[1] == 0).all())
+        # Experiences added while iterating are sampled by the next batches
+        buffer.append(training.Experience(np.zeros(3), 1, 0.0, False, np.ones(3)))
+        states, actions = next(batches)[:2]
+        self.assertEqual(tuple(states.shape), (16, 3))
+        self.assertTrue((actions == 1).all())
+        self.assertEqual(len(list(batches)), 1)
+
+
+@unittest.skipIf(training is None, 'pytorch_lightning is not installed')
+class TestPrioritizedReplay(unittest.TestCase):
+
+    def test_sum_tree(self):
+        tree = training.SumTree(5)
+        tree.update(np.arange(5), np.array([1.0, 2.0, 3.0, 4.0, 0.0]))
+        self.assertEqual(tree.total(), 10)
+        values = np.array([0.0, 0.99, 1.0, 2.99, 3.0, 5.99, 6.0, 9.99])
+        self.assertEqual(list(tree.find(values)), [0, 0, 1, 1, 2, 2, 3, 3])
+
+        tree.update(np.array([2]), np.array([10.0]))
+        self.assertEqual(tree.total(), 17)
+        self.assertEqual(list(tree.get(np.arange(5))), [1, 2, 10, 4, 0])
+        self.assertEqual(list(tree.find(np.array([2.99, 12.99, 13.0, 16.99]))), [1, 2, 3, 3])
+        tree.update(np.zeros(0, dtype=np.int64), np.zeros(0))
+        self.assertEqual(tree.total(), 17)
+
+    def test_priorities_and_weights(self):
+        buffer = training.PrioritizedReplayBuffer(4, 3, 2, alpha=1.0, beta=1.0, eps=0.0, frame_capacity=16)
+        for i in range(4):
+            buffer.append(training.Experience(np.full(3, i), i, 0.0, False, np.full(3, i + 1)))
+        # New experiences have the largest priority so far
+        self.assertEqual(list(buffer.tree.get(np.arange(4))), [1, 1, 1, 1])
+
+        buffer.update_priorities(np.arange(4), np.array([1.0, -1.0, 1.0, -5.0]))
+        self.assertEqual(buffer.max_priority, 5)
+        self.assertEqual(buffer.tree.total(), 8)
+
+        # One sample from each eighth of the total priority
+        _, actions, _, _, _, _, _, indices, weights = buffer.sample(8)
+        self.assertEqual(list(np.bincount(indices, minlength=4)), [1, 1, 1, 5])
+        self.assertTrue((actions == indices).all())
+        # (N * P(i)) ** -beta, normalized by the largest weight
+        self.assertTrue(np.allclose(weights, np.where(indices == 3, 0.2, 1.0)))
+
+        buffer.append(training.Experience(np.full(3, 4), 4, 0.0, False, np.full(3, 5)))
+        self.assertEqual(buffer.tree.get(np.array([0]))[0], 5)
+
+    def test_stale_priority_updates(self):
+        buffer = training.PrioritizedReplayBuffer(8, 3, 2, alpha=1.0, frame_capacity=6)
+        ids = [buffer.add_frame(np.full(3, i)) for i in range(5)]
+        buffer.extend(ids[:-1], [0, 1, 2, 3], np.zeros(4), np.zeros(4, dtype=bool), ids[1:])
+        sampled_ids = buffer.sample(16)[7]
+
+        # New frames wrap the frame ring and invalidate the first experiences before their priorities are updated
+        new_ids = buffer.add_frames(np.full((3, 3), 9))
+        buffer.extend(new_ids[:-1], [4, 5], np.zeros(2), np.zeros(2, dtype=bool), new_ids[1:])
+        self.assertEqual(list(buffer.valid[:6]), [False, False, True, True, True, True])
+        buffer.update_priorities(sampled_ids, np.full(16, 3.0))
+        self.assertEqual(list(buffer.tree.get(np.arange(2))), [0, 0])
+
+        _, actions, _, _, _, _, _, ids, weights = buffer.sample(64)
+        self.assertTrue(buffer.valid[ids % 8].all())
+        self.assertTrue((actions >= 2).all())
+        self.assertTrue(np.isfinite(weights).all())
+
+        # An experience overwritten since it was sampled keeps the priority of the new experience
+        buffer = training.PrioritizedReplayBuffer(2, 3, 2, alpha=1.0, eps=0.0, frame_capacity=16)
+        for i in range(2):
+            buffer.append(training.Experience(np.full(3, i), i, 0.0, False, np.full(3, i + 1)))
+        sampled_ids = np.array([0, 1])
+        buffer.append(training.Experience(np.full(3, 2), 2, 0.0, False, np.full(3, 3)))
+        buffer.update_priorities(sampled_ids, np.array([5.0, 0.5]))
+        self.assertEqual(list(buffer.tree.get(np.arange(2))), [1.0, 0.5])
+
+
+@unittest.skipIf(training is None, 'pytorch_lightning is not installed')
+class TestNStepWindow(unittest.TestCase):
+
+    def test_returns_stop_at_episode_end(self):
+        window = training.NStepWindow(n_steps=3, gamma=0.5)
+        completed = []
+        for i, reward in enumerate([1.0, 2.0, 4.0, 8.0]):
+            completed.append(window.push(training.Experience(i, i, reward, i == 3, i + 1), env_id=0))
+            # Another environment does not mix into the returns
+            window.push(training.Experience(-1, -1, 100.0, False, -1), env_id=1)
+
+        self.assertEqual([len(experiences) for experiences in completed], [0, 0, 1, 3])
+        first, = completed[2]
+        self.assertEqual((first.state, first.reward, first.n_steps, first.done, first.new_state),
+                         (0, 3.0, 3, False, 3))
+        # The episode ended, so the last experiences have fewer rewards and do not bootstrap past it
+        states, rewards, n_steps = zip(*[(e.state, e.reward, e.n_steps) for e in completed[3]])
+        self.assertEqual(states, (1, 2, 3))
+        self.assertEqual(rewards, (6.0, 8.0, 8.0))
+        self.assertEqual(n_steps, (3, 2, 1))
+        self.assertTrue(all(e.done and e.new_state == 4 for e in completed[3]))
+        self.assertEqual(window.flush(0), [])
+
+    def test_one_step(self):
+        window = training.NStepWindow(n_steps=1)
+        experience = training.Experience(0, 1, 1.0, False, 2)
+        self.assertEqual(window.push(experience), [experience])
+
+
+@unittest.skipIf(training is None, 'pytorch_lightning is not installed')
+class TestSelectActions(unittest.TestCase):
+
+    def test_masked_greedy(self):
+        # The Q-values prefer the last move
+        def net(states):
+            return torch.arange(5.0).repeat(len(states), 1)
+
+        valid_moves = np.array([[1, 1, 1, 1, 1], [1, 1, 1, 1, 0], [0, 1, 0, 0, 0]], dtype=bool)
+        actions = training.select_actions(net, np.zeros((3, 2), dtype=np.float32), valid_moves, epsilon=0.0)
+        self.assertEqual(list(actions), [4, 3, 1])
+
+    def test_exploration(self):
+        valid_moves = np.tile(np.array([[1, 0, 1, 1, 0]], dtype=bool), (1000, 1))
+        # Exploring rows do not evaluate the network
+        actions = training.select_actions(None, np.zeros((1000, 2), dtype=np.float32), valid_moves, epsilon=1.0)
+        self.assertEqual(set(actions), {0, 2, 3})
+
+        def net(states):
+            return torch.arange(5.0).repeat(len(states), 1)
+
+        actions = training.select_actions(net, np.zeros((1000, 2), dtype=np.float32), valid_moves, epsilon=0.5)
+        self.assertEqual(set(actions), {0, 2, 3})
+        # Greedy rows play 3, exploring rows play it a third of the time
+        self.assertTrue(0.55 < np.mean(actions == 3) < 0.78)
+
+
+@unittest.skipIf(training is None, 'pytorch_lightning is not installed')
+class TestOpponents(unittest.TestCase):
+
+    def capture_state(self):
+        # Black to move, and black captures the white corner stone at 5
+        state = gogame.init_state(5)
+        for action in [1, 0, 24, 12]:
+            state = gogame.next_state(state, action)
+        return state
+
+    def test_canonical_observations(self):
+        state = gogame.next_state(gogame.init_state(5), 0)
+        observations = state[np.newaxis, :3].reshape(1, -1)
+        canonical = training.canonical_observations(observations)
+        self.assertTrue((canonical.reshape(3, 25) == [state[1].flatten(), state[0].flatten(), np.zeros(25)]).all())
+        self.assertEqual(observations[0, 50:].sum(), 25)
+
+        # Black to move is already canonical
+        state = gogame.next_state(state, 1)
+        observations = state[np.newaxis, :3].reshape(1, -1)
+        self.assertTrue((training.canonical_observations(observations) == observations).all())
+
+    def test_heuristic_actions(self):
+        state = self.capture_state()
+        observations = np.repeat(state[np.newaxis, :3].reshape(1, -1), 10, axis=0)
+        valid_moves = np.repeat(gogame.valid_moves(state)[np.newaxis], 10, axis=0)
+        self.assertTrue((training.heuristic_actions(observations, valid_moves) == 5).all())
+
+    def test_sample(self):
+        pool = training.OpponentPool(75, 26, max_snapshots=2, random_prob=0.2, heuristic_prob=0.2)
+        opponents = pool.sample(1000)
+        # Without snapshots, the random and heuristic players are played equally often
+        self.assertEqual(set(opponents), {pool.RANDOM, pool.HEURISTIC})
+        self.assertTrue(0.4 < np.mean(opponents == pool.RANDOM) < 0.6)
+
+        for _ in range(3):
+            pool.add_snapshot(training.DQN(75, 26))
+        self.assertEqual((pool.num_snapshots, pool.next_slot), (2, 1))
+        opponents = pool.sample(1000)
+        self.assertEqual(set(opponents), {pool.RANDOM, pool.HEURISTIC, 2, 3})
+        self.assertTrue(0.5 < np.mean(opponents >= 2) < 0.7)
+
+    def test_select_actions(self):
+        pool = training.OpponentPool(75, 26, max_snapshots=1)
+        net = training.DQN(75, 26)
+        pool.add_snapshot(net)
+        # The opponent plays white, the heuristic player saves its stone in atari at 5
+        state = gogame.next_state(self.capture_state(), 25)
+        observations = np.repeat(state[np.newaxis, :3].reshape(1, -1), 3, axis=0).astype(np.float32)
+        valid_moves = np.repeat(gogame.valid_moves(state)[np.newaxis].astype(bool), 3, axis=0)
+
+        actions = pool.select_actions(observations, valid_moves, np.array([pool.RANDOM, pool.HEURISTIC, 2]))
+        self.assertTrue(valid_moves[np.arange(3), actions].all())
+        self.assertEqual(actions[1], 5)
+        # Snapshots play greedily, seeing the board as black
+        expected = training.select_actions(net, training.canonical_observations(observations[2:]), valid_moves[2:],
+                                           epsilon=0.0)
+        self.assertEqual(actions[2], expected[0])
+
+
+@unittest.skipIf(training is None, 'pytorch_lightning is not installed')
+class TestAgent(unittest.TestCase):
+
+    def test_play_step_with_reply(self):
+        for heuristic_prob in [None, 1.0]:
+            opponents = None if heuristic_prob is None else training.OpponentPool(75, 26, 2, 0.0, heuristic_prob)
+            env = GoEnv(size=5, komi=6.5)
+            buffer = training.ReplayBuffer(512, 75, 26)
+            agent = training.Agent(env, buffer, opponents=opponents)
+            self.assertEqual(agent.opponent_id, None if opponents is None else [training.OpponentPool.HEURISTIC])
+            frames = [agent.frame]
+            for _ in range(100):
+                _, done = agent.play_step(None, epsilon=1.0)
+                # The opponent replied, so the agent sees the current board with black to move
+                self.assertTrue((agent.state == env.state()[:3].reshape(-1)).all())
+                self.assertEqual(agent.state[50:].sum(), 0)
+                self.assertTrue((buffer.frames[agent.frame] == agent.state).all())
+                frames.append(agent.frame)
+
+            # Consecutive experiences of an episode share their boards
+            n = buffer.size
+            dones = buffer.dones[:n]
+            self.assertTrue((buffer.state_frames[1:n][~dones[:-1]] == buffer.next_frames[:n - 1][~dones[:-1]]).all())
+            self.assertTrue(set(buffer.state_frames[:n]) <= set(frames))
+
+
+@unittest.skipIf(training is None, 'pytorch_lightning is not installed')
+class TestActors(unittest.TestCase):
+
+    def test_vector_actor(self):
+        envs = [GoEnv(size=5, komi=6.5) for _ in range(4)]
+        buffer = training.ReplayBuffer(1024, 75, 26)
+        actor = training.VectorActor(envs, buffer, n_steps=2, gamma=0.9)
+        for _ in range(60):
+            actor.play_step(None, epsilon=1.0)
+            # Every board is stored once, after the opponent's reply
+            self.assertTrue((actor.states[:, 50:] == 0).all())
+            self.assertTrue((buffer.frames[actor.frames] == actor.states).all())
+            for env, state in zip(envs, actor.states):
+                self.assertTrue((state == env.state()[:3].reshape(-1)).all())
+        self.assertGreaterEqual(len(buffer), 4 * 58)
+        self.assertTrue(set(buffer.n_steps[:buffer.size]) <= {1, 2})
+
+    def test_run_actor(self):
+        buffer = training.ReplayBuffer(2048, 75, 26)
+        buffer.share_memory()
+        epsilon, reward = torch.multiprocessing.Value('d', 1.0), torch.multiprocessing.Value('d', 0.0)
+        stop = torch.multiprocessing.Event()
+        actor = threading.Thread(target=training.run_actor, args=(0, buffer, training.DQN(75, 26), epsilon, reward,
+                                                                  stop, {'size': 5, 'komi': 6.5}, 4))
+        actor.start()
+        try:
+            deadline = time.monotonic() + 60
+            while len(buffer) < 64 and time.monotonic() < deadline and actor.is_alive():
+                time.sleep(0.05)
+        finally:
+            stop.set()
+            actor.join()
+        self.assertGreaterEqual(len(buffer), 64)
+        actions = buffer.sample(64)[1]
+        self.assertTrue(((0 <= actions) & (actions < 26)).all())
+
+
+@unittest.skipIf(training is None, 'pytorch_lightning is not installed')
+class TestMetricsWriter(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp_dir.name, 'metrics.csv')
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def read_rows(self):
+        with open(self.path, newline='') as f:
+            return [[float(value) for value in row] for row in csv.reader(f)]
+
+    def test_flush_by_size(self):
+        with training.MetricsWriter(self.path, ['reward', 'loss'], block_size=4, flush_interval=60) as writer:
+            for step in range(3):
+                writer.log(step, float(step), torch.tensor(step / 4))
+            writer.full_blocks.join()
+            self.assertEqual(writer.stats()['rows_written'], 0)
+
+            # The full block is handed to the writer thread, which reads the tensors
+            writer.log(3, 3.0, torch.tensor(0.75))
+            writer.full_blocks.join()
+            self.assertEqual(writer.stats()['rows_written'], 4)
+            self.assertEqual(writer.stats()['flushes'], 1)
+            self.assertEqual(self.read_rows(), [[step, step, step / 4] for step in range(4)])
+
+            writer.log(4, 4.0, torch.tensor(1.0))
+        self.assertEqual(self.read_rows()[-1], [4, 4, 1])
+
+    def test_flush_by_interval(self):
+        with training.MetricsWriter(self.path, ['reward'], block_size=1024, flush_interval=0.05) as writer:
+            writer.log(0, 1.0)
+            time.sleep(0.1)
+            writer.log(1, 2.0)
+            writer.full_blocks.join()
+            self.assertEqual(writer.stats()['rows_written'], 2)
+            self.assertEqual(self.read_rows(), [[0, 1], [1, 2]])
+
+
+
+@unittest.skipIf(training is None, 'pytorch_lightning is not installed')
+class TestCheckpoint(unittest.TestCase):
+
+    def test_resume(self):
+        with tempfile.TemporaryDirectory() as checkpoint_dir:
+            kwargs = dict(replay_size=500, snapshot_rate=10, max_snapshots=2, checkpoint_dir=checkpoint_dir)
+            model = training.DQNLightning(warm_start_size=200, warm_start_steps=10, **kwargs)
+            model.opponents.add_snapshot(model.net)
+            checkpoint = {}
+            model.on_save_checkpoint(checkpoint)
+            checkpoint = pickle.loads(pickle.dumps(checkpoint))
+            self.assertEqual(os.listdir(checkpoint_dir), ['replay-step=0'])
+
+            resumed = training.DQNLightning(warm_start_size=0, warm_start_steps=0, **kwargs)
+            resumed.on_load_checkpoint(checkpoint)
+            for name in ['counters', 'frames', 'frame_valid_moves', 'state_frames', 'actions', 'rewards', 'dones',
+                         'next_frames', 'n_steps', 'valid']:
+                self.assertTrue((getattr(resumed.buffer, name) == getattr(model.buffer, name)).all(), name)
+            self.assertTrue((resumed.env.unwrapped.state_ == model.env.unwrapped.state_).all())
+            self.assertEqual(resumed.agent.opponent_id, model.agent.opponent_id)
+            self.assertTrue((resumed.opponents.counters == model.opponents.counters).all())
+            for snapshot, resumed_snapshot in zip(model.opponents.snapshots, resumed.opponents.snapshots):
+                for weights, resumed_weights in zip(snapshot.parameters(), resumed_snapshot.parameters()):
+                    self.assertTrue(torch.equal(weights, resumed_weights))
+
+            # The episode continues as it would have
+            for agent in [model.agent, resumed.agent]:
+                np.random.seed(0)
+                torch.manual_seed(0)
+                for _ in range(20):
+                    agent.play_step(model.net, epsilon=0.5)
+            self.assertEqual(len(resumed.buffer), len(model.buffer))
+            self.assertTrue((resumed.buffer.actions == model.buffer.actions).all())
+            self.assertTrue((resumed.buffer.frames == model.buffer.frames).all())
+
+
+@unittest.skipIf(training is None, 'pytorch_lightning is not installed')
+class TestInferenceServer(unittest.TestCase):
+
+    def test_clients(self):
+        torch.manual_seed(0)
+        net = training.DQN(12, 5, 16)
+        server = training.InferenceServer(net, 12, 5, num_clients=3, max_rows=4, max_batch_size=8,
+                                          max_latency=0.05)
+        server.start()
+        try:
+            states = [torch.rand(n, 12) for n in [1, 4, 3]]
+            results = [None] * 3
+
+            def request(client_id):
+                results[client_id] = server.client(client_id)(states[client_id])
+
+            threads = [threading.Thread(target=request, args=(i,)) for i in range(3)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            with torch.no_grad():
+                for i in range(3):
+                    self.assertTrue(torch.allclose(results[i], net(states[i])))
+            self.assertEqual(server.stats()['requests'], 3)
+
+            # New weights are used by the next batches
+            new_net = training.DQN(12, 5, 16)
+            server.update_weights(new_net)
+            with torch.no_grad():
+                self.assertTrue(torch.allclose(server.client(0)(states[0]), new_net(states[0])))
+        finally:
+            server.stop()
+
+
+
+@unittest.skipIf(training is None, 'pytorch_lightning is not installed')
+class TestArena(unittest.TestCase):
+
+    def test_arena_result(self):
+        # Wilson score interval of 7 successes in 10 trials
+        result = training.arena_result(np.array([1] * 7 + [-1] * 3), confidence=0.95)
+        self.assertEqual((result.games, result.wins, result.draws, result.losses), (10, 7, 0, 3))
+        self.assertAlmostEqual(result.score, 0.7)
+        self.assertAlmostEqual(result.score_low, 0.3968, places=4)
+        self.assertAlmostEqual(result.score_high, 0.8922, places=4)
+        self.assertAlmostEqual(result.elo, 400 * np.log10(7 / 3))
+        self.assertFalse(result.significant)
+
+        # Draws score 1/2
+        result = training.arena_result(np.array([1, 0, 0, -1]))
+        self.assertEqual((result.wins, result.draws, result.losses, result.score), (1, 2, 1, 0.5))
+
+        result = training.arena_result(np.ones(20))
+        self.assertAlmostEqual(result.score_low, 0.8389, places=4)
+        self.assertEqual(result.score_high, 1)
+        self.assertTrue(result.significant)
+
+        result = training.arena_result(np.zeros(0))
+        self.assertEqual((result.games, result.score, result.score_low, result.score_high), (0, 0.5, 0, 1))
+        self.assertFalse(result.significant)
+
+    def test_arena(self):
+        result = training.arena('heuristic', 'random', 256, 5, komi=0.5, max_moves=50, num_boards=32, seed=0)
+        self.assertTrue(result.significant)
+        self.assertGreater(result.score_low, 0.5)
+        self.assertLess(result.games, 256)
+
+        # Equal policies play every game, the intervals are corrected for the 3 checks after 64, 96 and 128 games
+        result = training.arena('random', 'random', 128, 5, komi=0.5, max_moves=50, num_boards=32, seed=0)
+        self.assertEqual(result.games, 128)
+        results = np.array([1] * result.wins + [0] * result.draws + [-1] * result.losses)
+        expected = training.arena_result(results, confidence=1 - 0.05 / 3)
+        self.assertAlmostEqual(result.score_low, expected.score_low)
+        self.assertAlmostEqual(result.score_high, expected.score_high)
+        self.assertFalse(result.significant)
+
+
+
+@unittest.skipIf(training is None, 'pytorch_lightning is not installed')
+class TestWarmStart(unittest.TestCase):
+
+    def test_random_transitions(self):
+        # Small chunks play a single board, whose games often end on the agent's move
+        for seed in range(10):
+            frames, frame_valid_moves, state_frames, actions, rewards, dones, next_frames, n_steps = \
+                training.random_transitions(125, 3, komi=0.5, max_moves=20, seed=seed)
+            self.assertEqual(len(actions), 125)
+            self.assertEqual(frames.shape, (len(frame_valid_moves), 3 * 3 * 3))
+            self.assertTrue((frame_valid_moves[state_frames, actions]).all())
+            self.assertTrue((n_steps == 1).all())
+            self.assertTrue(set(rewards[~dones]) <= {0})
+            self.assertTrue(dones.any())
+            # Consecutive experiences of a game share their boards
+            self.assertTrue((next_frames[:-1][~dones[:-1]] == state_frames[1:][~dones[:-1]]).all())
+
+    def test_warm_start(self):
+        buffer = training.ReplayBuffer(200, 3 * 5 * 5, 5 * 5 + 1)
+        self.assertEqual(training.warm_start(buffer, 150, 5, komi=0.5, max_moves=30, n_steps=2, seed=0), 150)
+        self.assertEqual(len(buffer), 150)
+        states, actions, _, _, next_states, valid_moves, n_steps, _, _ = buffer.sample(64)
+        self.assertTrue(((states[:, :25] + states[:, 25:50]) <= 1).all())
+        self.assertTrue(set(n_steps) <= {1, 2})
+        self.assertEqual(valid_moves.shape, (64, 26))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,270 @@
+import numpy as np
+
+from gym_go import govars
+
+"""
+Batched rule engine on CPU torch tensors
+
+Works on (B, NUM_CHNLS, SIZE, SIZE) tensors so the environment and the learner can share tensors without
+NumPy round-trips. Neighbour operations are padded shifts and a cross convolution, and groups are labeled
+for the whole batch at once by propagating the largest point id through each group
+(with pointer jumping so it converges in few iterations).
+
+The transitions, legal masks and scores are identical to the ones of `gogame`.
+All functions also accept NumPy arrays, in which case they return NumPy arrays
+(converted without copying through torch.from_numpy), so this module is also a backend of `gym_go.backends`.
+"""
+
+try:
+    import torch
+    import torch.nn.functional as F
+except ImportError:
+    torch = None
+
+available = torch is not None
+
+
+def _to_tensor(x):
+    if isinstance(x, np.ndarray):
+        return torch.from_numpy(np.ascontiguousarray(x)), True
+    return x, False
+
+
+def _neighbors(x, fill):
+    """
+    :param x: (B, SIZE, SIZE) tensor
+    :param fill: value of off-board neighbours
+    :return: (4, B, SIZE, SIZE) values of the up, down, left and right neighbour of every point
+    """
+    padded = F.pad(x.unsqueeze(1), (1, 1, 1, 1), value=fill).squeeze(1)
+    return torch.stack([padded[:, :-2, 1:-1], padded[:, 2:, 1:-1], padded[:, 1:-1, :-2], padded[:, 1:-1, 2:]])
+
+
+_surround_kernel = None
+
+
+def _num_occupied_neighbors(occupied):
+    """
+    Same as convolving with state_utils.surround_struct, counting off-board points as occupied
+    """
+    global _surround_kernel
+    if _surround_kernel is None:
+        _surround_kernel = torch.tensor([[0., 1., 0.], [1., 0., 1.], [0., 1., 0.]]).view(1, 1, 3, 3)
+    padded = F.pad(occupied.unsqueeze(1).float(), (1, 1, 1, 1), value=1)
+    return F.conv2d(padded, _surround_kernel).squeeze(1)
+
+
+def label(pieces):
+    """
+    Labels the 4-connected groups of the whole batch
+    :param pieces: (B, SIZE, SIZE) bool tensor
+    :return: (B, SIZE, SIZE) int64 tensor, 0 for no piece, otherwise a label unique across the batch
+    """
+    ids = torch.arange(1, pieces.numel() + 1).view(pieces.shape)
+    labels = torch.where(pieces, ids, torch.zeros_like(ids))
+    while True:
+        new_labels = torch.maximum(labels, _neighbors(labels, 0).amax(dim=0))
+        # Pointer jumping: take the label of the point we are labeled with
+        new_labels = new_labels.view(-1)[(new_labels - 1).clamp(min=0)]
+        new_labels = torch.where(pieces, new_labels, torch.zeros_like(new_labels))
+        if torch.equal(new_labels, labels):
+            return labels
+        labels = new_labels
+
+
+def liberty_counts(labels, empties):
+    """
+    :param labels: (B, SIZE, SIZE) output of label
+    :param empties: (B, SIZE, SIZE) bool tensor of empty points
+    :return: (B * SIZE * SIZE + 1,) number of distinct empty points adjacent to each label
+    """
+    neighbor_labels = _neighbors(labels, 0) * empties
+    # Only count a group once per empty point
+    unique_labels = neighbor_labels.clone()
+    for k in range(1, 4):
+        for j in range(k):
+            unique_labels[k] = torch.where(neighbor_labels[k] == neighbor_labels[j],
+                                           torch.zeros_like(unique_labels[k]), unique_labels[k])
+    counts = torch.zeros(labels.numel() + 1, dtype=torch.int64)
+    counts.index_add_(0, unique_labels.reshape(-1), torch.ones(unique_labels.numel(), dtype=torch.int64))
+    counts[0] = 0
+    return counts
+
+
+def _compute_invalid_moves(pieces, batch_player, batch_ko):
+    """
+    Same as state_utils.compute_invalid_moves for the OPPONENT of each player
+    :param pieces: (B, 2, SIZE, SIZE) bool tensor
+    :param batch_ko: (B,) 1D ko-protected location, -1 for none
+    :return: (B, SIZE, SIZE) bool tensor
+    """
+    idcs = torch.arange(len(pieces))
+    own_pieces = pieces[idcs, batch_player]
+    opp_pieces = pieces[idcs, 1 - batch_player]
+    occupied = own_pieces | opp_pieces
+    empties = ~occupied
+
+    possible_invalid = torch.zeros_like(occupied)
+    definite_valid = torch.zeros_like(occupied)
+    for group_pieces, multi_libs_invalid in [(own_pieces, True), (opp_pieces, False)]:
+        labels = label(group_pieces)
+        counts = liberty_counts(labels, empties)
+        neighbor_labels = _neighbors(labels, 0)
+        neighbor_libs = counts[neighbor_labels]
+        has_group = neighbor_labels > 0
+        single_lib = (has_group & (neighbor_libs == 1)).any(dim=0)
+        multi_libs = (has_group & (neighbor_libs > 1)).any(dim=0)
+        # Possible invalids are on single liberties of opponent groups and on multi-liberties of own groups
+        # Definite valids are on single liberties of own groups, multi-liberties of opponent groups
+        if multi_libs_invalid:
+            possible_invalid |= multi_libs
+            definite_valid |= single_lib
+        else:
+            possible_invalid |= single_lib
+            definite_valid |= multi_libs
+
+    surrounded = _num_occupied_neighbors(occupied) == 4
+    invalid_moves = occupied | (possible_invalid & ~definite_valid & surrounded & empties)
+
+    # Ko-protection
+    has_ko = batch_ko >= 0
+    invalid_moves.view(len(pieces), -1)[idcs[has_ko], batch_ko[has_ko]] = True
+    return invalid_moves
+
+
+def batch_next_states(batch_states, batch_action1d, canonical=False):
+    """
+    Same as gogame.batch_next_states
+    """
+    batch_states, is_numpy = _to_tensor(batch_states)
+    if not torch.is_tensor(batch_action1d):
+        batch_action1d = torch.as_tensor(np.asarray(batch_action1d))
+    batch_action1d = batch_action1d.long()
+
+    # Deep copy the state to modify
+    batch_states = batch_states.clone()
+    n, num_chnls, m, _ = batch_states.shape
+    idcs = torch.arange(n)
+
+    batch_pass = batch_action1d == m * m
+    batch_non_pass = idcs[~batch_pass]
+    batch_players = batch_states[:, govars.TURN_CHNL, 0, 0].long()
+    batch_prev_passed = batch_states[:, govars.PASS_CHNL, 0, 0] == 1
+
+    # Pass moves
+    batch_states[batch_pass, govars.PASS_CHNL] = 1
+    # Game ended
+    batch_states[batch_pass & batch_prev_passed, govars.DONE_CHNL] = 1
+    # Non-pass moves
+    batch_states[batch_non_pass, govars.PASS_CHNL] = 0
+
+    # Assert all non-pass moves are valid
+    flat_states = batch_states.view(n, num_chnls, -1)
+    non_pass_actions = batch_action1d[batch_non_pass]
+    assert (flat_states[batch_non_pass, govars.INVD_CHNL, non_pass_actions] == 0).all(), \
+        ("Invalid move", non_pass_actions)
+
+    # Add piece
+    flat_states[batch_non_pass, batch_players[batch_non_pass], non_pass_actions] = 1
+
+    pieces = batch_states[:, [govars.BLACK, govars.WHITE]] > 0
+    opp_pieces = pieces[idcs, 1 - batch_players]
+
+    # Check whether the pieces will be surrounded by opponent's pieces
+    action_planes = torch.zeros(n, m * m, dtype=torch.bool)
+    action_planes[batch_non_pass, non_pass_actions] = True
+    adjacent = _neighbors(action_planes.view(n, m, m), False).any(dim=0)
+    batch_surrounded = ~(adjacent & ~opp_pieces).any(dim=2).any(dim=1)
+
+    # Kill adjacent opponent groups without liberties
+    opp_labels = label(opp_pieces)
+    counts = liberty_counts(opp_labels, ~(pieces[:, 0] | pieces[:, 1]))
+    adjacent_labels = torch.zeros(opp_labels.numel() + 1, dtype=torch.bool)
+    adjacent_labels[opp_labels[adjacent]] = True
+    adjacent_labels[0] = False
+    killed = adjacent_labels[opp_labels] & (counts[opp_labels] == 0)
+    pieces[idcs, 1 - batch_players] = opp_pieces & ~killed
+    batch_states[idcs, 1 - batch_players] = pieces[idcs, 1 - batch_players].to(batch_states.dtype)
+
+    # If only killed one group, and that one group was one piece, and piece set is surrounded,
+    # activate ko protection
+    flat_killed = killed.view(n, -1)
+    ko_protect = ~batch_pass & (flat_killed.sum(dim=1) == 1) & batch_surrounded
+    batch_ko = torch.where(ko_protect, flat_killed.long().argmax(dim=1), torch.full((n,), -1, dtype=torch.int64))
+
+    # Update invalid moves
+    batch_states[:, govars.INVD_CHNL] = _compute_invalid_moves(pieces, batch_players, batch_ko).to(batch_states.dtype)
+
+    # Switch turn
+    batch_states[:, govars.TURN_CHNL] = 1 - batch_states[:, govars.TURN_CHNL]
+
+    if canonical:
+        batch_states = batch_canonical_form(batch_states)
+
+    return batch_states.numpy() if is_numpy else batch_states
+
+
+def next_state(state, action1d, canonical=False):
+    """
+    Same as gogame.next_state
+    """
+    batch_states = batch_next_states(state[None], [action1d], canonical)
+    return batch_states[0]
+
+
+def batch_canonical_form(batch_states):
+    """
+    Same as gogame.batch_canonical_form
+    """
+    batch_states, is_numpy = _to_tensor(batch_states)
+    batch_states = batch_states.clone()
+    white = batch_states[:, govars.TURN_CHNL, 0, 0] == govars.WHITE
+    batch_states[white] = batch_states[white][:, [govars.WHITE, govars.BLACK, *range(2, govars.NUM_CHNLS)]]
+    batch_states[white, govars.TURN_CHNL] = 0
+    return batch_states.numpy() if is_numpy else batch_states
+
+
+def batch_valid_moves(batch_states):
+    """
+    Same as gogame.batch_valid_moves
+    :return: (B, SIZE * SIZE + 1) legal mask, the last move is passing
+    """
+    batch_states, is_numpy = _to_tensor(batch_states)
+    n = len(batch_states)
+    invalid_moves = batch_states[:, govars.INVD_CHNL].reshape(n, -1)
+    valid_moves = torch.cat([1 - invalid_moves, torch.ones(n, 1, dtype=invalid_moves.dtype)], dim=1)
+    return valid_moves.numpy() if is_numpy else valid_moves
+
+
+def batch_areas(batch_states):
+    """
+    Same as gogame.batch_areas
+    :return: black areas, white areas
+    """
+    batch_states, is_numpy = _to_tensor(batch_states)
+    black = batch_states[:, govars.BLACK] > 0
+    white = batch_states[:, govars.WHITE] > 0
+    empties = ~(black | white)
+
+    # Empty areas claimed by each player
+    empty_labels = label(empties)
+    claims = []
+    for player_pieces in [black, white]:
+        touching = _neighbors(player_pieces, False).any(dim=0) & empties
+        claimed = torch.zeros(empty_labels.numel() + 1, dtype=torch.int64)
+        claimed.index_add_(0, empty_labels[touching], torch.ones(int(touching.sum()), dtype=torch.int64))
+        claims.append(claimed[empty_labels] > 0)
+    black_claim, white_claim = claims
+
+    black_areas = (black | (empties & black_claim & ~white_claim)).sum(dim=(1, 2))
+    white_areas = (white | (empties & white_claim & ~black_claim)).sum(dim=(1, 2))
+    if is_numpy:
+        return black_areas.numpy(), white_areas.numpy()
+    return black_areas, white_areas
+
+
+def batch_observations(batch_states):
+    """
+    :return: (B, 3 * SIZE * SIZE) view of the black, white and turn channels, the input of the DQN
+    """
+    return batch_states[:, :govars.TURN_CHNL + 1].reshape(len(batch_states), -1)